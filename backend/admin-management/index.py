@@ -1,13 +1,73 @@
 import json
 import os
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool, PoolError
 import bcrypt
 from typing import Dict, Any, Optional
 from datetime import datetime
+from time import monotonic
+
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+DB_STATEMENT_TIMEOUT_MS = 10000
+DB_PING_AFTER_SECONDS = 30
+
+# shared:db_pool — копия tools/shared/db_pool.py, правится там (python tools/sync_shared.py)
+_db_pool = None
+_db_last_used = {}
+
+
+def _db_alive(conn) -> bool:
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def get_db():
+    """Соединение из пула, живущего между тёплыми вызовами функции.
+    Простаивавшее дольше DB_PING_AFTER_SECONDS соединение проверяется и при обрыве пересоздаётся."""
+    global _db_pool
+    dsn = os.environ['DATABASE_URL']
+    options = f'-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}'
+    if _db_pool is None or _db_pool.closed:
+        _db_pool = ThreadedConnectionPool(1, DB_POOL_MAX, dsn, options=options)
+    for _ in range(DB_POOL_MAX + 1):
+        try:
+            conn = _db_pool.getconn()
+        except PoolError:
+            return psycopg2.connect(dsn, options=options)
+        idle = monotonic() - _db_last_used.get(id(conn), monotonic())
+        if not conn.closed and (idle < DB_PING_AFTER_SECONDS or _db_alive(conn)):
+            return conn
+        _db_last_used.pop(id(conn), None)
+        _db_pool.putconn(conn, close=True)
+    return psycopg2.connect(dsn, options=options)
+
+
+def release_db(conn):
+    """Вернуть соединение в пул; незавершённая транзакция откатывается"""
+    broken = conn.closed
+    if not broken:
+        try:
+            conn.rollback()
+            conn.autocommit = False
+        except psycopg2.Error:
+            broken = True
+    if broken:
+        _db_last_used.pop(id(conn), None)
+    else:
+        _db_last_used[id(conn)] = monotonic()
+    try:
+        _db_pool.putconn(conn, close=broken)
+    except (PoolError, AttributeError):
+        conn.close()
+# end shared:db_pool
 
-def get_db_connection():
-    """Создание безопасного подключения к БД"""
-    return psycopg2.connect(os.environ['DATABASE_URL'])
 
 def verify_admin_token(token: str, conn) -> Optional[Dict[str, Any]]:
     """Проверка токена администратора"""
@@ -63,7 +123,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     headers = event.get('headers', {})
     admin_token = headers.get('X-Admin-Token') or headers.get('x-admin-token')
     
-    conn = get_db_connection()
+    conn = get_db()
     
     try:
         admin = verify_admin_token(admin_token, conn)
@@ -326,4 +386,4 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     finally:
-        conn.close()
+        release_db(conn)
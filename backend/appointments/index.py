@@ -1,10 +1,199 @@
+import base64
+import binascii
 import json
 import os
 import logging
+import select
+import threading
+from collections import deque
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.pool import ThreadedConnectionPool, PoolError
+from psycopg2.extras import RealDictCursor, execute_values
 from typing import Dict, Any
+from time import monotonic, sleep
+
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+DB_STATEMENT_TIMEOUT_MS = 5000
+DB_PING_AFTER_SECONDS = 30
+
+# Окно открытия записи (по Москве, например '07:55-08:30'), в котором create ставит заявки в очередь
+BOOKING_SURGE_WINDOW = os.environ.get('BOOKING_SURGE_WINDOW', '')
+BOOKING_QUEUE_BATCH = int(os.environ.get('BOOKING_QUEUE_BATCH', '50'))
+BOOKING_QUEUE_LOCK_ID = 730001
+# Заявка не должна зависеть от того, опрашивает ли её клиент: очередь разбирается и после постановки,
+# и фоновым заданием job-worker; не проведённая за BOOKING_QUEUE_TTL_MINUTES заявка снимается (expired).
+# Срок отдаётся клиенту в expires_in — страница записи ждёт ответа столько же (плюс такт job-worker)
+BOOKING_QUEUE_TTL_MINUTES = 3
+BOOKING_DRAIN_BUDGET = 10
+BOOKING_DRAIN_JOB_PRIORITY = 20
+
+# Список записей врача: допустимые поля для fields= и размер страницы при постраничной выдаче
+APPOINTMENT_LIST_FIELDS = (
+    'id', 'doctor_id', 'patient_name', 'patient_phone', 'patient_snils', 'patient_oms',
+    'appointment_date', 'appointment_time', 'description', 'status', 'created_by',
+    'created_at', 'completed_at', 'updated_at',
+)
+APPOINTMENT_LIST_PAGE = 200
+APPOINTMENT_LIST_MAX = 1000
+
+# changes-since: перекрытие окна на случай транзакций, закоммиченных позже своего updated_at,
+# предел изменений за один ответ и срок хранения отметок удаления
+CHANGES_OVERLAP_SECONDS = 5
+CHANGES_MAX = 1000
+DELETIONS_RETENTION_DAYS = 7
+
+# slot-updates: канал уведомлений об изменении занятости дня и предел ожидания long-poll.
+# LISTEN держит одно выделенное соединение экземпляра, а не соединение из пула на каждого ждущего:
+# ждущий берёт соединение пула только на перечитывание изменений. Ждущих на экземпляр не больше
+# SLOT_WAITERS_MAX, остальным сразу отдаётся текущее состояние
+SLOT_CHANNEL = 'slot_changes'
+SLOT_WAIT_DEFAULT = 20
+SLOT_WAIT_MAX = 25
+SLOT_WAITERS_MAX = int(os.environ.get('SLOT_WAITERS_MAX', str(max(1, DB_POOL_MAX // 2))))
+SLOT_EVENTS_KEPT = 1000
+SLOT_LISTEN_RECONNECT_SECONDS = 1
+
+# shared:db_pool — копия tools/shared/db_pool.py, правится там (python tools/sync_shared.py)
+_db_pool = None
+_db_last_used = {}
+
+
+def _db_alive(conn) -> bool:
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def get_db():
+    """Соединение из пула, живущего между тёплыми вызовами функции.
+    Простаивавшее дольше DB_PING_AFTER_SECONDS соединение проверяется и при обрыве пересоздаётся."""
+    global _db_pool
+    dsn = os.environ['DATABASE_URL']
+    options = f'-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}'
+    if _db_pool is None or _db_pool.closed:
+        _db_pool = ThreadedConnectionPool(1, DB_POOL_MAX, dsn, options=options)
+    for _ in range(DB_POOL_MAX + 1):
+        try:
+            conn = _db_pool.getconn()
+        except PoolError:
+            return psycopg2.connect(dsn, options=options)
+        idle = monotonic() - _db_last_used.get(id(conn), monotonic())
+        if not conn.closed and (idle < DB_PING_AFTER_SECONDS or _db_alive(conn)):
+            return conn
+        _db_last_used.pop(id(conn), None)
+        _db_pool.putconn(conn, close=True)
+    return psycopg2.connect(dsn, options=options)
+
+
+def release_db(conn):
+    """Вернуть соединение в пул; незавершённая транзакция откатывается"""
+    broken = conn.closed
+    if not broken:
+        try:
+            conn.rollback()
+            conn.autocommit = False
+        except psycopg2.Error:
+            broken = True
+    if broken:
+        _db_last_used.pop(id(conn), None)
+    else:
+        _db_last_used[id(conn)] = monotonic()
+    try:
+        _db_pool.putconn(conn, close=broken)
+    except (PoolError, AttributeError):
+        conn.close()
+# end shared:db_pool
+
+
+class LocalSlotBroker:
+    """Брокер уведомлений внутри процесса вместо LISTEN/NOTIFY (SLOT_BROKER=local, для локальных тестов).
+    Ждущий просыпается на каждую публикацию и сам перечитывает изменения из doctor_day_slots.
+    События нумеруются: ждущий запоминает position() до проверки и не пропускает публикации после неё."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._events = deque(maxlen=SLOT_EVENTS_KEPT)
+
+    def publish(self, doctor_id, slot_date):
+        with self._cond:
+            self._seq += 1
+            self._events.append((self._seq, str(doctor_id), str(slot_date)))
+            self._cond.notify_all()
+
+    def position(self):
+        with self._cond:
+            return self._seq
+
+    def wait(self, timeout, seen):
+        """(события после seen, новая позиция); события None — часть вытеснена, нужно перечитать всё"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > seen, timeout)
+            if self._events and self._events[0][0] > seen + 1:
+                return None, self._seq
+            return [(d, day) for n, d, day in self._events if n > seen], self._seq
+
+
+class PgSlotListener(LocalSlotBroker):
+    """Одно выделенное (не из пула) соединение экземпляра с LISTEN SLOT_CHANNEL.
+    Фоновый поток раздаёт уведомления всем ждущим slot-updates, как LocalSlotBroker."""
+
+    def __init__(self):
+        super().__init__()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._ready = threading.Event()
+
+    def start(self, timeout):
+        """Запустить поток при первом ждущем; False — подписка пока не готова"""
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._ready.clear()
+                self._thread = threading.Thread(target=self._run, name='slot-listener', daemon=True)
+                self._thread.start()
+        return self._ready.wait(timeout)
+
+    def _run(self):
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(os.environ['DATABASE_URL'])
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {SLOT_CHANNEL}")
+                self._ready.set()
+                while True:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        continue
+                    conn.poll()
+                    for n in conn.notifies:
+                        doctor_id, _, slot_date = n.payload.partition(':')
+                        self.publish(doctor_id, slot_date)
+                    conn.notifies.clear()
+            except (psycopg2.Error, OSError) as e:
+                logging.warning('slot listener: %s', e)
+                self._ready.clear()
+                # Уведомления за время переподключения потеряны — ждущие перечитают изменения
+                self.publish('', '')
+            finally:
+                if conn is not None and not conn.closed:
+                    conn.close()
+            sleep(SLOT_LISTEN_RECONNECT_SECONDS)
+
+
+_slot_broker = LocalSlotBroker() if os.environ.get('SLOT_BROKER') == 'local' else None
+_slot_listener = PgSlotListener()
+_slot_waiters = 0
+_slot_waiters_lock = threading.Lock()
+
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
@@ -35,7 +224,11 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
-    conn = psycopg2.connect(database_url)
+    if method == 'GET' and (event.get('queryStringParameters') or {}).get('action') == 'slot-updates':
+        # Long-poll берёт соединение пула только на время запросов, а не на всё ожидание
+        return slot_updates_response(event.get('queryStringParameters') or {})
+    
+    conn = get_db()
     
     try:
         if method == 'GET':
@@ -45,7 +238,6 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             if action == 'server-time':
                 tz_moscow = timezone(timedelta(hours=3))
                 now_moscow = datetime.now(tz=tz_moscow)
-                conn.close()
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -66,201 +258,154 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     }
                 
                 cursor = conn.cursor(cursor_factory=RealDictCursor)
+                plans = fetch_day_plans(cursor, doctor_id, date, date)
+                cursor.close()
                 
-                cursor.execute("""
-                    SELECT is_working FROM t_p30358746_hospital_website_red.doctor_calendar 
-                    WHERE doctor_id = %s AND calendar_date = %s
-                """, (doctor_id, date))
-                calendar_entry = cursor.fetchone()
+                available_slots = free_slots_for_day(plans[0])[0] if plans else []
                 
-                if calendar_entry and not calendar_entry['is_working']:
-                    cursor.close()
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'available_slots': available_slots}),
+                    'isBase64Encoded': False
+                }
+            
+            elif action == 'available-slots-bulk':
+                doctor_id = params.get('doctor_id')
+                start_date = params.get('start_date')
+                end_date = params.get('end_date')
+                
+                if not doctor_id or not start_date or not end_date:
                     return {
-                        'statusCode': 200,
+                        'statusCode': 400,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'available_slots': []}),
+                        'body': json.dumps({'error': 'Missing parameters'}),
                         'isBase64Encoded': False
                     }
                 
-                day_of_week = datetime.strptime(date, '%Y-%m-%d').weekday()
-                day_of_week = (day_of_week + 1) % 7
-                
-                cursor.execute("""
-                    SELECT * FROM t_p30358746_hospital_website_red.daily_schedules 
-                    WHERE doctor_id = %s AND schedule_date = %s AND is_active = TRUE
-                """, (doctor_id, date))
-                daily_schedule = cursor.fetchone()
+                cursor = conn.cursor(cursor_factory=RealDictCursor)
+                plans = fetch_day_plans(cursor, doctor_id, start_date, end_date)
+                cursor.close()
                 
-                if not daily_schedule:
-                    cursor.execute("""
-                        SELECT * FROM t_p30358746_hospital_website_red.doctor_schedules 
-                        WHERE doctor_id = %s AND day_of_week = %s AND is_active = TRUE
-                    """, (doctor_id, day_of_week))
-                    schedule = cursor.fetchone()
-                else:
-                    schedule = daily_schedule
+                slots_by_date = {}
+                for plan in plans:
+                    date_str = str(plan['day'])
+                    if plan['is_working'] is False:
+                        slots_by_date[date_str] = {'available_slots': [], 'booked_slots': 0, 'hasSchedule': False}
+                        continue
+                    available_slots, has_schedule = free_slots_for_day(plan)
+                    slots_by_date[date_str] = {
+                        'available_slots': available_slots,
+                        'booked_slots': len(plan['booked']) if has_schedule else 0
+                    }
                 
-                if not schedule:
-                    cursor.close()
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'slots_by_date': slots_by_date}),
+                    'isBase64Encoded': False
+                }
+            
+            elif action == 'clinic-availability':
+                tz_moscow = timezone(timedelta(hours=3))
+                start_date = params.get('start_date') or datetime.now(tz=tz_moscow).strftime('%Y-%m-%d')
+                try:
+                    datetime.strptime(start_date, '%Y-%m-%d')
+                    days = max(1, min(int(params.get('days', '14')), 14))
+                    limit = max(0, min(int(params.get('limit', '3')), 20))
+                except ValueError:
                     return {
-                        'statusCode': 200,
+                        'statusCode': 400,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'available_slots': []}),
+                        'body': json.dumps({'error': 'Invalid start_date, days or limit'}),
                         'isBase64Encoded': False
                     }
                 
-                cursor.execute("""
-                    SELECT appointment_time FROM t_p30358746_hospital_website_red.appointments_v2 
-                    WHERE doctor_id = %s AND appointment_date = %s AND status IN ('scheduled', 'completed')
-                """, (doctor_id, date))
-                booked_appointments = cursor.fetchall()
-                booked_times = [str(appt['appointment_time'])[:5] for appt in booked_appointments]
-                
-                start_time_str = str(schedule['start_time']) if schedule['start_time'] else '09:00:00'
-                end_time_str = str(schedule['end_time']) if schedule['end_time'] else '18:00:00'
-                start_time = datetime.strptime(start_time_str, '%H:%M:%S')
-                end_time = datetime.strptime(end_time_str, '%H:%M:%S')
-                slot_duration = schedule.get('slot_duration', 15)
-                
-                break_start = schedule.get('break_start_time')
-                break_end = schedule.get('break_end_time')
-                break_start_time = datetime.strptime(str(break_start), '%H:%M:%S') if break_start else None
-                break_end_time = datetime.strptime(str(break_end), '%H:%M:%S') if break_end else None
-                
-                available_slots = []
-                current_time = start_time
-                
-                while current_time < end_time:
-                    if break_start_time and break_end_time:
-                        if break_start_time <= current_time < break_end_time:
-                            current_time += timedelta(minutes=slot_duration)
-                            continue
-                    
-                    time_str = current_time.strftime('%H:%M')
-                    if time_str not in booked_times:
-                        available_slots.append(time_str)
-                    
-                    current_time += timedelta(minutes=slot_duration)
-                
+                cursor = conn.cursor(cursor_factory=RealDictCursor)
+                cursor.execute(CLINIC_DAY_PLANS_QUERY, {
+                    'start_date': start_date,
+                    'days': days,
+                    'clinic': params.get('clinic') or None,
+                    'specialization': params.get('specialization') or None,
+                })
+                plans = cursor.fetchall()
                 cursor.close()
+                
+                doctors = {}
+                for plan in plans:
+                    doctor = doctors.get(plan['doctor_id'])
+                    if doctor is None:
+                        doctor = doctors[plan['doctor_id']] = {
+                            'doctor_id': plan['doctor_id'],
+                            'full_name': plan['full_name'],
+                            'specialization': plan['specialization'],
+                            'clinic': plan['clinic'],
+                            'first_slots': [],
+                            'free_by_date': {}
+                        }
+                    date_str = str(plan['day'])
+                    available_slots = free_slots_for_day(plan)[0]
+                    doctor['free_by_date'][date_str] = len(available_slots)
+                    for slot in available_slots[:limit - len(doctor['first_slots'])]:
+                        doctor['first_slots'].append({'date': date_str, 'time': slot})
+                
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'available_slots': available_slots}),
+                    'body': json.dumps({'start_date': start_date, 'days': days, 'doctors': list(doctors.values())}),
                     'isBase64Encoded': False
                 }
             
-            elif action == 'available-slots-bulk':
-                doctor_id = params.get('doctor_id')
-                start_date = params.get('start_date')
-                end_date = params.get('end_date')
-                
-                if not doctor_id or not start_date or not end_date:
+            elif action == 'booking-status':
+                # Только чтение: заявки проводит и снимает по сроку задание booking_drain (drain-queue),
+                # иначе опрос ждущих клиентов сам становился бы нагрузкой на запись в час наплыва
+                try:
+                    ticket = int(params.get('ticket', ''))
+                except ValueError:
                     return {
                         'statusCode': 400,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Missing parameters'}),
+                        'body': json.dumps({'error': 'Missing ticket'}),
                         'isBase64Encoded': False
                     }
                 
                 cursor = conn.cursor(cursor_factory=RealDictCursor)
-                
-                cursor.execute("""
-                    SELECT * FROM t_p30358746_hospital_website_red.doctor_schedules 
-                    WHERE doctor_id = %s AND is_active = TRUE
-                """, (doctor_id,))
-                schedules = {s['day_of_week']: s for s in cursor.fetchall()}
-                
-                cursor.execute("""
-                    SELECT * FROM t_p30358746_hospital_website_red.daily_schedules 
-                    WHERE doctor_id = %s AND schedule_date BETWEEN %s AND %s AND is_active = TRUE
-                """, (doctor_id, start_date, end_date))
-                daily_schedules = {str(ds['schedule_date']): ds for ds in cursor.fetchall()}
-                
-                cursor.execute("""
-                    SELECT calendar_date, is_working FROM t_p30358746_hospital_website_red.doctor_calendar 
-                    WHERE doctor_id = %s AND calendar_date BETWEEN %s AND %s
-                """, (doctor_id, start_date, end_date))
-                calendar_data = {str(cal['calendar_date']): cal['is_working'] for cal in cursor.fetchall()}
-                
                 cursor.execute("""
-                    SELECT appointment_date, appointment_time FROM t_p30358746_hospital_website_red.appointments_v2 
-                    WHERE doctor_id = %s AND appointment_date BETWEEN %s AND %s 
-                    AND status IN ('scheduled', 'completed')
-                """, (doctor_id, start_date, end_date))
-                all_appointments = cursor.fetchall()
-                
-                booked_by_date = {}
-                for appt in all_appointments:
-                    date = str(appt['appointment_date']) if appt['appointment_date'] else None
-                    if date and date not in booked_by_date:
-                        booked_by_date[date] = []
-                    if date:
-                        booked_by_date[date].append(str(appt['appointment_time'])[:5])
-                
-                current_date = datetime.strptime(start_date, '%Y-%m-%d')
-                end_date_obj = datetime.strptime(end_date, '%Y-%m-%d')
+                    SELECT q.status, q.appointment_id, q.appointment_time, a.created_at,
+                           (SELECT COUNT(*) FROM t_p30358746_hospital_website_red.booking_queue p
+                            WHERE p.status = 'pending' AND p.id < q.id) + 1 AS position
+                    FROM t_p30358746_hospital_website_red.booking_queue q
+                    LEFT JOIN t_p30358746_hospital_website_red.appointments_v2 a ON a.id = q.appointment_id
+                    WHERE q.id = %s
+                """, (ticket,))
+                row = cursor.fetchone()
+                cursor.close()
                 
-                slots_by_date = {}
+                if not row:
+                    return {
+                        'statusCode': 404,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Ticket not found'}),
+                        'isBase64Encoded': False
+                    }
                 
-                while current_date <= end_date_obj:
-                    date_str = current_date.strftime('%Y-%m-%d')
-                    day_of_week = (current_date.weekday() + 1) % 7
-                    
-                    if date_str in calendar_data and not calendar_data[date_str]:
-                        slots_by_date[date_str] = {'available_slots': [], 'booked_slots': 0, 'hasSchedule': False}
-                        current_date += timedelta(days=1)
-                        continue
-                    
-                    schedule = daily_schedules.get(date_str) or schedules.get(day_of_week)
-                    
-                    if schedule:
-                        booked_times = list(set(booked_by_date.get(date_str, [])))
-                        
-                        start_time_str = str(schedule['start_time']) if schedule['start_time'] else '09:00:00'
-                        end_time_str = str(schedule['end_time']) if schedule['end_time'] else '18:00:00'
-                        start_time = datetime.strptime(start_time_str, '%H:%M:%S')
-                        end_time = datetime.strptime(end_time_str, '%H:%M:%S')
-                        slot_duration = schedule.get('slot_duration', 15)
-                        
-                        break_start = schedule.get('break_start_time')
-                        break_end = schedule.get('break_end_time')
-                        break_start_time = datetime.strptime(str(break_start), '%H:%M:%S') if break_start else None
-                        break_end_time = datetime.strptime(str(break_end), '%H:%M:%S') if break_end else None
-                        
-                        available_slots = []
-                        current_time = start_time
-                        
-                        while current_time < end_time:
-                            if break_start_time and break_end_time:
-                                if break_start_time <= current_time < break_end_time:
-                                    current_time += timedelta(minutes=slot_duration)
-                                    continue
-                            
-                            time_str = current_time.strftime('%H:%M')
-                            if time_str not in booked_times:
-                                available_slots.append(time_str)
-                            
-                            current_time += timedelta(minutes=slot_duration)
-                        
-                        unique_booked = list(set(booked_times))
-                        slots_by_date[date_str] = {
-                            'available_slots': available_slots,
-                            'booked_slots': len(unique_booked)
-                        }
-                    else:
-                        slots_by_date[date_str] = {
-                            'available_slots': [],
-                            'booked_slots': 0
-                        }
-                    
-                    current_date += timedelta(days=1)
+                if row['status'] == 'booked':
+                    result = {
+                        'status': 'booked',
+                        'success': True,
+                        'appointment': {'id': row['appointment_id'], 'created_at': str(row['created_at'])}
+                    }
+                elif row['status'] == 'rejected':
+                    result = {'status': 'rejected', 'error': f"Слот {str(row['appointment_time'])[:5]} уже занят"}
+                elif row['status'] == 'expired':
+                    result = {'status': 'expired', 'error': 'Заявка не была обработана вовремя, попробуйте записаться ещё раз'}
+                else:
+                    result = {'status': 'pending', 'position': row['position']}
                 
-                cursor.close()
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'slots_by_date': slots_by_date}),
+                    'body': json.dumps(result),
                     'isBase64Encoded': False
                 }
             
@@ -326,8 +471,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 
                 cursor = conn.cursor(cursor_factory=RealDictCursor)
                 
-                # Нормализуем номер: убираем +, пробелы, скобки, дефисы
-                phone_clean = phone.replace('+', '').replace(' ', '').replace('-', '').replace('(', '').replace(')', '')
+                # Поиск по индексу idx_appointments_v2_phone_norm: последние 10 цифр номера
+                phone_norm = normalize_phone(phone)
                 
                 cursor.execute("""
                     SELECT 
@@ -346,9 +491,9 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         d.specialization as doctor_specialization
                     FROM t_p30358746_hospital_website_red.appointments_v2 a
                     LEFT JOIN t_p30358746_hospital_website_red.doctors d ON d.id = a.doctor_id
-                    WHERE REGEXP_REPLACE(a.patient_phone, '[^0-9]', '', 'g') LIKE '%%' || RIGHT(REGEXP_REPLACE(%s, '[^0-9]', '', 'g'), 10) || '%%'
+                    WHERE a.patient_phone_norm = %s
                     ORDER BY a.appointment_date DESC, a.appointment_time DESC
-                """, (phone_clean,))
+                """, (phone_norm,))
                 
                 appointments = cursor.fetchall()
                 cursor.close()
@@ -387,11 +532,99 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False
                 }
             
+            elif action == 'changes-since':
+                doctor_id = params.get('doctor_id')
+                since = params.get('since')
+                start_date = params.get('start_date')
+                end_date = params.get('end_date')
+                
+                try:
+                    since_ts = parse_since(conn, since) if since else None
+                except ValueError:
+                    since_ts = None
+                if since_ts is None:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Missing or invalid since'}),
+                        'isBase64Encoded': False
+                    }
+                
+                cursor = conn.cursor(cursor_factory=RealDictCursor)
+                cursor.execute("SELECT LOCALTIMESTAMP AS now")
+                now = cursor.fetchone()['now']
+                
+                # Отметки удаления хранятся ограниченное время: более старый курсор требует полной перезагрузки
+                if since_ts < now - timedelta(days=DELETIONS_RETENTION_DAYS):
+                    cursor.close()
+                    return {
+                        'statusCode': 200,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'reset': True, 'cursor': now.isoformat()}),
+                        'isBase64Encoded': False
+                    }
+                
+                window_start = since_ts - timedelta(seconds=CHANGES_OVERLAP_SECONDS)
+                filters = ""
+                filter_params = []
+                if doctor_id:
+                    filters += " AND doctor_id = %s"
+                    filter_params.append(doctor_id)
+                if start_date:
+                    filters += " AND appointment_date >= %s"
+                    filter_params.append(start_date)
+                if end_date:
+                    filters += " AND appointment_date <= %s"
+                    filter_params.append(end_date)
+                
+                cursor.execute(f"""
+                    SELECT {', '.join(APPOINTMENT_LIST_FIELDS)}
+                    FROM t_p30358746_hospital_website_red.appointments_v2
+                    WHERE updated_at > %s{filters}
+                    ORDER BY updated_at, id
+                    LIMIT %s
+                """, (window_start, *filter_params, CHANGES_MAX + 1))
+                changes = cursor.fetchall()
+                
+                cursor.execute(f"""
+                    SELECT appointment_id
+                    FROM t_p30358746_hospital_website_red.appointment_deletions
+                    WHERE deleted_at > %s{filters}
+                """, (window_start, *filter_params))
+                deleted = [r['appointment_id'] for r in cursor.fetchall()]
+                cursor.close()
+                
+                # Слишком много изменений — дешевле перечитать список целиком
+                if len(changes) > CHANGES_MAX:
+                    return {
+                        'statusCode': 200,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'reset': True, 'cursor': now.isoformat()}),
+                        'isBase64Encoded': False
+                    }
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({
+                        'changes': changes,
+                        'deleted': deleted,
+                        'cursor': now.isoformat(),
+                    }, default=str, ensure_ascii=False, separators=(',', ':')),
+                    'isBase64Encoded': False
+                }
+            
             elif action == 'logs':
                 doctor_id = params.get('doctor_id')
-                limit = int(params.get('limit', '500'))
-                if limit > 2000:
-                    limit = 2000
+                try:
+                    limit = min(max(int(params.get('limit', '500')), 1), 2000)
+                except ValueError:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Invalid limit'}),
+                        'isBase64Encoded': False
+                    }
                 
                 cursor = conn.cursor(cursor_factory=RealDictCursor)
                 
@@ -438,9 +671,38 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'isBase64Encoded': False
                     }
                 
-                cursor = conn.cursor(cursor_factory=RealDictCursor)
+                fields = [f.strip() for f in params.get('fields', '').split(',') if f.strip()]
+                unknown = [f for f in fields if f not in APPOINTMENT_LIST_FIELDS]
+                if unknown:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': f'Unknown fields: {", ".join(unknown)}'}),
+                        'isBase64Encoded': False
+                    }
+                columns = fields or list(APPOINTMENT_LIST_FIELDS)
+                if 'id' not in columns:
+                    columns.insert(0, 'id')
+                # Ключ сортировки нужен для курсора следующей страницы, даже если его не просили
+                select_columns = columns + [c for c in ('appointment_date', 'appointment_time') if c not in columns]
+                
+                paginated = 'limit' in params or 'cursor' in params
+                limit = None
+                if paginated:
+                    try:
+                        limit = min(max(int(params.get('limit', APPOINTMENT_LIST_PAGE)), 1), APPOINTMENT_LIST_MAX)
+                        after = decode_list_cursor(params['cursor']) if params.get('cursor') else None
+                    except ValueError:
+                        return {
+                            'statusCode': 400,
+                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                            'body': json.dumps({'error': 'Invalid limit or cursor'}),
+                            'isBase64Encoded': False
+                        }
                 
-                query = "SELECT * FROM t_p30358746_hospital_website_red.appointments_v2 WHERE doctor_id = %s"
+                cursor = conn.cursor()
+                
+                query = f"SELECT {', '.join(select_columns)} FROM t_p30358746_hospital_website_red.appointments_v2 WHERE doctor_id = %s"
                 query_params = [doctor_id]
                 
                 if start_date:
@@ -451,16 +713,42 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     query += " AND appointment_date <= %s"
                     query_params.append(end_date)
                 
-                query += " ORDER BY appointment_date, appointment_time"
+                if paginated and after:
+                    query += " AND (appointment_date, appointment_time, id) > (%s, %s, %s)"
+                    query_params.extend(after)
+                
+                # Порядок совпадает с индексом idx_appointments_v2_doctor_keyset
+                query += " ORDER BY appointment_date, appointment_time, id"
+                
+                if paginated:
+                    # Лишняя строка показывает, есть ли следующая страница
+                    query += " LIMIT %s"
+                    query_params.append(limit + 1)
                 
                 cursor.execute(query, tuple(query_params))
-                appointments = cursor.fetchall()
+                rows = cursor.fetchall()
                 cursor.close()
                 
+                next_cursor = None
+                if paginated and len(rows) > limit:
+                    rows = rows[:limit]
+                    last = dict(zip(select_columns, rows[-1]))
+                    next_cursor = encode_list_cursor(last['appointment_date'], last['appointment_time'], last['id'])
+                
+                rows = [[str(v) if v is not None and not isinstance(v, (int, float, str, bool)) else v for v in row[:len(columns)]]
+                        for row in rows]
+                
+                if params.get('format') == 'rows':
+                    payload = {'columns': columns, 'rows': rows}
+                else:
+                    payload = {'appointments': [dict(zip(columns, row)) for row in rows]}
+                if paginated:
+                    payload['next_cursor'] = next_cursor
+                
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'appointments': appointments}, default=str),
+                    'body': json.dumps(payload, ensure_ascii=False, separators=(',', ':')),
                     'isBase64Encoded': False
                 }
         
@@ -468,7 +756,33 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             body = json.loads(event.get('body', '{}'))
             action = body.get('action', 'create')
             
-            if action == 'log':
+            if action == 'drain-queue':
+                # Вызов из job-worker: разобрать очередь наплыва в пределах BOOKING_DRAIN_BUDGET
+                expired = expire_booking_queue(conn)
+                deadline = monotonic() + BOOKING_DRAIN_BUDGET
+                drained = 0
+                while monotonic() < deadline:
+                    processed = drain_booking_queue(conn)
+                    drained += processed
+                    if processed < BOOKING_QUEUE_BATCH:
+                        break
+                pending = booking_queue_pending(conn)
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({
+                        'success': True,
+                        'status': 'running' if pending else 'done',
+                        'drained': drained,
+                        'expired': expired,
+                        'pending': pending,
+                        'retry_after': 1 if pending else 0,
+                    }),
+                    'isBase64Encoded': False
+                }
+            
+            elif action == 'log':
                 doctor_id = body.get('doctor_id')
                 user_login = body.get('user_login')
                 action_type = body.get('action_type')
@@ -508,7 +822,6 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 appointment_time = body.get('appointment_time')
                 description = body.get('description', '')
                 created_by = body.get('created_by', 1)
-                skip_slot_check = body.get('skip_slot_check', False)
                 
                 if not all([doctor_id, patient_name, patient_phone, appointment_date, appointment_time]):
                     return {
@@ -547,35 +860,66 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'isBase64Encoded': False
                     }
                 
-                cursor = conn.cursor(cursor_factory=RealDictCursor)
-                
-                if not skip_slot_check:
+                if body.get('accept_queue') and surge_mode_active(datetime.now(tz=tz_moscow)):
+                    cursor = conn.cursor(cursor_factory=RealDictCursor)
                     cursor.execute("""
-                        SELECT * FROM t_p30358746_hospital_website_red.appointments_v2 
-                        WHERE doctor_id = %s AND appointment_date = %s AND appointment_time = %s 
-                        AND status IN ('scheduled', 'completed')
-                    """, (doctor_id, appointment_date, appointment_time))
-                    existing = cursor.fetchone()
+                        WITH ticket AS (
+                            INSERT INTO t_p30358746_hospital_website_red.booking_queue
+                            (doctor_id, patient_name, patient_phone, patient_snils, patient_oms,
+                             appointment_date, appointment_time, description, created_by)
+                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                            RETURNING id
+                        )
+                        SELECT ticket.id, (
+                            SELECT COUNT(*) FROM t_p30358746_hospital_website_red.booking_queue
+                            WHERE status = 'pending' AND id < ticket.id
+                        ) + 1 AS position
+                        FROM ticket
+                    """, (doctor_id, patient_name, patient_phone, patient_snils, patient_oms,
+                          appointment_date, appointment_time, description, created_by))
+                    ticket = cursor.fetchone()
+                    enqueue_booking_drain(cursor)
+                    conn.commit()
+                    cursor.close()
+                    drain_booking_queue(conn)
                     
-                    if existing:
-                        cursor.close()
-                        return {
-                            'statusCode': 400,
-                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                            'body': json.dumps({'error': f'Слот {appointment_time[:5]} уже занят'}),
-                            'isBase64Encoded': False
-                        }
+                    return {
+                        'statusCode': 202,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({
+                            'queued': True,
+                            'ticket': ticket['id'],
+                            'position': ticket['position'],
+                            'expires_in': BOOKING_QUEUE_TTL_MINUTES * 60,
+                        }),
+                        'isBase64Encoded': False
+                    }
+                
+                cursor = conn.cursor(cursor_factory=RealDictCursor)
                 
+                # Занятость слота проверяет уникальный индекс idx_appointments_v2_unique:
+                # при конфликте строка не вставляется, и гонка двух пациентов не превращается в 500
                 cursor.execute("""
                     INSERT INTO t_p30358746_hospital_website_red.appointments_v2 
-                    (doctor_id, patient_name, patient_phone, patient_snils, patient_oms, 
+                    (doctor_id, patient_name, patient_phone, patient_phone_norm, patient_snils, patient_oms, 
                      appointment_date, appointment_time, description, status, created_by) 
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, 'scheduled', %s)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, 'scheduled', %s)
+                    ON CONFLICT (doctor_id, appointment_date, appointment_time) WHERE status != 'cancelled'
+                    DO NOTHING
                     RETURNING id, created_at
-                """, (doctor_id, patient_name, patient_phone, patient_snils, patient_oms, 
+                """, (doctor_id, patient_name, patient_phone, normalize_phone(patient_phone), patient_snils, patient_oms, 
                       appointment_date, appointment_time, description, created_by))
                 
                 result = cursor.fetchone()
+                if not result:
+                    cursor.close()
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': f'Слот {appointment_time[:5]} уже занят'}),
+                        'isBase64Encoded': False
+                    }
+                sync_day_slots(cursor, doctor_id, appointment_date)
 
                 source_map = {1: 'self', 2: 'doctor', 3: 'registrar'}
                 registry_source = source_map.get(created_by, 'self')
@@ -613,6 +957,17 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             
             update_fields = []
             update_values = []
+            slot_days = set()
+            appt = None
+            
+            if 'status' in body or ('appointment_date' in body and 'appointment_time' in body):
+                cursor.execute("""
+                    SELECT doctor_id, appointment_date FROM t_p30358746_hospital_website_red.appointments_v2 
+                    WHERE id = %s
+                """, (appointment_id,))
+                appt = cursor.fetchone()
+                if appt:
+                    slot_days.add((appt['doctor_id'], str(appt['appointment_date'])))
             
             if 'status' in body:
                 update_fields.append('status = %s')
@@ -630,13 +985,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 new_date = body['appointment_date']
                 new_time = body['appointment_time']
                 
-                cursor.execute("""
-                    SELECT doctor_id FROM t_p30358746_hospital_website_red.appointments_v2 
-                    WHERE id = %s
-                """, (appointment_id,))
-                appt = cursor.fetchone()
-                
                 if appt:
+                    slot_days.add((appt['doctor_id'], new_date))
                     cursor.execute("""
                         SELECT * FROM t_p30358746_hospital_website_red.appointments_v2 
                         WHERE doctor_id = %s AND appointment_date = %s AND appointment_time = %s 
@@ -665,6 +1015,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             if 'patient_phone' in body:
                 update_fields.append('patient_phone = %s')
                 update_values.append(body['patient_phone'])
+                update_fields.append('patient_phone_norm = %s')
+                update_values.append(normalize_phone(body['patient_phone']))
             
             if 'patient_snils' in body:
                 update_fields.append('patient_snils = %s')
@@ -683,10 +1035,13 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False
                 }
             
+            update_fields.append('updated_at = CURRENT_TIMESTAMP')
             update_values.append(appointment_id)
             query = f"UPDATE t_p30358746_hospital_website_red.appointments_v2 SET {', '.join(update_fields)} WHERE id = %s"
             
             cursor.execute(query, tuple(update_values))
+            for slot_doctor_id, slot_date in sorted(slot_days):
+                sync_day_slots(cursor, slot_doctor_id, slot_date)
             conn.commit()
             cursor.close()
             
@@ -710,7 +1065,25 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 }
             
             cursor = conn.cursor(cursor_factory=RealDictCursor)
-            cursor.execute("DELETE FROM t_p30358746_hospital_website_red.appointments_v2 WHERE id = %s", (appointment_id,))
+            cursor.execute("""
+                WITH removed AS (
+                    DELETE FROM t_p30358746_hospital_website_red.appointments_v2
+                    WHERE id = %s
+                    RETURNING id, doctor_id, appointment_date
+                ), tombstone AS (
+                    INSERT INTO t_p30358746_hospital_website_red.appointment_deletions (appointment_id, doctor_id, appointment_date)
+                    SELECT id, doctor_id, appointment_date FROM removed
+                    ON CONFLICT (appointment_id) DO UPDATE SET deleted_at = CURRENT_TIMESTAMP
+                )
+                SELECT doctor_id, appointment_date FROM removed
+            """, (appointment_id,))
+            deleted = cursor.fetchone()
+            cursor.execute(
+                "DELETE FROM t_p30358746_hospital_website_red.appointment_deletions WHERE deleted_at < NOW() - %s * INTERVAL '1 day'",
+                (DELETIONS_RETENTION_DAYS,)
+            )
+            if deleted:
+                sync_day_slots(cursor, deleted['doctor_id'], deleted['appointment_date'])
             conn.commit()
             cursor.close()
             
@@ -730,7 +1103,48 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             }
     
     finally:
-        conn.close()
+        release_db(conn)
+
+
+def encode_list_cursor(appointment_date, appointment_time, appointment_id):
+    """Курсор следующей страницы — ключ сортировки последней отданной строки"""
+    raw = f'{appointment_date}|{appointment_time}|{appointment_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_list_cursor(value):
+    """(дата, время, id) из курсора; ValueError, если курсор испорчен"""
+    try:
+        raw = base64.urlsafe_b64decode(value + '=' * (-len(value) % 4)).decode()
+        date_part, time_part, id_part = raw.split('|')
+        return (
+            datetime.strptime(date_part, '%Y-%m-%d').date(),
+            datetime.strptime(time_part[:8], '%H:%M:%S').time(),
+            int(id_part),
+        )
+    except (ValueError, UnicodeDecodeError, binascii.Error) as e:
+        raise ValueError('invalid cursor') from e
+
+
+def parse_since(conn, value):
+    """Курсор since как наивное время БД (в нём ведутся updated_at и LOCALTIMESTAMP).
+    Значение со смещением приводится к часовому поясу сессии БД; ValueError, если это не ISO-время."""
+    since_ts = datetime.fromisoformat(value)
+    if since_ts.tzinfo is None:
+        return since_ts
+    cursor = conn.cursor()
+    cursor.execute("SELECT %s::timestamptz AT TIME ZONE current_setting('TimeZone')", (since_ts,))
+    since_ts = cursor.fetchone()[0]
+    cursor.close()
+    return since_ts
+
+
+# shared:phone — копия tools/shared/phone.py, правится там (python tools/sync_shared.py)
+def normalize_phone(phone):
+    """Последние 10 цифр номера — значение patient_phone_norm, по которому ищутся записи пациента"""
+    digits = ''.join(filter(str.isdigit, phone or ''))
+    return digits[-10:] or None
+# end shared:phone
 
 
 def upsert_registry(cursor, full_name, phone, email, source):
@@ -757,4 +1171,378 @@ def upsert_registry(cursor, full_name, phone, email, source):
     cursor.execute(
         "INSERT INTO t_p30358746_hospital_website_red.reest_phone_max (full_name, phone, email, source_type, source, appointment_date) VALUES (%s, %s, %s, %s, %s, %s)",
         (full_name, phone or None, email or None, source, source, now)
-    )
\ No newline at end of file
+    )
+    bump_registry_stats(cursor, source, 1)
+
+
+def bump_registry_stats(cursor, source, delta):
+    """Поправить счётчик registry_source_stats в той же транзакции, что и вставка в реестр"""
+    cursor.execute(
+        "INSERT INTO t_p30358746_hospital_website_red.registry_source_stats (source, records) VALUES (%s, %s) "
+        "ON CONFLICT (source) DO UPDATE SET records = registry_source_stats.records + EXCLUDED.records, updated_at = NOW()",
+        (source or '', delta)
+    )
+
+
+def surge_mode_active(now_moscow):
+    if not BOOKING_SURGE_WINDOW:
+        return False
+    start, end = BOOKING_SURGE_WINDOW.split('-')
+    return start.strip() <= now_moscow.strftime('%H:%M') < end.strip()
+
+
+def enqueue_booking_drain(cursor):
+    """Фоновое задание job-worker на разбор очереди — в транзакции постановки заявки.
+    Одно ждущее задание на всю очередь (dedupe_key), поэтому наплыв не плодит заданий."""
+    cursor.execute("""
+        INSERT INTO t_p30358746_hospital_website_red.background_jobs (kind, payload, priority, dedupe_key)
+        VALUES ('booking_drain', '{}', %s, 'booking_drain')
+        ON CONFLICT (dedupe_key) WHERE status IN ('queued', 'running') DO NOTHING
+    """, (BOOKING_DRAIN_JOB_PRIORITY,))
+
+
+def expire_booking_queue(conn):
+    """Снять заявки, ждущие дольше BOOKING_QUEUE_TTL_MINUTES: их результат не должен оставаться неизвестным"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        UPDATE t_p30358746_hospital_website_red.booking_queue
+        SET status = 'expired', processed_at = NOW()
+        WHERE status = 'pending' AND created_at < NOW() - %s * INTERVAL '1 minute'
+    """, (BOOKING_QUEUE_TTL_MINUTES,))
+    expired = cursor.rowcount
+    conn.commit()
+    cursor.close()
+    return expired
+
+
+def booking_queue_pending(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM t_p30358746_hospital_website_red.booking_queue WHERE status = 'pending'")
+    pending = cursor.fetchone()[0]
+    cursor.close()
+    return pending
+
+
+def drain_booking_queue(conn, batch_size=BOOKING_QUEUE_BATCH):
+    """Провести пачку заявок из очереди одной транзакцией в порядке поступления.
+    Одновременно очередь разбирает только один вызов (advisory lock), поэтому из конкурирующих
+    заявок на один слот всегда выигрывает более ранняя."""
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        cursor.execute("SELECT pg_try_advisory_xact_lock(%s) AS locked", (BOOKING_QUEUE_LOCK_ID,))
+        if not cursor.fetchone()['locked']:
+            conn.rollback()
+            return 0
+        
+        cursor.execute("""
+            SELECT * FROM t_p30358746_hospital_website_red.booking_queue
+            WHERE status = 'pending'
+            ORDER BY id
+            LIMIT %s
+        """, (batch_size,))
+        tickets = cursor.fetchall()
+        if not tickets:
+            conn.rollback()
+            return 0
+        
+        cursor.execute("""
+            INSERT INTO t_p30358746_hospital_website_red.appointments_v2 
+            (doctor_id, patient_name, patient_phone, patient_phone_norm, patient_snils, patient_oms, 
+             appointment_date, appointment_time, description, status, created_by) 
+            SELECT doctor_id, patient_name, patient_phone,
+                   NULLIF(RIGHT(REGEXP_REPLACE(patient_phone, '[^0-9]', '', 'g'), 10), ''),
+                   patient_snils, patient_oms,
+                   appointment_date, appointment_time, description, 'scheduled', created_by
+            FROM t_p30358746_hospital_website_red.booking_queue
+            WHERE id = ANY(%s)
+            ORDER BY id
+            ON CONFLICT (doctor_id, appointment_date, appointment_time) WHERE status != 'cancelled'
+            DO NOTHING
+            RETURNING id, doctor_id, appointment_date, appointment_time
+        """, ([t['id'] for t in tickets],))
+        booked = {
+            (r['doctor_id'], r['appointment_date'], r['appointment_time']): r['id']
+            for r in cursor.fetchall()
+        }
+        
+        source_map = {1: 'self', 2: 'doctor', 3: 'registrar'}
+        outcomes = []
+        for t in tickets:
+            appointment_id = booked.pop((t['doctor_id'], t['appointment_date'], t['appointment_time']), None)
+            outcomes.append((t['id'], 'booked' if appointment_id else 'rejected', appointment_id))
+            if appointment_id:
+                upsert_registry(cursor, t['patient_name'], t['patient_phone'], None, source_map.get(t['created_by'], 'self'))
+        
+        execute_values(cursor, """
+            UPDATE t_p30358746_hospital_website_red.booking_queue AS q
+            SET status = v.status, appointment_id = v.appointment_id, processed_at = NOW()
+            FROM (VALUES %s) AS v(id, status, appointment_id)
+            WHERE q.id = v.id
+        """, outcomes, template='(%s, %s, %s::integer)')
+        
+        for slot_doctor_id, slot_date in sorted({(t['doctor_id'], t['appointment_date']) for t in tickets}):
+            sync_day_slots(cursor, slot_doctor_id, slot_date)
+        
+        conn.commit()
+        return len(tickets)
+    finally:
+        cursor.close()
+
+
+# Одним запросом на каждый день диапазона: отметка календаря, действующее расписание
+# (ежедневное приоритетнее недельного) и занятые минуты от полуночи из doctor_day_slots.
+DAY_PLANS_QUERY = """
+    SELECT
+        days.day::date AS day,
+        cal.is_working,
+        sch.priority IS NOT NULL AS has_schedule_row,
+        sch.start_time, sch.end_time, sch.slot_duration,
+        sch.break_start_time, sch.break_end_time,
+        COALESCE(dds.booked_minutes, '{}') AS booked
+    FROM generate_series(%(start_date)s::date, %(end_date)s::date, INTERVAL '1 day') AS days(day)
+    LEFT JOIN t_p30358746_hospital_website_red.doctor_day_slots dds
+        ON dds.doctor_id = %(doctor_id)s AND dds.slot_date = days.day::date
+    LEFT JOIN t_p30358746_hospital_website_red.doctor_calendar cal
+        ON cal.doctor_id = %(doctor_id)s AND cal.calendar_date = days.day::date
+    LEFT JOIN LATERAL (
+        SELECT * FROM (
+            SELECT 0 AS priority, start_time, end_time, slot_duration, break_start_time, break_end_time
+            FROM t_p30358746_hospital_website_red.daily_schedules
+            WHERE doctor_id = %(doctor_id)s AND schedule_date = days.day::date AND is_active = TRUE
+            UNION ALL
+            SELECT 1 AS priority, start_time, end_time, slot_duration, break_start_time, break_end_time
+            FROM t_p30358746_hospital_website_red.doctor_schedules
+            WHERE doctor_id = %(doctor_id)s AND day_of_week = EXTRACT(DOW FROM days.day)::int AND is_active = TRUE
+        ) candidates
+        ORDER BY priority
+        LIMIT 1
+    ) sch ON TRUE
+    ORDER BY days.day
+"""
+
+
+# То же для всех активных врачей поликлиники/специальности: строка на врача и день.
+CLINIC_DAY_PLANS_QUERY = """
+    SELECT
+        doc.id AS doctor_id, doc.full_name, doc.specialization, doc.clinic,
+        days.day::date AS day,
+        cal.is_working,
+        sch.priority IS NOT NULL AS has_schedule_row,
+        sch.start_time, sch.end_time, sch.slot_duration,
+        sch.break_start_time, sch.break_end_time,
+        COALESCE(dds.booked_minutes, '{}') AS booked
+    FROM t_p30358746_hospital_website_red.doctors doc
+    CROSS JOIN generate_series(
+        %(start_date)s::date, %(start_date)s::date + (%(days)s - 1), INTERVAL '1 day'
+    ) AS days(day)
+    LEFT JOIN t_p30358746_hospital_website_red.doctor_day_slots dds
+        ON dds.doctor_id = doc.id AND dds.slot_date = days.day::date
+    LEFT JOIN t_p30358746_hospital_website_red.doctor_calendar cal
+        ON cal.doctor_id = doc.id AND cal.calendar_date = days.day::date
+    LEFT JOIN LATERAL (
+        SELECT * FROM (
+            SELECT 0 AS priority, start_time, end_time, slot_duration, break_start_time, break_end_time
+            FROM t_p30358746_hospital_website_red.daily_schedules
+            WHERE doctor_id = doc.id AND schedule_date = days.day::date AND is_active = TRUE
+            UNION ALL
+            SELECT 1 AS priority, start_time, end_time, slot_duration, break_start_time, break_end_time
+            FROM t_p30358746_hospital_website_red.doctor_schedules
+            WHERE doctor_id = doc.id AND day_of_week = EXTRACT(DOW FROM days.day)::int AND is_active = TRUE
+        ) candidates
+        ORDER BY priority
+        LIMIT 1
+    ) sch ON TRUE
+    WHERE doc.is_active = TRUE
+    AND (%(clinic)s IS NULL OR doc.clinic = %(clinic)s)
+    AND (%(specialization)s IS NULL OR doc.specialization = %(specialization)s)
+    ORDER BY doc.clinic, doc.full_name, doc.id, days.day
+"""
+
+
+def fetch_day_plans(cursor, doctor_id, start_date, end_date):
+    cursor.execute(DAY_PLANS_QUERY, {'doctor_id': doctor_id, 'start_date': start_date, 'end_date': end_date})
+    return cursor.fetchall()
+
+
+def sync_day_slots(cursor, doctor_id, slot_date):
+    """Пересчитать занятые минуты дня врача в doctor_day_slots внутри текущей транзакции.
+    Первый запрос блокирует строку дня, поэтому второй видит все уже зафиксированные записи на этот день.
+    Уведомление в SLOT_CHANNEL уходит ждущим slot-updates только после коммита транзакции."""
+    cursor.execute("""
+        INSERT INTO t_p30358746_hospital_website_red.doctor_day_slots (doctor_id, slot_date)
+        VALUES (%s, %s)
+        ON CONFLICT (doctor_id, slot_date) DO UPDATE SET updated_at = NOW()
+    """, (doctor_id, slot_date))
+    cursor.execute("""
+        UPDATE t_p30358746_hospital_website_red.doctor_day_slots SET booked_minutes = ARRAY(
+            SELECT DISTINCT (EXTRACT(HOUR FROM appointment_time) * 60 + EXTRACT(MINUTE FROM appointment_time))::int
+            FROM t_p30358746_hospital_website_red.appointments_v2
+            WHERE doctor_id = %s AND appointment_date = %s AND status IN ('scheduled', 'completed')
+            ORDER BY 1
+        ), updated_at = NOW()
+        WHERE doctor_id = %s AND slot_date = %s
+    """, (doctor_id, slot_date, doctor_id, slot_date))
+    cursor.execute("SELECT pg_notify(%s, %s)", (SLOT_CHANNEL, f'{doctor_id}:{slot_date}'))
+    if _slot_broker:
+        _slot_broker.publish(doctor_id, slot_date)
+
+
+def changed_slot_days(cursor, doctor_id, start_date, end_date, since_ts):
+    """Дни врача в диапазоне, занятость которых менялась после since_ts (с перекрытием CHANGES_OVERLAP_SECONDS).
+    Возвращает (дни, есть ли среди них изменения строго новее since_ts, время БД на момент запроса)."""
+    cursor.execute("""
+        SELECT slot_date, updated_at > %(since)s AS fresh, LOCALTIMESTAMP AS now
+        FROM t_p30358746_hospital_website_red.doctor_day_slots
+        WHERE doctor_id = %(doctor_id)s AND slot_date BETWEEN %(start_date)s AND %(end_date)s
+          AND updated_at > %(since)s - %(overlap)s * INTERVAL '1 second'
+        UNION ALL
+        SELECT NULL, FALSE, LOCALTIMESTAMP
+    """, {'doctor_id': doctor_id, 'start_date': start_date, 'end_date': end_date,
+          'since': since_ts, 'overlap': CHANGES_OVERLAP_SECONDS})
+    rows = cursor.fetchall()
+    days = {r['slot_date'] for r in rows if r['slot_date'] is not None}
+    return days, any(r['fresh'] for r in rows), rows[-1]['now']
+
+
+def slot_db(query, *args):
+    """Один короткий запрос long-poll на соединении из пула: между запросами ожидание соединения не держит"""
+    conn = get_db()
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        return query(cursor, *args)
+    finally:
+        cursor.close()
+        release_db(conn)
+
+
+def db_now(cursor):
+    cursor.execute("SELECT LOCALTIMESTAMP AS now")
+    return cursor.fetchone()['now']
+
+
+def changed_day_slots(cursor, doctor_id, days):
+    """Свободные слоты изменившихся дней в формате available-slots-bulk"""
+    slots_by_date = {}
+    for plan in fetch_day_plans(cursor, doctor_id, min(days), max(days)):
+        if plan['day'] not in days:
+            continue
+        available_slots, has_schedule = free_slots_for_day(plan)
+        slots_by_date[str(plan['day'])] = {
+            'available_slots': available_slots,
+            'booked_slots': len(plan['booked']) if has_schedule else 0,
+            **({} if plan['is_working'] is not False else {'hasSchedule': False}),
+        }
+    return slots_by_date
+
+
+def wait_slot_updates(doctor_id, start_date, end_date, since_ts, wait):
+    """Long-poll изменений свободных слотов врача: сразу отдаёт дни, изменившиеся после since_ts,
+    иначе ждёт уведомления SLOT_CHANNEL до wait секунд. Без since_ts только выдаёт курсор.
+    Сверх SLOT_WAITERS_MAX ждущих на экземпляр отвечает сразу, не дожидаясь изменений.
+    Соединение пула берётся на каждое перечитывание и возвращается до ожидания уведомления.
+    Возвращает (slots_by_date в формате available-slots-bulk только по изменившимся дням, новый курсор)."""
+    global _slot_waiters
+    if since_ts is None:
+        return {}, slot_db(db_now)
+    
+    waiting = False
+    try:
+        days, fresh, now = slot_db(changed_slot_days, doctor_id, start_date, end_date, since_ts)
+        deadline = monotonic() + wait
+        broker = _slot_broker or _slot_listener
+        if not fresh and wait:
+            with _slot_waiters_lock:
+                waiting = _slot_waiters < SLOT_WAITERS_MAX
+                if waiting:
+                    _slot_waiters += 1
+        # Подписка, не поднявшаяся до конца ожидания, означает ответ по текущему состоянию
+        if waiting and (broker is _slot_broker or _slot_listener.start(deadline - monotonic())):
+            seen = broker.position()
+            # Изменение могло зафиксироваться между первым запросом и подпиской
+            days, fresh, now = slot_db(changed_slot_days, doctor_id, start_date, end_date, since_ts)
+            while not fresh and monotonic() < deadline:
+                events, seen = broker.wait(deadline - monotonic(), seen)
+                # Пустой doctor_id — слушатель переподключался и мог потерять уведомления
+                relevant = events is None or any(
+                    d in (str(doctor_id), '') and (not day or start_date <= day <= end_date) for d, day in events
+                )
+                if relevant:
+                    days, fresh, now = slot_db(changed_slot_days, doctor_id, start_date, end_date, since_ts)
+        if waiting and not fresh:
+            days, fresh, now = slot_db(changed_slot_days, doctor_id, start_date, end_date, since_ts)
+        
+        return (slot_db(changed_day_slots, doctor_id, days) if days else {}), now
+    finally:
+        if waiting:
+            with _slot_waiters_lock:
+                _slot_waiters -= 1
+
+
+def slot_updates_response(params):
+    """GET ?action=slot-updates: проверка параметров и long-poll wait_slot_updates"""
+    doctor_id = params.get('doctor_id')
+    start_date = params.get('start_date')
+    end_date = params.get('end_date')
+    since = params.get('since')
+    
+    if not doctor_id or not start_date or not end_date:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Missing parameters'}),
+            'isBase64Encoded': False
+        }
+    try:
+        wait = min(max(int(params.get('wait', SLOT_WAIT_DEFAULT)), 0), SLOT_WAIT_MAX)
+        since_ts = slot_db(lambda cursor: parse_since(cursor.connection, since)) if since else None
+    except ValueError:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Invalid since or wait'}),
+            'isBase64Encoded': False
+        }
+    
+    slots_by_date, cursor_ts = wait_slot_updates(doctor_id, start_date, end_date, since_ts, wait)
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'slots_by_date': slots_by_date, 'cursor': cursor_ts.isoformat()}),
+        'isBase64Encoded': False
+    }
+
+
+def time_to_minutes(value, default=None):
+    if value is None:
+        return default
+    return value.hour * 60 + value.minute
+
+
+def minutes_to_hhmm(minutes):
+    return f'{minutes // 60:02d}:{minutes % 60:02d}'
+
+
+@lru_cache(maxsize=512)
+def build_slot_grid(start_min, end_min, slot_duration, break_start_min, break_end_min):
+    """Сетка слотов дня в минутах от полуночи; строится один раз на набор параметров расписания"""
+    has_break = break_start_min is not None and break_end_min is not None
+    return tuple(
+        minute for minute in range(start_min, end_min, slot_duration)
+        if not (has_break and break_start_min <= minute < break_end_min)
+    )
+
+
+def free_slots_for_day(plan):
+    """Свободные слоты дня в формате HH:MM и признак наличия расписания.
+    Строка расписания без времени начала/конца — это 09:00–18:00, как и раньше; нет строки — нет слотов."""
+    if plan['is_working'] is False or not plan['has_schedule_row']:
+        return [], False
+    grid = build_slot_grid(
+        time_to_minutes(plan['start_time'], 9 * 60),
+        time_to_minutes(plan['end_time'], 18 * 60),
+        plan['slot_duration'] or 15,
+        time_to_minutes(plan['break_start_time']),
+        time_to_minutes(plan['break_end_time']),
+    )
+    booked = set(plan['booked'])
+    return [minutes_to_hhmm(minute) for minute in grid if minute not in booked], True
@@ -1,9 +1,73 @@
 import json
 import os
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool, PoolError
 import bcrypt
 from psycopg2.extras import RealDictCursor
 from typing import Dict, Any
+from time import monotonic
+
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+DB_STATEMENT_TIMEOUT_MS = 10000
+DB_PING_AFTER_SECONDS = 30
+
+# shared:db_pool — копия tools/shared/db_pool.py, правится там (python tools/sync_shared.py)
+_db_pool = None
+_db_last_used = {}
+
+
+def _db_alive(conn) -> bool:
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def get_db():
+    """Соединение из пула, живущего между тёплыми вызовами функции.
+    Простаивавшее дольше DB_PING_AFTER_SECONDS соединение проверяется и при обрыве пересоздаётся."""
+    global _db_pool
+    dsn = os.environ['DATABASE_URL']
+    options = f'-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}'
+    if _db_pool is None or _db_pool.closed:
+        _db_pool = ThreadedConnectionPool(1, DB_POOL_MAX, dsn, options=options)
+    for _ in range(DB_POOL_MAX + 1):
+        try:
+            conn = _db_pool.getconn()
+        except PoolError:
+            return psycopg2.connect(dsn, options=options)
+        idle = monotonic() - _db_last_used.get(id(conn), monotonic())
+        if not conn.closed and (idle < DB_PING_AFTER_SECONDS or _db_alive(conn)):
+            return conn
+        _db_last_used.pop(id(conn), None)
+        _db_pool.putconn(conn, close=True)
+    return psycopg2.connect(dsn, options=options)
+
+
+def release_db(conn):
+    """Вернуть соединение в пул; незавершённая транзакция откатывается"""
+    broken = conn.closed
+    if not broken:
+        try:
+            conn.rollback()
+            conn.autocommit = False
+        except psycopg2.Error:
+            broken = True
+    if broken:
+        _db_last_used.pop(id(conn), None)
+    else:
+        _db_last_used[id(conn)] = monotonic()
+    try:
+        _db_pool.putconn(conn, close=broken)
+    except (PoolError, AttributeError):
+        conn.close()
+# end shared:db_pool
+
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
@@ -50,7 +114,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'isBase64Encoded': False
             }
         
-        conn = psycopg2.connect(database_url)
+        conn = get_db()
         
         try:
             cursor = conn.cursor(cursor_factory=RealDictCursor)
@@ -164,7 +228,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             }
         
         finally:
-            conn.close()
+            release_db(conn)
     
     else:
         return {
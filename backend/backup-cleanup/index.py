@@ -2,7 +2,10 @@ import json
 import os
 import boto3
 import psycopg2
-from datetime import datetime, timedelta
+from psycopg2.pool import ThreadedConnectionPool, PoolError
+from datetime import datetime, timedelta, timezone
+from time import monotonic
+from concurrent.futures import ThreadPoolExecutor
 
 SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 't_p30358746_hospital_website_red')
 
@@ -13,8 +16,66 @@ CORS_HEADERS = {
 }
 
 
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+DB_STATEMENT_TIMEOUT_MS = 60000
+DB_PING_AFTER_SECONDS = 30
+
+# shared:db_pool — копия tools/shared/db_pool.py, правится там (python tools/sync_shared.py)
+_db_pool = None
+_db_last_used = {}
+
+
+def _db_alive(conn) -> bool:
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
 def get_db():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+    """Соединение из пула, живущего между тёплыми вызовами функции.
+    Простаивавшее дольше DB_PING_AFTER_SECONDS соединение проверяется и при обрыве пересоздаётся."""
+    global _db_pool
+    dsn = os.environ['DATABASE_URL']
+    options = f'-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}'
+    if _db_pool is None or _db_pool.closed:
+        _db_pool = ThreadedConnectionPool(1, DB_POOL_MAX, dsn, options=options)
+    for _ in range(DB_POOL_MAX + 1):
+        try:
+            conn = _db_pool.getconn()
+        except PoolError:
+            return psycopg2.connect(dsn, options=options)
+        idle = monotonic() - _db_last_used.get(id(conn), monotonic())
+        if not conn.closed and (idle < DB_PING_AFTER_SECONDS or _db_alive(conn)):
+            return conn
+        _db_last_used.pop(id(conn), None)
+        _db_pool.putconn(conn, close=True)
+    return psycopg2.connect(dsn, options=options)
+
+
+def release_db(conn):
+    """Вернуть соединение в пул; незавершённая транзакция откатывается"""
+    broken = conn.closed
+    if not broken:
+        try:
+            conn.rollback()
+            conn.autocommit = False
+        except psycopg2.Error:
+            broken = True
+    if broken:
+        _db_last_used.pop(id(conn), None)
+    else:
+        _db_last_used[id(conn)] = monotonic()
+    try:
+        _db_pool.putconn(conn, close=broken)
+    except (PoolError, AttributeError):
+        conn.close()
+# end shared:db_pool
 
 
 def get_s3():
@@ -26,28 +87,101 @@ def get_s3():
     )
 
 
-def delete_s3_folder(s3, folder):
-    try:
-        paginator = s3.get_paginator('list_objects_v2')
-        pages = paginator.paginate(Bucket='files', Prefix=folder + '/')
-        keys = []
-        for page in pages:
-            for obj in page.get('Contents', []):
-                keys.append({'Key': obj['Key']})
-        if keys:
-            s3.delete_objects(Bucket='files', Delete={'Objects': keys})
-    except Exception as e:
-        print(f'[s3 delete error] folder={folder} error={e}')
+# Очистка выполняется фоновым заданием job-worker с самым низким приоритетом
+CLEANUP_JOB_PRIORITY = -20
+
+
+# shared:backup_storage — копия tools/shared/backup_storage.py, правится там (python tools/sync_shared.py)
+S3_DELETE_BATCH = 1000
+S3_DELETE_WORKERS = 8
+
+
+def list_backup_objects(s3, prefix='backups/'):
+    """Все объекты под префиксом одним проходом, сгруппированные по папке:
+    папка -> {'objects': [(ключ, размер)], 'last_modified': самое позднее изменение}"""
+    folders = {}
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket='files', Prefix=prefix):
+        for obj in page.get('Contents', []):
+            folder = folders.setdefault(obj['Key'].rsplit('/', 1)[0], {'objects': [], 'last_modified': None})
+            folder['objects'].append((obj['Key'], obj.get('Size', 0)))
+            modified = obj.get('LastModified')
+            if modified and (folder['last_modified'] is None or modified > folder['last_modified']):
+                folder['last_modified'] = modified
+    return folders
+
+
+def delete_s3_keys(s3, objects):
+    """Удалить объекты пачками по S3_DELETE_BATCH ключей (предел delete_objects), пачки — параллельно.
+    Возвращает (удалено объектов, освобождено байт, ошибок)."""
+    chunks = [objects[i:i + S3_DELETE_BATCH] for i in range(0, len(objects), S3_DELETE_BATCH)]
+
+    def delete_chunk(chunk):
+        try:
+            resp = s3.delete_objects(
+                Bucket='files',
+                Delete={'Objects': [{'Key': key} for key, _ in chunk], 'Quiet': True},
+            )
+        except Exception as e:
+            print(f'[s3 delete error] keys={len(chunk)} error={e}')
+            return 0, 0, len(chunk)
+        failed = {err['Key'] for err in resp.get('Errors', [])}
+        done = [(key, size) for key, size in chunk if key not in failed]
+        return len(done), sum(size for _, size in done), len(failed)
+
+    if not chunks:
+        return 0, 0, 0
+    with ThreadPoolExecutor(max_workers=min(S3_DELETE_WORKERS, len(chunks))) as pool:
+        results = list(pool.map(delete_chunk, chunks))
+    return tuple(sum(r[i] for r in results) for i in range(3))
+# end shared:backup_storage
+
+
+# shared:background_jobs — копия tools/shared/background_jobs.py, правится там (python tools/sync_shared.py)
+def enqueue_job(conn, kind, payload, priority=0, dedupe_key=None):
+    """Поставить задание в background_jobs в текущей транзакции (коммитит вызывающий).
+    Пока задание с тем же dedupe_key ждёт или выполняется, возвращается его id."""
+    cur = conn.cursor()
+    for _ in range(2):
+        cur.execute(f'''
+            INSERT INTO "{SCHEMA}".background_jobs (kind, payload, priority, dedupe_key)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (dedupe_key) WHERE status IN ('queued', 'running') DO NOTHING
+            RETURNING id
+        ''', (kind, json.dumps(payload), priority, dedupe_key))
+        row = cur.fetchone()
+        if row is None:
+            cur.execute(f'''
+                SELECT id FROM "{SCHEMA}".background_jobs WHERE dedupe_key = %s AND status IN ('queued', 'running')
+            ''', (dedupe_key,))
+            row = cur.fetchone()
+        if row is not None:
+            break
+    cur.close()
+    return row[0]
+# end shared:background_jobs
 
 
 def handler(event: dict, context) -> dict:
     """
     Cron-функция автоматической очистки старых архивов БД.
     Читает параметр retention_days из настроек. Если 0 — не удаляет ничего.
+    Вызов по cron только ставит задание backup_cleanup в очередь; удаление выполняется,
+    когда job-worker вызывает функцию с ?action=run.
+    Папки без записи в backup_records («сироты» прерванных выгрузок) удаляются только по явному
+    флагу ?action=run&purge_orphans=1 (или purge_orphans: true в теле) и никогда — папки,
+    на которые ссылаются backup_runs или ждущие/выполняющиеся задания db_backup.
     """
     if event.get('httpMethod') == 'OPTIONS':
         return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': ''}
 
+    params = event.get('queryStringParameters') or {}
+    try:
+        body = json.loads(event.get('body') or '{}')
+    except (TypeError, ValueError):
+        body = {}
+    purge_orphans = params.get('purge_orphans') in ('1', 'true') or body.get('purge_orphans') is True
+
     conn = get_db()
     cur = conn.cursor()
     cur.execute(f'''
@@ -59,33 +193,76 @@ def handler(event: dict, context) -> dict:
     retention_days = row[0] if row else 0
 
     if retention_days <= 0:
-        conn.close()
+        release_db(conn)
         return {
             'statusCode': 200,
             'headers': {**CORS_HEADERS, 'Content-Type': 'application/json'},
             'body': json.dumps({'success': True, 'skipped': True, 'reason': 'retention_days = 0, удаление отключено'}),
         }
 
+    if params.get('action') != 'run':
+        job_id = enqueue_job(conn, 'backup_cleanup', {}, priority=CLEANUP_JOB_PRIORITY, dedupe_key='backup_cleanup')
+        conn.commit()
+        release_db(conn)
+        return {
+            'statusCode': 200,
+            'headers': {**CORS_HEADERS, 'Content-Type': 'application/json'},
+            'body': json.dumps({'success': True, 'queued': True, 'job_id': job_id}),
+        }
+
     cutoff = datetime.now() - timedelta(days=retention_days)
     cur = conn.cursor()
+    # Цепочка base + delta удаляется целиком, когда устарела её последняя копия
     cur.execute(f'''
-        DELETE FROM "{SCHEMA}".backup_records
-        WHERE created_at < %s
+        DELETE FROM "{SCHEMA}".backup_records r
+        WHERE r.created_at < %s
+          AND (r.base_folder IS NULL OR NOT EXISTS (
+              SELECT 1 FROM "{SCHEMA}".backup_records n
+              WHERE n.base_folder = r.base_folder AND n.created_at >= %s
+          ))
         RETURNING folder
-    ''', (cutoff,))
+    ''', (cutoff, cutoff))
     deleted_folders = [r[0] for r in cur.fetchall()]
     conn.commit()
+    kept_folders = set()
+    if purge_orphans:
+        # Папка плановой выгрузки пишется частями ещё до записи в backup_records, а папку
+        # фонового архива job-worker может повторить — такие папки сиротами не считаются
+        cur.execute(f'''
+            SELECT folder FROM "{SCHEMA}".backup_records
+            UNION SELECT folder FROM "{SCHEMA}".backup_runs
+            UNION SELECT payload->>'folder' FROM "{SCHEMA}".background_jobs
+            WHERE kind = 'db_backup' AND status IN ('queued', 'running') AND payload ? 'folder'
+        ''')
+        kept_folders = {r[0] for r in cur.fetchall()}
     cur.close()
-    conn.close()
+    release_db(conn)
 
+    # Один листинг backups/: папки удалённых записей и, по флагу purge_orphans, «сироты» старше срока
     s3 = get_s3()
-    for folder in deleted_folders:
-        delete_s3_folder(s3, folder)
+    listed = list_backup_objects(s3)
+    cutoff_utc = cutoff.astimezone(timezone.utc)
+    orphans = [
+        folder for folder, info in listed.items()
+        if folder not in kept_folders and folder not in deleted_folders
+        and info['last_modified'] is not None and info['last_modified'] < cutoff_utc
+    ] if purge_orphans else []
+    objects = [obj for folder in deleted_folders + orphans for obj in listed.get(folder, {}).get('objects', [])]
+    deleted_files, reclaimed, errors = delete_s3_keys(s3, objects)
 
-    print(f'[cleanup] retention_days={retention_days}, cutoff={cutoff}, deleted={len(deleted_folders)}')
+    print(f'[cleanup] retention_days={retention_days}, cutoff={cutoff}, deleted={len(deleted_folders)}, '
+          f'orphans={len(orphans)}, files={deleted_files}, bytes={reclaimed}, errors={errors}')
 
     return {
         'statusCode': 200,
         'headers': {**CORS_HEADERS, 'Content-Type': 'application/json'},
-        'body': json.dumps({'success': True, 'deleted': len(deleted_folders), 'cutoff': cutoff.isoformat()}),
-    }
\ No newline at end of file
+        'body': json.dumps({
+            'success': True,
+            'deleted': len(deleted_folders),
+            'orphans_deleted': len(orphans),
+            'deleted_s3_files': deleted_files,
+            'bytes_reclaimed': reclaimed,
+            'delete_errors': errors,
+            'cutoff': cutoff.isoformat(),
+        }),
+    }
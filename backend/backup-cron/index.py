@@ -1,9 +1,16 @@
 import json
 import os
-import urllib.request
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool, PoolError
+from datetime import datetime, time, timedelta, timezone
+from time import monotonic
 
 
-DB_BACKUP_URL = 'https://functions.poehali.dev/44a9271b-91c3-434f-a4ed-a10b64718f46'
+SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 't_p30358746_hospital_website_red')
+MSK = timezone(timedelta(hours=3))
+BACKUP_LOCK_ID = 730002
+# Плановая копия выполняется заданием job-worker с тем же приоритетом, что и ручная из db-backup
+BACKUP_JOB_PRIORITY = -10
 
 CORS_HEADERS = {
     'Access-Control-Allow-Origin': '*',
@@ -12,26 +19,206 @@ CORS_HEADERS = {
 }
 
 
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+DB_STATEMENT_TIMEOUT_MS = 10000
+DB_PING_AFTER_SECONDS = 30
+
+# shared:db_pool — копия tools/shared/db_pool.py, правится там (python tools/sync_shared.py)
+_db_pool = None
+_db_last_used = {}
+
+
+def _db_alive(conn) -> bool:
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def get_db():
+    """Соединение из пула, живущего между тёплыми вызовами функции.
+    Простаивавшее дольше DB_PING_AFTER_SECONDS соединение проверяется и при обрыве пересоздаётся."""
+    global _db_pool
+    dsn = os.environ['DATABASE_URL']
+    options = f'-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}'
+    if _db_pool is None or _db_pool.closed:
+        _db_pool = ThreadedConnectionPool(1, DB_POOL_MAX, dsn, options=options)
+    for _ in range(DB_POOL_MAX + 1):
+        try:
+            conn = _db_pool.getconn()
+        except PoolError:
+            return psycopg2.connect(dsn, options=options)
+        idle = monotonic() - _db_last_used.get(id(conn), monotonic())
+        if not conn.closed and (idle < DB_PING_AFTER_SECONDS or _db_alive(conn)):
+            return conn
+        _db_last_used.pop(id(conn), None)
+        _db_pool.putconn(conn, close=True)
+    return psycopg2.connect(dsn, options=options)
+
+
+def release_db(conn):
+    """Вернуть соединение в пул; незавершённая транзакция откатывается"""
+    broken = conn.closed
+    if not broken:
+        try:
+            conn.rollback()
+            conn.autocommit = False
+        except psycopg2.Error:
+            broken = True
+    if broken:
+        _db_last_used.pop(id(conn), None)
+    else:
+        _db_last_used[id(conn)] = monotonic()
+    try:
+        _db_pool.putconn(conn, close=broken)
+    except (PoolError, AttributeError):
+        conn.close()
+# end shared:db_pool
+
+
+# shared:backup_schedule — копия tools/shared/backup_schedule.py, правится там (python tools/sync_shared.py)
+def backup_due(settings, last_started, now):
+    """Пора ли запускать плановую копию и когда следующий запуск.
+    Окно start_time–end_time по МСК (может переходить через полночь); repeat_minutes — интервал
+    между запусками внутри окна, 0 — один запуск за окно. Возвращает (пора, время следующего запуска)."""
+    if not settings['enabled']:
+        return False, None
+    start = time(*map(int, settings['start_time'].split(':')))
+    end = time(*map(int, settings['end_time'].split(':')))
+    window_start = now.replace(hour=start.hour, minute=start.minute, second=0, microsecond=0)
+    window_end = now.replace(hour=end.hour, minute=end.minute, second=59, microsecond=0)
+    if window_end < window_start:
+        if now <= window_end:
+            window_start -= timedelta(days=1)
+        else:
+            window_end += timedelta(days=1)
+    if now > window_end:
+        window_start += timedelta(days=1)
+        window_end += timedelta(days=1)
+    if now < window_start:
+        return False, window_start
+    if last_started is None or last_started < window_start:
+        return True, now
+    if settings['repeat_minutes'] > 0:
+        next_run = last_started + timedelta(minutes=settings['repeat_minutes'])
+        if next_run <= now:
+            return True, now
+        if next_run <= window_end:
+            return False, next_run
+    return False, window_start + timedelta(days=1)
+# end shared:backup_schedule
+
+
+# shared:background_jobs — копия tools/shared/background_jobs.py, правится там (python tools/sync_shared.py)
+def enqueue_job(conn, kind, payload, priority=0, dedupe_key=None):
+    """Поставить задание в background_jobs в текущей транзакции (коммитит вызывающий).
+    Пока задание с тем же dedupe_key ждёт или выполняется, возвращается его id."""
+    cur = conn.cursor()
+    for _ in range(2):
+        cur.execute(f'''
+            INSERT INTO "{SCHEMA}".background_jobs (kind, payload, priority, dedupe_key)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (dedupe_key) WHERE status IN ('queued', 'running') DO NOTHING
+            RETURNING id
+        ''', (kind, json.dumps(payload), priority, dedupe_key))
+        row = cur.fetchone()
+        if row is None:
+            cur.execute(f'''
+                SELECT id FROM "{SCHEMA}".background_jobs WHERE dedupe_key = %s AND status IN ('queued', 'running')
+            ''', (dedupe_key,))
+            row = cur.fetchone()
+        if row is not None:
+            break
+    cur.close()
+    return row[0]
+# end shared:background_jobs
+
+
+def get_schedule_state(conn):
+    """Настройки, время последнего запуска, есть ли незавершённый запуск и держит ли кто-то блокировку"""
+    cur = conn.cursor()
+    cur.execute(f'''
+        SELECT s.enabled, s.start_time, s.end_time, s.repeat_minutes,
+               (SELECT MAX(started_at) FROM "{SCHEMA}".backup_runs),
+               EXISTS (SELECT 1 FROM "{SCHEMA}".backup_runs WHERE status = 'running'),
+               EXISTS (
+                   SELECT 1 FROM pg_locks
+                   WHERE locktype = 'advisory' AND classid = 0 AND objid = %s AND objsubid = 1 AND granted
+               )
+        FROM "{SCHEMA}".backup_settings s
+        WHERE s.id = 1
+    ''', (BACKUP_LOCK_ID,))
+    row = cur.fetchone()
+    cur.close()
+    if not row:
+        return None
+    return {
+        'settings': {
+            'enabled': row[0],
+            'start_time': str(row[1])[:5] if row[1] else '02:00',
+            'end_time': str(row[2])[:5] if row[2] else '04:00',
+            'repeat_minutes': row[3] or 0,
+        },
+        'last_started': row[4],
+        'open_run': row[5],
+        'locked': row[6],
+    }
+
+
 def handler(event: dict, context) -> dict:
     """
     Cron-функция автоматического архивирования БД.
-    Вызывается по расписанию и запускает плановый бэкап через db-backup.
+    Сама решает по backup_settings и журналу backup_runs, пора ли запускать копию, и ставит
+    задание db_backup для job-worker только когда пора или когда прерванный запуск нужно продолжить.
     """
     if event.get('httpMethod') == 'OPTIONS':
         return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': ''}
 
-    req = urllib.request.Request(
-        f'{DB_BACKUP_URL}?action=scheduled',
-        method='POST',
-        headers={'Content-Type': 'application/json'},
-        data=b'{}',
-    )
+    conn = get_db()
+    try:
+        state = get_schedule_state(conn)
+    finally:
+        release_db(conn)
+
+    if state is None:
+        due, next_due, reason = False, None, 'backup disabled'
+    elif state['locked']:
+        due, next_due, reason = False, None, 'backup already running'
+    elif state['open_run']:
+        due, next_due, reason = True, None, 'resume'
+    else:
+        due, next_due = backup_due(state['settings'], state['last_started'], datetime.now(MSK))
+        reason = 'due' if due else ('backup disabled' if not state['settings']['enabled'] else 'not due')
+
+    if not due:
+        return {
+            'statusCode': 200,
+            'headers': {**CORS_HEADERS, 'Content-Type': 'application/json'},
+            'body': json.dumps({
+                'success': True,
+                'skipped': True,
+                'reason': reason,
+                'next_due': next_due.isoformat() if next_due else None,
+            }),
+        }
 
-    with urllib.request.urlopen(req, timeout=60) as resp:
-        result = json.loads(resp.read().decode())
+    # Копию делает db-backup по заданию job-worker: он сам берёт блокировку, отмечает готовые таблицы
+    # в backup_runs и продолжает прерванный запуск. Пока задание ждёт или выполняется, новое не ставится
+    conn = get_db()
+    try:
+        job_id = enqueue_job(conn, 'db_backup', {'scheduled': True},
+                             priority=BACKUP_JOB_PRIORITY, dedupe_key='db_backup_scheduled')
+        conn.commit()
+    finally:
+        release_db(conn)
 
     return {
         'statusCode': 200,
         'headers': {**CORS_HEADERS, 'Content-Type': 'application/json'},
-        'body': json.dumps({'success': True, 'result': result}),
+        'body': json.dumps({'success': True, 'reason': reason, 'queued': True, 'job_id': job_id}),
     }
@@ -1,9 +1,72 @@
 import json
 import os
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool, PoolError
 from psycopg2.extras import RealDictCursor
 from typing import Dict, Any
-import urllib.request
+from time import monotonic
+
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+DB_STATEMENT_TIMEOUT_MS = 5000
+DB_PING_AFTER_SECONDS = 30
+
+# shared:db_pool — копия tools/shared/db_pool.py, правится там (python tools/sync_shared.py)
+_db_pool = None
+_db_last_used = {}
+
+
+def _db_alive(conn) -> bool:
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def get_db():
+    """Соединение из пула, живущего между тёплыми вызовами функции.
+    Простаивавшее дольше DB_PING_AFTER_SECONDS соединение проверяется и при обрыве пересоздаётся."""
+    global _db_pool
+    dsn = os.environ['DATABASE_URL']
+    options = f'-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}'
+    if _db_pool is None or _db_pool.closed:
+        _db_pool = ThreadedConnectionPool(1, DB_POOL_MAX, dsn, options=options)
+    for _ in range(DB_POOL_MAX + 1):
+        try:
+            conn = _db_pool.getconn()
+        except PoolError:
+            return psycopg2.connect(dsn, options=options)
+        idle = monotonic() - _db_last_used.get(id(conn), monotonic())
+        if not conn.closed and (idle < DB_PING_AFTER_SECONDS or _db_alive(conn)):
+            return conn
+        _db_last_used.pop(id(conn), None)
+        _db_pool.putconn(conn, close=True)
+    return psycopg2.connect(dsn, options=options)
+
+
+def release_db(conn):
+    """Вернуть соединение в пул; незавершённая транзакция откатывается"""
+    broken = conn.closed
+    if not broken:
+        try:
+            conn.rollback()
+            conn.autocommit = False
+        except psycopg2.Error:
+            broken = True
+    if broken:
+        _db_last_used.pop(id(conn), None)
+    else:
+        _db_last_used[id(conn)] = monotonic()
+    try:
+        _db_pool.putconn(conn, close=broken)
+    except (PoolError, AttributeError):
+        conn.close()
+# end shared:db_pool
+
 
 SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 't_p30358746_hospital_website_red')
 
@@ -13,21 +76,50 @@ CORS = {
     'Access-Control-Allow-Headers': 'Content-Type',
 }
 
-def send_max_message(phone: str, message: str):
-    """Отправить сообщение в MAX через GREEN-API"""
-    instance_id = os.environ.get('GREEN_API_INSTANCE_ID')
-    token = os.environ.get('GREEN_API_TOKEN')
-    if not instance_id or not token:
-        return
-    clean_phone = ''.join(filter(str.isdigit, phone))
-    chat_id = f"{clean_phone}@c.us"
-    data = json.dumps({'chatId': chat_id, 'message': message}).encode('utf-8')
-    url = f'https://api.green-api.com/v3/waInstance{instance_id}/sendMessage/{token}'
-    try:
-        req = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'}, method='POST')
-        urllib.request.urlopen(req, timeout=10)
-    except Exception as e:
-        print(f"MAX send error: {e}")
+# Уведомления пациентам отправляет job-worker; их приоритет выше рассылок и архивов
+NOTIFY_JOB_PRIORITY = 10
+
+
+# shared:phone — копия tools/shared/phone.py, правится там (python tools/sync_shared.py)
+def normalize_phone(phone):
+    """Последние 10 цифр номера — значение patient_phone_norm, по которому ищутся записи пациента"""
+    digits = ''.join(filter(str.isdigit, phone or ''))
+    return digits[-10:] or None
+# end shared:phone
+
+
+def enqueue_max_message(conn, phone: str, message: str):
+    """Поставить сообщение в MAX в очередь background_jobs в текущей транзакции (коммитит вызывающий).
+    Отправку через GREEN-API с повторами выполняет job-worker."""
+    cur = conn.cursor()
+    cur.execute(f"""
+        INSERT INTO {SCHEMA}.background_jobs (kind, payload, priority)
+        VALUES ('max_message', %s, %s)
+        RETURNING id
+    """, (json.dumps({'phone': phone, 'message': message}), NOTIFY_JOB_PRIORITY))
+    job_id = cur.fetchone()[0]
+    cur.close()
+    return job_id
+
+def sync_day_slots(cursor, doctor_id, slot_date):
+    """Пересчитать занятые минуты дня врача в doctor_day_slots внутри текущей транзакции"""
+    cursor.execute(f"""
+        INSERT INTO {SCHEMA}.doctor_day_slots (doctor_id, slot_date)
+        VALUES (%s, %s)
+        ON CONFLICT (doctor_id, slot_date) DO UPDATE SET updated_at = NOW()
+    """, (doctor_id, slot_date))
+    cursor.execute(f"""
+        UPDATE {SCHEMA}.doctor_day_slots SET booked_minutes = ARRAY(
+            SELECT DISTINCT (EXTRACT(HOUR FROM appointment_time) * 60 + EXTRACT(MINUTE FROM appointment_time))::int
+            FROM {SCHEMA}.appointments_v2
+            WHERE doctor_id = %s AND appointment_date = %s AND status IN ('scheduled', 'completed')
+            ORDER BY 1
+        ), updated_at = NOW()
+        WHERE doctor_id = %s AND slot_date = %s
+    """, (doctor_id, slot_date, doctor_id, slot_date))
+    # Ждущие appointments?action=slot-updates получат уведомление после коммита
+    cursor.execute("SELECT pg_notify(%s, %s)", ('slot_changes', f'{doctor_id}:{slot_date}'))
+
 
 def fmt_date(d) -> str:
     if not d:
@@ -56,7 +148,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     body = json.loads(event.get('body') or '{}')
     action = body.get('action', '')
 
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = get_db()
     cursor = conn.cursor(cursor_factory=RealDictCursor)
 
     if action == 'notify':
@@ -69,15 +161,13 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         description = body.get('description', '')
 
         if not phone:
-            conn.close()
+            release_db(conn)
             return {
                 'statusCode': 400,
                 'headers': {'Content-Type': 'application/json', **CORS},
                 'body': json.dumps({'error': 'Номер телефона обязателен'})
             }
 
-        conn.close()
-
         date_fmt = fmt_date(date)
         msg = (
             f"✅ Вы успешно записаны на приём!\n\n"
@@ -89,7 +179,9 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             + (f"\n📋 Описание: {description}" if description else "") +
             f"\n\nДо встречи! Пожалуйста, не опаздывайте."
         )
-        send_max_message(phone, msg)
+        enqueue_max_message(conn, phone, msg)
+        conn.commit()
+        release_db(conn)
 
         return {
             'statusCode': 200,
@@ -100,7 +192,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     if action == 'get-appointments':
         phone = ''.join(filter(str.isdigit, body.get('phone', '')))
         if not phone:
-            conn.close()
+            release_db(conn)
             return {
                 'statusCode': 400,
                 'headers': {'Content-Type': 'application/json', **CORS},
@@ -119,14 +211,14 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 d.specialization AS doctor_specialty
             FROM {SCHEMA}.appointments_v2 a
             LEFT JOIN {SCHEMA}.doctors d ON d.id = a.doctor_id
-            WHERE a.patient_phone LIKE %s
+            WHERE a.patient_phone_norm = %s
               AND a.status = 'scheduled'
               AND a.appointment_date >= CURRENT_DATE
             ORDER BY a.appointment_date, a.appointment_time
-        """, (f'%{phone[-10:]}%',))
+        """, (normalize_phone(phone),))
 
         rows = cursor.fetchall()
-        conn.close()
+        release_db(conn)
 
         appointments = []
         for r in rows:
@@ -151,7 +243,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         phone = ''.join(filter(str.isdigit, body.get('phone', '')))
 
         if not appointment_id or not phone:
-            conn.close()
+            release_db(conn)
             return {
                 'statusCode': 400,
                 'headers': {'Content-Type': 'application/json', **CORS},
@@ -161,6 +253,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         cursor.execute(f"""
             SELECT
                 a.id,
+                a.doctor_id,
                 a.appointment_date,
                 a.appointment_time,
                 a.patient_name,
@@ -171,14 +264,14 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             FROM {SCHEMA}.appointments_v2 a
             LEFT JOIN {SCHEMA}.doctors d ON d.id = a.doctor_id
             WHERE a.id = %s
-              AND a.patient_phone LIKE %s
+              AND a.patient_phone_norm = %s
               AND a.status = 'scheduled'
-        """, (appointment_id, f'%{phone[-10:]}%'))
+        """, (appointment_id, normalize_phone(phone)))
 
         appt = cursor.fetchone()
 
         if not appt:
-            conn.close()
+            release_db(conn)
             return {
                 'statusCode': 404,
                 'headers': {'Content-Type': 'application/json', **CORS},
@@ -187,11 +280,10 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
 
         cursor.execute(f"""
             UPDATE {SCHEMA}.appointments_v2
-            SET status = 'cancelled'
+            SET status = 'cancelled', updated_at = CURRENT_TIMESTAMP
             WHERE id = %s
         """, (appointment_id,))
-        conn.commit()
-        conn.close()
+        sync_day_slots(cursor, appt['doctor_id'], appt['appointment_date'])
 
         date_fmt = fmt_date(appt['appointment_date'])
         time_fmt = fmt_time(appt['appointment_time'])
@@ -208,7 +300,10 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             f"\n👤 Пациент: {patient}\n\n"
             f"Если хотите записаться снова — посетите наш сайт."
         )
-        send_max_message(appt['patient_phone'], msg)
+        # Уведомление ставится в очередь той же транзакцией, что и отмена: без отмены его не будет, и наоборот
+        enqueue_max_message(conn, appt['patient_phone'], msg)
+        conn.commit()
+        release_db(conn)
 
         return {
             'statusCode': 200,
@@ -227,7 +322,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             })
         }
 
-    conn.close()
+    release_db(conn)
     return {
         'statusCode': 400,
         'headers': {'Content-Type': 'application/json', **CORS},
@@ -2,8 +2,72 @@ import json
 import os
 from datetime import datetime
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool, PoolError
 from psycopg2.extras import RealDictCursor
 from typing import Dict, Any
+from time import monotonic
+
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+DB_STATEMENT_TIMEOUT_MS = 10000
+DB_PING_AFTER_SECONDS = 30
+
+# shared:db_pool — копия tools/shared/db_pool.py, правится там (python tools/sync_shared.py)
+_db_pool = None
+_db_last_used = {}
+
+
+def _db_alive(conn) -> bool:
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def get_db():
+    """Соединение из пула, живущего между тёплыми вызовами функции.
+    Простаивавшее дольше DB_PING_AFTER_SECONDS соединение проверяется и при обрыве пересоздаётся."""
+    global _db_pool
+    dsn = os.environ['DATABASE_URL']
+    options = f'-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}'
+    if _db_pool is None or _db_pool.closed:
+        _db_pool = ThreadedConnectionPool(1, DB_POOL_MAX, dsn, options=options)
+    for _ in range(DB_POOL_MAX + 1):
+        try:
+            conn = _db_pool.getconn()
+        except PoolError:
+            return psycopg2.connect(dsn, options=options)
+        idle = monotonic() - _db_last_used.get(id(conn), monotonic())
+        if not conn.closed and (idle < DB_PING_AFTER_SECONDS or _db_alive(conn)):
+            return conn
+        _db_last_used.pop(id(conn), None)
+        _db_pool.putconn(conn, close=True)
+    return psycopg2.connect(dsn, options=options)
+
+
+def release_db(conn):
+    """Вернуть соединение в пул; незавершённая транзакция откатывается"""
+    broken = conn.closed
+    if not broken:
+        try:
+            conn.rollback()
+            conn.autocommit = False
+        except psycopg2.Error:
+            broken = True
+    if broken:
+        _db_last_used.pop(id(conn), None)
+    else:
+        _db_last_used[id(conn)] = monotonic()
+    try:
+        _db_pool.putconn(conn, close=broken)
+    except (PoolError, AttributeError):
+        conn.close()
+# end shared:db_pool
+
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
@@ -37,7 +101,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     # Получаем IP-адрес клиента
     source_ip = event.get('requestContext', {}).get('identity', {}).get('sourceIp', '')
     
-    conn = psycopg2.connect(database_url)
+    conn = get_db()
     
     try:
         # Проверка блокировки IP
@@ -187,7 +251,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             }
     
     finally:
-        conn.close()
+        release_db(conn)
 
 
 def upsert_registry(cursor, full_name, phone, email, source):
@@ -251,4 +315,14 @@ def upsert_registry(cursor, full_name, phone, email, source):
     cursor.execute(
         "INSERT INTO t_p30358746_hospital_website_red.reest_phone_max (full_name, phone, email, source_type, source, complaint_date) VALUES (%s, %s, %s, %s, %s, %s)",
         (full_name, phone or None, email or None, source, source, now)
-    )
\ No newline at end of file
+    )
+    bump_registry_stats(cursor, source, 1)
+
+
+def bump_registry_stats(cursor, source, delta):
+    """Поправить счётчик registry_source_stats в той же транзакции, что и вставка в реестр"""
+    cursor.execute(
+        "INSERT INTO t_p30358746_hospital_website_red.registry_source_stats (source, records) VALUES (%s, %s) "
+        "ON CONFLICT (source) DO UPDATE SET records = registry_source_stats.records + EXCLUDED.records, updated_at = NOW()",
+        (source or '', delta)
+    )
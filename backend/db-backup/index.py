@@ -1,17 +1,28 @@
 """
 Сервис архивирования баз данных в S3-хранилище.
-Поддерживает резервное копирование таблиц по расписанию, разовый полный архив, просмотр и очистку старых архивов.
+Поддерживает резервное копирование таблиц по расписанию, разовый полный архив, просмотр, восстановление
+и очистку старых архивов.
 """
+import csv
+import gzip
 import json
 import os
-import csv
-import io
+import zlib
 import boto3
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool, PoolError
 from datetime import datetime, time, timedelta, timezone
+from time import monotonic
+from concurrent.futures import ThreadPoolExecutor
 
 SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 't_p30358746_hospital_website_red')
 BACKUP_TABLES = ['appointments_v2', 'daily_schedules', 'doctor_calendar', 'doctor_schedules']
+RESTORE_SCHEMA = f'{SCHEMA}_restore'
+MSK = timezone(timedelta(hours=3))
+BACKUP_LOCK_ID = 730002
+# Разовый полный архив в фоне (job-worker): после рассылок и уведомлений
+BACKUP_JOB_PRIORITY = -10
+RESTORE_COPY_CHUNK = 1024 * 1024
 
 CORS_HEADERS = {
     'Access-Control-Allow-Origin': '*',
@@ -29,102 +40,964 @@ def get_s3():
     )
 
 
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+DB_STATEMENT_TIMEOUT_MS = 600000
+DB_PING_AFTER_SECONDS = 30
+
+# shared:db_pool — копия tools/shared/db_pool.py, правится там (python tools/sync_shared.py)
+_db_pool = None
+_db_last_used = {}
+
+
+def _db_alive(conn) -> bool:
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
 def get_db():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+    """Соединение из пула, живущего между тёплыми вызовами функции.
+    Простаивавшее дольше DB_PING_AFTER_SECONDS соединение проверяется и при обрыве пересоздаётся."""
+    global _db_pool
+    dsn = os.environ['DATABASE_URL']
+    options = f'-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}'
+    if _db_pool is None or _db_pool.closed:
+        _db_pool = ThreadedConnectionPool(1, DB_POOL_MAX, dsn, options=options)
+    for _ in range(DB_POOL_MAX + 1):
+        try:
+            conn = _db_pool.getconn()
+        except PoolError:
+            return psycopg2.connect(dsn, options=options)
+        idle = monotonic() - _db_last_used.get(id(conn), monotonic())
+        if not conn.closed and (idle < DB_PING_AFTER_SECONDS or _db_alive(conn)):
+            return conn
+        _db_last_used.pop(id(conn), None)
+        _db_pool.putconn(conn, close=True)
+    return psycopg2.connect(dsn, options=options)
+
+
+def release_db(conn):
+    """Вернуть соединение в пул; незавершённая транзакция откатывается"""
+    broken = conn.closed
+    if not broken:
+        try:
+            conn.rollback()
+            conn.autocommit = False
+        except psycopg2.Error:
+            broken = True
+    if broken:
+        _db_last_used.pop(id(conn), None)
+    else:
+        _db_last_used[id(conn)] = monotonic()
+    try:
+        _db_pool.putconn(conn, close=broken)
+    except (PoolError, AttributeError):
+        conn.close()
+# end shared:db_pool
+
+
+# Часть multipart-загрузки: минимум S3 — 5 МиБ. На каждую выгружаемую таблицу в памяти
+# не больше буфера и BACKUP_UPLOADS_IN_FLIGHT отправляемых частей.
+BACKUP_PART_SIZE = 5 * 1024 * 1024
+BACKUP_UPLOADS_IN_FLIGHT = 2
+BACKUP_WORKERS = int(os.environ.get('BACKUP_WORKERS', '3'))
+BACKUP_WATERMARK_OVERLAP = timedelta(minutes=5)
+# Прерванный запуск продолжается не больше BACKUP_RUN_MAX_ATTEMPTS раз и не после долгого простоя
+BACKUP_RUN_MAX_ATTEMPTS = 3
+BACKUP_RUN_STALE = timedelta(hours=6)
+
+
+def file_url(key):
+    return f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{key}"
+
+
+class S3StreamUpload:
+    """Файловый объект для COPY ... TO STDOUT: копит байты до BACKUP_PART_SIZE и отправляет
+    их очередной частью multipart-загрузки. Небольшой файл уходит одним put_object.
+    С executor части отправляются в фоне, пока COPY продолжает читать таблицу."""
+
+    def __init__(self, s3, key, content_type='text/csv; charset=utf-8', executor=None):
+        self.s3 = s3
+        self.key = key
+        self.content_type = content_type
+        self.executor = executor
+        self.upload_id = None
+        self.parts = []
+        self.pending = []
+        self.buffer = bytearray()
+        self.size = 0
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.buffer += data
+        if len(self.buffer) >= BACKUP_PART_SIZE:
+            self.flush_part()
+
+    def upload_part(self, number, body):
+        resp = self.s3.upload_part(
+            Bucket='files', Key=self.key, UploadId=self.upload_id,
+            PartNumber=number, Body=body,
+        )
+        return {'ETag': resp['ETag'], 'PartNumber': number}
+
+    def flush_part(self):
+        if self.upload_id is None:
+            self.upload_id = self.s3.create_multipart_upload(
+                Bucket='files', Key=self.key, ContentType=self.content_type,
+            )['UploadId']
+        number = len(self.parts) + len(self.pending) + 1
+        body = bytes(self.buffer)
+        self.buffer = bytearray()
+        self.size += len(body)
+        if self.executor is None:
+            self.parts.append(self.upload_part(number, body))
+            return
+        while len(self.pending) >= BACKUP_UPLOADS_IN_FLIGHT:
+            self.parts.append(self.pending.pop(0).result())
+        self.pending.append(self.executor.submit(self.upload_part, number, body))
+
+    def close(self):
+        if self.upload_id is None:
+            self.s3.put_object(Bucket='files', Key=self.key, Body=bytes(self.buffer), ContentType=self.content_type)
+            self.size += len(self.buffer)
+            self.buffer = bytearray()
+            return
+        if self.buffer:
+            self.flush_part()
+        while self.pending:
+            self.parts.append(self.pending.pop(0).result())
+        self.s3.complete_multipart_upload(
+            Bucket='files', Key=self.key, UploadId=self.upload_id,
+            MultipartUpload={'Parts': self.parts},
+        )
+
+    def abort(self):
+        for future in self.pending:
+            try:
+                future.result()
+            except Exception:
+                pass
+        self.pending = []
+        if self.upload_id is not None:
+            try:
+                self.s3.abort_multipart_upload(Bucket='files', Key=self.key, UploadId=self.upload_id)
+            except Exception as e:
+                print(f'[s3 abort error] key={self.key} error={e}')
+
+
+class GzipStream:
+    """Сжатие gzip на лету перед записью в S3StreamUpload"""
+
+    def __init__(self, target):
+        self.target = target
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+
+    @property
+    def size(self):
+        return self.target.size
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        chunk = self.compressor.compress(data)
+        if chunk:
+            self.target.write(chunk)
+
+    def close(self):
+        self.target.write(self.compressor.flush())
+        self.target.close()
 
+    def abort(self):
+        self.target.abort()
 
-def table_to_csv(conn, table_name):
+
+def is_partitioned(cur, table):
+    cur.execute('''
+        SELECT c.relkind = 'p' FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = %s AND c.relname = %s
+    ''', (SCHEMA, table))
+    row = cur.fetchone()
+    return bool(row and row[0])
+
+
+def without_partitions(cur, tables):
+    """Список без секций, родитель которых тоже в нём: их строки уже входят в родительскую таблицу"""
+    cur.execute('''
+        SELECT child.relname FROM pg_inherits i
+        JOIN pg_class child ON child.oid = i.inhrelid
+        JOIN pg_class parent ON parent.oid = i.inhparent
+        JOIN pg_namespace n ON n.oid = child.relnamespace
+        WHERE n.nspname = %s AND child.relispartition AND parent.relname = ANY(%s)
+    ''', (SCHEMA, list(tables)))
+    partitions = {row[0] for row in cur.fetchall()}
+    return [t for t in tables if t not in partitions]
+
+
+def export_table_csv(conn, s3, key, table_name, executor=None, query=None):
+    """Выгрузить таблицу (или запрос по ней) в S3 сжатым потоком COPY ... TO STDOUT —
+    память не зависит от размера таблицы"""
+    upload = GzipStream(S3StreamUpload(s3, key, 'application/gzip', executor))
+    cur = conn.cursor()
+    if query is None and is_partitioned(cur, table_name):
+        # COPY секционированной таблицы напрямую не поддерживается — строки всех секций через SELECT
+        query = f'SELECT * FROM "{SCHEMA}"."{table_name}"'
+    source = f'({query})' if query else f'"{SCHEMA}"."{table_name}"'
+    try:
+        cur.copy_expert(f'COPY {source} TO STDOUT WITH (FORMAT csv, HEADER true)', upload)
+        upload.close()
+        rows = cur.rowcount
+    except Exception:
+        upload.abort()
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return file_url(key), upload.size, rows
+
+
+def delta_query(cur, table, watermark):
+    """Строки, изменённые после водяного знака прошлого запуска. Знак по updated_at сдвигается
+    назад на BACKUP_WATERMARK_OVERLAP: транзакция, начатая до снимка и завершённая после,
+    проставит updated_at раньше знака. Повторы безвредны — восстановление заменяет строки по id."""
+    since = watermark.get('updated_at')
+    if since is None:
+        return f'SELECT * FROM "{SCHEMA}"."{table}"'
+    since = datetime.fromisoformat(since) - BACKUP_WATERMARK_OVERLAP
+    return cur.mogrify(
+        f'SELECT * FROM "{SCHEMA}"."{table}" WHERE updated_at >= %s OR id > %s',
+        (since, watermark.get('max_id') or 0),
+    ).decode('utf-8')
+
+
+def export_in_snapshot(snapshot_id, s3, folder, table, executor, watermark=None, progress=None):
+    """Выгрузка одной таблицы в отдельном соединении из общего снимка резервной копии.
+    С watermark выгружаются только изменённые строки и список всех id таблицы — по нему
+    при восстановлении удаляются строки, удалённые после прошлого запуска.
+    progress(conn, result) вызывается по завершении таблицы на этом же соединении вне снимка."""
+    name = f'{table}.csv.gz'
+    conn = get_db()
+    try:
+        result = export_snapshot_table(conn, snapshot_id, s3, folder, table, name, executor, watermark)
+        if progress is not None:
+            conn.rollback()
+            try:
+                progress(conn, result)
+            except Exception as e:
+                conn.rollback()
+                print(f'[backup progress error] table={table} error={e}')
+        return result
+    finally:
+        release_db(conn)
+
+
+def export_snapshot_table(conn, snapshot_id, s3, folder, table, name, executor, watermark):
+    try:
+        cur = conn.cursor()
+        cur.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
+        cur.execute('SET TRANSACTION SNAPSHOT %s', (snapshot_id,))
+        query = delta_query(cur, table, watermark) if watermark is not None else None
+        cur.close()
+        url, size, row_count = export_table_csv(conn, s3, f'{folder}/{name}', table, executor, query)
+        result = {'table': table, 'name': name, 'rows': row_count, 'url': url, 'size': size, 'success': True}
+        if watermark is not None:
+            ids_name = f'{table}.ids.csv.gz'
+            ids_url, ids_size, ids_count = export_table_csv(
+                conn, s3, f'{folder}/{ids_name}', table, executor, f'SELECT id FROM "{SCHEMA}"."{table}"'
+            )
+            result['ids'] = {'name': ids_name, 'url': ids_url, 'size': ids_size, 'rows': ids_count}
+        return result
+    except Exception as e:
+        print(f'[backup error] table={table} error={e}')
+        return {'table': table, 'name': name, 'error': str(e), 'success': False}
+
+
+def table_watermarks(cur, tables):
+    """Водяные знаки (максимальные updated_at и id) по таблицам в текущем снимке"""
+    watermarks = {}
+    for table in tables:
+        cur.execute(f'SELECT MAX(updated_at), MAX(id) FROM "{SCHEMA}"."{table}"')
+        max_updated, max_id = cur.fetchone()
+        watermarks[table] = {
+            'updated_at': max_updated.isoformat() if max_updated else None,
+            'max_id': max_id,
+        }
+    return watermarks
+
+
+def run_backup(conn, s3, folder, tables, since=None, track_watermarks=False, progress=None):
+    """Параллельная выгрузка таблиц из одного согласованного снимка.
+    Транзакция conn экспортирует снимок и держит его открытым, пока работают BACKUP_WORKERS;
+    крупные таблицы запускаются первыми, отправка частей в S3 идёт параллельно с чтением.
+    since — водяные знаки прошлого запуска по таблицам: выгружается дельта.
+    progress(conn, result, watermark) — отметка о готовой таблице, вызывается из потока выгрузки.
+    Возвращает результаты по таблицам и водяные знаки этого снимка (если track_watermarks)."""
+    conn.rollback()
     cur = conn.cursor()
-    cur.execute(f'SELECT * FROM "{SCHEMA}"."{table_name}"')
-    rows = cur.fetchall()
-    cols = [desc[0] for desc in cur.description]
+    cur.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
+    cur.execute('SELECT pg_export_snapshot()')
+    snapshot_id = cur.fetchone()[0]
+    cur.execute('''
+        SELECT c.relname FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = %s AND c.relname = ANY(%s)
+        ORDER BY pg_total_relation_size(c.oid) DESC
+    ''', (SCHEMA, list(tables)))
+    ordered = [row[0] for row in cur.fetchall()]
+    ordered += [t for t in tables if t not in ordered]
+    watermarks = table_watermarks(cur, tables) if track_watermarks else {}
     cur.close()
-    buf = io.StringIO()
-    writer = csv.writer(buf)
-    writer.writerow(cols)
-    writer.writerows(rows)
-    return buf.getvalue(), len(rows)
-
-
-def upload_csv(s3, key, content):
-    encoded = content.encode('utf-8')
-    s3.put_object(
-        Bucket='files',
-        Key=key,
-        Body=encoded,
-        ContentType='text/csv; charset=utf-8',
-    )
-    url = f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{key}"
-    return url, len(encoded)
+
+    try:
+        with ThreadPoolExecutor(max_workers=BACKUP_WORKERS * BACKUP_UPLOADS_IN_FLIGHT) as uploads, \
+                ThreadPoolExecutor(max_workers=BACKUP_WORKERS) as workers:
+            results = list(workers.map(
+                lambda table: export_in_snapshot(
+                    snapshot_id, s3, folder, table, uploads,
+                    since.get(table, {}) if since is not None else None,
+                    (lambda c, r: progress(c, r, watermarks.get(r['table']))) if progress else None,
+                ),
+                ordered
+            ))
+    finally:
+        conn.rollback()
+    return sorted(results, key=lambda r: r['table']), watermarks
+
+
+def get_last_scheduled(conn):
+    """Последняя копия цепочки по расписанию и время её базовой копии"""
+    cur = conn.cursor()
+    cur.execute(f'''
+        SELECT r.folder, r.base_folder, r.watermarks, b.created_at
+        FROM "{SCHEMA}".backup_records r
+        LEFT JOIN "{SCHEMA}".backup_records b ON b.folder = r.base_folder AND b.mode = 'base'
+        WHERE r.mode IN ('base', 'delta')
+        ORDER BY r.created_at DESC
+        LIMIT 1
+    ''')
+    row = cur.fetchone()
+    cur.close()
+    if not row:
+        return None
+    raw = row[2]
+    return {
+        'folder': row[0],
+        'base_folder': row[1],
+        'watermarks': raw if isinstance(raw, dict) else (json.loads(raw) if raw else {}),
+        'base_created_at': row[3],
+    }
 
 
 def get_backup_settings(conn):
     cur = conn.cursor()
     cur.execute(f'''
-        SELECT enabled, start_time, end_time, repeat_minutes, retention_days
+        SELECT enabled, start_time, end_time, repeat_minutes, retention_days, baseline_hours
         FROM "{SCHEMA}".backup_settings
         WHERE id = 1
     ''')
     row = cur.fetchone()
     cur.close()
     if not row:
-        return {'enabled': False, 'start_time': '02:00', 'end_time': '04:00', 'repeat_minutes': 0, 'retention_days': 0}
+        return {'enabled': False, 'start_time': '02:00', 'end_time': '04:00', 'repeat_minutes': 0, 'retention_days': 0, 'baseline_hours': 24}
     return {
         'enabled': row[0],
         'start_time': str(row[1])[:5] if row[1] else '02:00',
         'end_time': str(row[2])[:5] if row[2] else '04:00',
         'repeat_minutes': row[3] or 0,
         'retention_days': row[4] or 0,
+        'baseline_hours': row[5] or 24,
     }
 
 
-def save_backup_record(conn, folder, full, results):
+def save_backup_record(conn, folder, full, results, mode='snapshot', base_folder=None, watermarks=None):
     success_results = [r for r in results if r.get('success')]
     total_rows = sum(r.get('rows', 0) for r in success_results)
-    files_json = json.dumps([
-        {'name': r['table'] + '.csv', 'url': r['url'], 'size': r.get('size', 0), 'rows': r.get('rows', 0)}
-        for r in success_results
-    ])
+    files = []
+    for r in success_results:
+        files.append({'name': r['name'], 'table': r['table'], 'url': r['url'], 'size': r.get('size', 0), 'rows': r.get('rows', 0)})
+        if r.get('ids'):
+            files.append({**r['ids'], 'table': r['table'], 'kind': 'ids'})
+    cur = conn.cursor()
+    cur.execute(f'''
+        INSERT INTO "{SCHEMA}".backup_records (folder, full_backup, tables_count, total_rows, files, mode, base_folder, watermarks)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    ''', (folder, full, len(success_results), total_rows, json.dumps(files), mode, base_folder, json.dumps(watermarks or {})))
+    conn.commit()
+    cur.close()
+
+
+# shared:backup_schedule — копия tools/shared/backup_schedule.py, правится там (python tools/sync_shared.py)
+def backup_due(settings, last_started, now):
+    """Пора ли запускать плановую копию и когда следующий запуск.
+    Окно start_time–end_time по МСК (может переходить через полночь); repeat_minutes — интервал
+    между запусками внутри окна, 0 — один запуск за окно. Возвращает (пора, время следующего запуска)."""
+    if not settings['enabled']:
+        return False, None
+    start = time(*map(int, settings['start_time'].split(':')))
+    end = time(*map(int, settings['end_time'].split(':')))
+    window_start = now.replace(hour=start.hour, minute=start.minute, second=0, microsecond=0)
+    window_end = now.replace(hour=end.hour, minute=end.minute, second=59, microsecond=0)
+    if window_end < window_start:
+        if now <= window_end:
+            window_start -= timedelta(days=1)
+        else:
+            window_end += timedelta(days=1)
+    if now > window_end:
+        window_start += timedelta(days=1)
+        window_end += timedelta(days=1)
+    if now < window_start:
+        return False, window_start
+    if last_started is None or last_started < window_start:
+        return True, now
+    if settings['repeat_minutes'] > 0:
+        next_run = last_started + timedelta(minutes=settings['repeat_minutes'])
+        if next_run <= now:
+            return True, now
+        if next_run <= window_end:
+            return False, next_run
+    return False, window_start + timedelta(days=1)
+# end shared:backup_schedule
+
+
+def acquire_backup_lock(conn) -> bool:
+    """Сессионная блокировка плановой копии: пока соединение живо, второй запуск не начнётся.
+    Если функцию прервут по таймауту, соединение закроется и блокировка снимется сама."""
+    cur = conn.cursor()
+    cur.execute('SELECT pg_try_advisory_lock(%s)', (BACKUP_LOCK_ID,))
+    locked = cur.fetchone()[0]
+    conn.commit()
+    cur.close()
+    return locked
+
+
+def release_backup_lock(conn):
+    conn.rollback()
+    cur = conn.cursor()
+    cur.execute('SELECT pg_advisory_unlock(%s)', (BACKUP_LOCK_ID,))
+    conn.commit()
+    cur.close()
+
+
+def get_open_run(conn, run_id=None):
+    """Незавершённый плановый запуск из журнала backup_runs (прерванный таймаутом)"""
+    cur = conn.cursor()
+    cur.execute(f'''
+        SELECT id, folder, mode, base_folder, since, tables, done, attempts, heartbeat_at
+        FROM "{SCHEMA}".backup_runs
+        WHERE status = 'running' AND (%s::integer IS NULL OR id = %s::integer)
+        ORDER BY id DESC
+        LIMIT 1
+    ''', (run_id, run_id))
+    row = cur.fetchone()
+    cur.close()
+    if not row:
+        return None
+    parse = lambda raw: raw if isinstance(raw, (dict, list)) else (json.loads(raw) if raw else None)
+    return {
+        'id': row[0], 'folder': row[1], 'mode': row[2], 'base_folder': row[3],
+        'since': parse(row[4]), 'tables': parse(row[5]) or [], 'done': parse(row[6]) or {},
+        'attempts': row[7], 'heartbeat_at': row[8],
+    }
+
+
+def last_run_started(conn):
+    cur = conn.cursor()
+    cur.execute(f'SELECT MAX(started_at) FROM "{SCHEMA}".backup_runs')
+    row = cur.fetchone()
+    cur.close()
+    return row[0] if row else None
+
+
+def create_run(conn, folder, mode, base_folder, since, tables):
     cur = conn.cursor()
     cur.execute(f'''
-        INSERT INTO "{SCHEMA}".backup_records (folder, full_backup, tables_count, total_rows, files)
+        INSERT INTO "{SCHEMA}".backup_runs (folder, mode, base_folder, since, tables)
         VALUES (%s, %s, %s, %s, %s)
-    ''', (folder, full, len(success_results), total_rows, files_json))
+        RETURNING id
+    ''', (folder, mode, base_folder, json.dumps(since) if since is not None else None, json.dumps(tables)))
+    run_id = cur.fetchone()[0]
+    conn.commit()
+    cur.close()
+    return {'id': run_id, 'folder': folder, 'mode': mode, 'base_folder': base_folder,
+            'since': since, 'tables': tables, 'done': {}, 'attempts': 1, 'heartbeat_at': datetime.now(timezone.utc)}
+
+
+def record_run_progress(conn, run_id, result, watermark):
+    """Отметить таблицу в журнале запуска — после прерывания она не выгружается повторно"""
+    cur = conn.cursor()
+    cur.execute(f'''
+        UPDATE "{SCHEMA}".backup_runs
+        SET done = done || jsonb_build_object(%s, %s::jsonb), heartbeat_at = NOW()
+        WHERE id = %s
+    ''', (result['table'], json.dumps({'result': result, 'watermark': watermark}), run_id))
+    conn.commit()
+    cur.close()
+
+
+def finish_run(conn, run_id, status='done'):
+    cur = conn.cursor()
+    cur.execute(f'''
+        UPDATE "{SCHEMA}".backup_runs SET status = %s, finished_at = NOW(), heartbeat_at = NOW()
+        WHERE id = %s
+    ''', (status, run_id))
     conn.commit()
     cur.close()
 
 
-def delete_s3_folder(s3, folder):
+def run_scheduled(conn):
+    """Плановая копия под блокировкой: продолжить прерванный запуск или начать новый, если пора"""
+    settings = get_backup_settings(conn)
+    run = get_open_run(conn)
+    resumed = run is not None
+    abandoned = None
+
+    if run is None:
+        due, next_due = backup_due(settings, last_run_started(conn), datetime.now(MSK))
+        if not due:
+            return {
+                'statusCode': 200,
+                'headers': {**CORS_HEADERS, 'Content-Type': 'application/json'},
+                'body': json.dumps({
+                    'success': True,
+                    'skipped': True,
+                    'reason': 'backup disabled' if not settings['enabled'] else 'not due',
+                    'next_due': next_due.isoformat() if next_due else None,
+                }),
+            }
+
+        dt_str = (datetime.now(timezone.utc) + timedelta(hours=3)).strftime('%Y-%m-%d_%H-%M-%S')
+        folder = f'backups/{dt_str}'
+        # Дельта от прошлого запуска, пока базовая копия цепочки моложе baseline_hours
+        last = get_last_scheduled(conn)
+        baseline_due = (
+            last is None
+            or last['base_created_at'] is None
+            or datetime.now(timezone.utc) - last['base_created_at'] >= timedelta(hours=settings['baseline_hours'])
+            or set(last['watermarks']) != set(BACKUP_TABLES)
+        )
+        if baseline_due:
+            run = create_run(conn, folder, 'base', folder, None, BACKUP_TABLES)
+        else:
+            run = create_run(conn, folder, 'delta', last['base_folder'], last['watermarks'], BACKUP_TABLES)
+    else:
+        stale = datetime.now(timezone.utc) - run['heartbeat_at'] > BACKUP_RUN_STALE if run['heartbeat_at'] else False
+        if run['attempts'] >= BACKUP_RUN_MAX_ATTEMPTS or stale:
+            # Таблица, которая каждый раз не успевает до таймаута, не должна держать запуск открытым вечно:
+            # невыгруженные таблицы отмечаются ошибкой, и следующий плановый запуск начнётся как обычно
+            abandoned = f'запуск прерывался {run["attempts"]} раз' if not stale else 'запуск давно не продвигался'
+        else:
+            cur = conn.cursor()
+            cur.execute(f'UPDATE "{SCHEMA}".backup_runs SET attempts = attempts + 1, heartbeat_at = NOW() WHERE id = %s', (run['id'],))
+            conn.commit()
+            cur.close()
+
+    s3 = get_s3()
+    since = run['since']
+    remaining = [t for t in run['tables'] if t not in run['done']]
+    if remaining and not abandoned:
+        run_backup(
+            conn, s3, run['folder'], remaining, since=since, track_watermarks=True,
+            progress=lambda c, result, watermark: record_run_progress(c, run['id'], result, watermark),
+        )
+
+    done = get_open_run(conn, run['id'])['done']
+    results = [done[t]['result'] for t in run['tables'] if t in done]
+    if abandoned:
+        results += [{'table': t, 'name': f'{t}.csv.gz', 'error': abandoned, 'success': False}
+                    for t in run['tables'] if t not in done]
+    watermarks = {}
+    for t in run['tables']:
+        entry = done.get(t)
+        if entry and entry['result']['success'] and entry.get('watermark') is not None:
+            watermarks[t] = entry['watermark']
+        elif since is not None and t in since:
+            # Для таблиц, выгрузка которых не удалась, знак остаётся прежним — их изменения попадут в следующую дельту
+            watermarks[t] = since[t]
+
+    # Без единой готовой таблицы копии нет — запуск только закрывается
+    if not abandoned or any(r['success'] for r in results):
+        save_backup_record(conn, run['folder'], False, results, mode=run['mode'], base_folder=run['base_folder'], watermarks=watermarks)
+    finish_run(conn, run['id'], 'failed' if abandoned else 'done')
+
+    deleted, reclaimed = 0, 0
+    if settings['retention_days'] > 0:
+        deleted, reclaimed = delete_old_records(conn, settings['retention_days'], s3)
+
+    return {
+        'statusCode': 200,
+        'headers': {**CORS_HEADERS, 'Content-Type': 'application/json'},
+        'body': json.dumps({
+            'success': True,
+            'folder': run['folder'],
+            'mode': run['mode'],
+            'resumed': resumed,
+            'abandoned': abandoned,
+            'results': results,
+            'deleted_old': deleted,
+            'bytes_reclaimed': reclaimed,
+        }),
+    }
+
+
+def backup_tables(conn, folder, full):
+    """Разовый архив в folder: основные таблицы или, для полного, все таблицы схемы"""
+    tables = BACKUP_TABLES
+    if full:
+        cur = conn.cursor()
+        # Секции выгружаются в составе родительской таблицы, а не отдельными файлами
+        cur.execute('''
+            SELECT c.relname FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = %s AND c.relkind IN ('r', 'p') AND NOT c.relispartition
+            ORDER BY c.relname
+        ''', (SCHEMA,))
+        tables = [row[0] for row in cur.fetchall()]
+        cur.close()
+
+    results, _ = run_backup(conn, get_s3(), folder, tables)
+    save_backup_record(conn, folder, full, results)
+    return results
+
+
+def get_backup_record(conn, folder):
+    cur = conn.cursor()
+    cur.execute(f'''
+        SELECT tables_count, total_rows, created_at FROM "{SCHEMA}".backup_records WHERE folder = %s
+    ''', (folder,))
+    row = cur.fetchone()
+    cur.close()
+    if not row:
+        return None
+    return {'tables_count': row[0], 'total_rows': row[1], 'created_at': row[2].isoformat()}
+
+
+# shared:background_jobs — копия tools/shared/background_jobs.py, правится там (python tools/sync_shared.py)
+def enqueue_job(conn, kind, payload, priority=0, dedupe_key=None):
+    """Поставить задание в background_jobs в текущей транзакции (коммитит вызывающий).
+    Пока задание с тем же dedupe_key ждёт или выполняется, возвращается его id."""
+    cur = conn.cursor()
+    for _ in range(2):
+        cur.execute(f'''
+            INSERT INTO "{SCHEMA}".background_jobs (kind, payload, priority, dedupe_key)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (dedupe_key) WHERE status IN ('queued', 'running') DO NOTHING
+            RETURNING id
+        ''', (kind, json.dumps(payload), priority, dedupe_key))
+        row = cur.fetchone()
+        if row is None:
+            cur.execute(f'''
+                SELECT id FROM "{SCHEMA}".background_jobs WHERE dedupe_key = %s AND status IN ('queued', 'running')
+            ''', (dedupe_key,))
+            row = cur.fetchone()
+        if row is not None:
+            break
+    cur.close()
+    return row[0]
+# end shared:background_jobs
+
+
+def get_backup_job(conn, job_id):
+    """Фоновое задание архива: состояние, попытки и ответ (results) после выполнения"""
+    cur = conn.cursor()
+    cur.execute(f'''
+        SELECT id, status, payload, attempts, result, last_error, created_at, finished_at
+        FROM "{SCHEMA}".background_jobs
+        WHERE id = %s AND kind = 'db_backup'
+    ''', (job_id,))
+    row = cur.fetchone()
+    cur.close()
+    if not row:
+        return None
+    return {
+        'id': row[0],
+        'status': row[1],
+        'payload': row[2] or {},
+        'attempts': row[3],
+        'result': row[4],
+        'last_error': row[5],
+        'created_at': row[6].isoformat(),
+        'finished_at': row[7].isoformat() if row[7] else None,
+    }
+
+
+def verify_admin_token(token, conn) -> bool:
+    """Проверка токена администратора через БД"""
+    if not token:
+        return False
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            f'SELECT id FROM "{SCHEMA}".admins WHERE password_hash = %s AND is_active = true',
+            (token,)
+        )
+        return cur.fetchone() is not None
+    finally:
+        cur.close()
+
+
+def backup_files(raw):
+    """Файлы копии по таблицам: {'rows': файл строк, 'ids': список id (только у дельт)}"""
+    files_data = raw if isinstance(raw, list) else (json.loads(raw) if raw else [])
+    files = {}
+    for f in files_data:
+        table = f.get('table') or f['name'].split('.')[0]
+        files.setdefault(table, {})[f.get('kind', 'rows')] = f
+    return files
+
+
+def load_restore_chain(conn, folder):
+    """Копии, которые нужно загрузить по порядку: сама копия или её базовая + дельты до неё включительно"""
+    cur = conn.cursor()
+    cur.execute(f'''
+        SELECT folder, mode, base_folder, files, created_at
+        FROM "{SCHEMA}".backup_records WHERE folder = %s
+    ''', (folder,))
+    target = cur.fetchone()
+    chain = [target] if target else []
+    if target and target[1] == 'delta':
+        cur.execute(f'''
+            SELECT folder, mode, base_folder, files, created_at
+            FROM "{SCHEMA}".backup_records
+            WHERE (folder = %s AND mode = 'base')
+               OR (mode = 'delta' AND base_folder = %s AND created_at <= %s)
+            ORDER BY mode = 'delta', created_at
+        ''', (target[2], target[2], target[4]))
+        chain = cur.fetchall()
+        if not chain or chain[0][1] != 'base':
+            chain = []
+    cur.close()
+    return [{'folder': r[0], 'mode': r[1], 'files': backup_files(r[3])} for r in chain]
+
+
+def copy_backup_file(cur, s3, key, target):
+    """COPY FROM STDIN из файла архива потоком из S3; столбцы берутся из заголовка CSV"""
+    body = s3.get_object(Bucket='files', Key=key)['Body']
+    stream = gzip.GzipFile(fileobj=body) if key.endswith('.gz') else body
+    try:
+        columns = next(csv.reader([stream.readline().decode('utf-8')]))
+        column_list = ', '.join(f'"{c}"' for c in columns)
+        cur.copy_expert(f'COPY {target} ({column_list}) FROM STDIN WITH (FORMAT csv)', stream, size=RESTORE_COPY_CHUNK)
+        return cur.rowcount
+    finally:
+        stream.close()
+        body.close()
+
+
+def check_rows(report, what, expected, loaded):
+    if expected is not None and expected != loaded:
+        report['ok'] = False
+        report['errors'].append(f'{what}: ожидалось {expected} строк, загружено {loaded}')
+
+
+def stage_table(s3, chain, table):
+    """Собрать таблицу в схеме RESTORE_SCHEMA: базовая копия, затем дельты — замена строк по id
+    и удаление id, которых нет в списке. Число строк каждого файла сверяется с backup_records.files."""
+    main = f'"{SCHEMA}"."{table}"'
+    staged = f'"{RESTORE_SCHEMA}"."{table}"'
+    report = {'table': table, 'ok': True, 'errors': [], 'rows': 0}
+    conn = get_db()
+    cur = conn.cursor()
     try:
-        paginator = s3.get_paginator('list_objects_v2')
-        pages = paginator.paginate(Bucket='files', Prefix=folder + '/')
-        keys = []
-        for page in pages:
-            for obj in page.get('Contents', []):
-                keys.append({'Key': obj['Key']})
-        if keys:
-            s3.delete_objects(Bucket='files', Delete={'Objects': keys})
+        cur.execute(f'DROP TABLE IF EXISTS {staged}')
+        cur.execute(f'CREATE TABLE {staged} (LIKE {main})')
+        base = chain[0]['files'][table]['rows']
+        loaded = copy_backup_file(cur, s3, f"{chain[0]['folder']}/{base['name']}", staged)
+        check_rows(report, base['name'], base.get('rows'), loaded)
+        expected_total = loaded
+
+        if len(chain) > 1:
+            cur.execute(f'CREATE INDEX ON {staged} (id)')
+        for delta in chain[1:]:
+            files = delta['files'].get(table)
+            if not files:
+                # Выгрузка таблицы в этом запуске не удалась — её изменения вошли в следующую дельту
+                continue
+            cur.execute(f'CREATE TEMP TABLE _restore_rows AS SELECT * FROM {staged} WITH NO DATA')
+            loaded = copy_backup_file(cur, s3, f"{delta['folder']}/{files['rows']['name']}", '_restore_rows')
+            check_rows(report, f"{delta['folder']}/{files['rows']['name']}", files['rows'].get('rows'), loaded)
+            cur.execute(f'DELETE FROM {staged} t USING _restore_rows r WHERE t.id = r.id')
+            cur.execute(f'INSERT INTO {staged} SELECT * FROM _restore_rows')
+            cur.execute('DROP TABLE _restore_rows')
+            if 'ids' in files:
+                cur.execute('CREATE TEMP TABLE _restore_ids (id BIGINT PRIMARY KEY)')
+                loaded = copy_backup_file(cur, s3, f"{delta['folder']}/{files['ids']['name']}", '_restore_ids')
+                check_rows(report, f"{delta['folder']}/{files['ids']['name']}", files['ids'].get('rows'), loaded)
+                cur.execute(f'DELETE FROM {staged} t WHERE NOT EXISTS (SELECT 1 FROM _restore_ids i WHERE i.id = t.id)')
+                cur.execute('DROP TABLE _restore_ids')
+                expected_total = loaded
+
+        cur.execute(f'SELECT COUNT(*) FROM {staged}')
+        report['rows'] = cur.fetchone()[0]
+        check_rows(report, 'итог', expected_total, report['rows'])
+        conn.commit()
     except Exception as e:
-        print(f'[s3 delete error] folder={folder} error={e}')
+        conn.rollback()
+        print(f'[restore error] table={table} error={e}')
+        report['ok'] = False
+        report['errors'].append(str(e))
+    finally:
+        cur.close()
+        release_db(conn)
+    return report
+
+
+def dependency_order(cur, tables):
+    """Таблицы в порядке внешних ключей: сначала те, на которые ссылаются"""
+    cur.execute('''
+        SELECT child.relname, parent.relname
+        FROM pg_constraint c
+        JOIN pg_class child ON child.oid = c.conrelid
+        JOIN pg_class parent ON parent.oid = c.confrelid
+        JOIN pg_namespace n ON n.oid = child.relnamespace
+        WHERE c.contype = 'f' AND n.nspname = %s AND child.relname <> parent.relname
+    ''', (SCHEMA,))
+    parents = {}
+    for child, parent in cur.fetchall():
+        if child in tables and parent in tables:
+            parents.setdefault(child, set()).add(parent)
+    ordered, placed = [], set()
+    while len(ordered) < len(tables):
+        ready = sorted(t for t in tables if t not in placed and parents.get(t, set()) <= placed)
+        if not ready:
+            ready = sorted(t for t in tables if t not in placed)
+        ordered.extend(ready)
+        placed.update(ready)
+    return ordered
+
+
+def swap_restored(conn, tables):
+    """Заменить содержимое рабочих таблиц собранными в RESTORE_SCHEMA одной транзакцией.
+    Таблицы не переименовываются: так сохраняются внешние ключи, права и последовательности id."""
+    cur = conn.cursor()
+    try:
+        cur.execute("SET LOCAL lock_timeout = '10s'")
+        cur.execute('TRUNCATE ' + ', '.join(f'"{SCHEMA}"."{t}"' for t in tables))
+        for table in dependency_order(cur, set(tables)):
+            cur.execute(f'INSERT INTO "{SCHEMA}"."{table}" SELECT * FROM "{RESTORE_SCHEMA}"."{table}"')
+            cur.execute('SELECT pg_get_serial_sequence(%s, %s)', (f'"{SCHEMA}"."{table}"', 'id'))
+            sequence = cur.fetchone()[0]
+            if sequence:
+                cur.execute(
+                    f'SELECT setval(%s, COALESCE((SELECT MAX(id) FROM "{SCHEMA}"."{table}"), 0) + 1, false)',
+                    (sequence,)
+                )
+        if 'appointments_v2' in tables:
+            # Занятость слотов материализована в doctor_day_slots — пересобираем по восстановленным записям
+            cur.execute(f'DELETE FROM "{SCHEMA}".doctor_day_slots')
+            cur.execute(f'''
+                INSERT INTO "{SCHEMA}".doctor_day_slots (doctor_id, slot_date, booked_minutes)
+                SELECT
+                    doctor_id,
+                    appointment_date,
+                    ARRAY_AGG(DISTINCT (EXTRACT(HOUR FROM appointment_time) * 60 + EXTRACT(MINUTE FROM appointment_time))::int
+                              ORDER BY (EXTRACT(HOUR FROM appointment_time) * 60 + EXTRACT(MINUTE FROM appointment_time))::int)
+                FROM "{SCHEMA}".appointments_v2
+                WHERE status IN ('scheduled', 'completed') AND appointment_date IS NOT NULL
+                GROUP BY doctor_id, appointment_date
+            ''')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def drop_staged(conn, tables):
+    cur = conn.cursor()
+    for table in tables:
+        cur.execute(f'DROP TABLE IF EXISTS "{RESTORE_SCHEMA}"."{table}"')
+    conn.commit()
+    cur.close()
+
+
+# shared:backup_storage — копия tools/shared/backup_storage.py, правится там (python tools/sync_shared.py)
+S3_DELETE_BATCH = 1000
+S3_DELETE_WORKERS = 8
+
+
+def list_backup_objects(s3, prefix='backups/'):
+    """Все объекты под префиксом одним проходом, сгруппированные по папке:
+    папка -> {'objects': [(ключ, размер)], 'last_modified': самое позднее изменение}"""
+    folders = {}
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket='files', Prefix=prefix):
+        for obj in page.get('Contents', []):
+            folder = folders.setdefault(obj['Key'].rsplit('/', 1)[0], {'objects': [], 'last_modified': None})
+            folder['objects'].append((obj['Key'], obj.get('Size', 0)))
+            modified = obj.get('LastModified')
+            if modified and (folder['last_modified'] is None or modified > folder['last_modified']):
+                folder['last_modified'] = modified
+    return folders
+
+
+def delete_s3_keys(s3, objects):
+    """Удалить объекты пачками по S3_DELETE_BATCH ключей (предел delete_objects), пачки — параллельно.
+    Возвращает (удалено объектов, освобождено байт, ошибок)."""
+    chunks = [objects[i:i + S3_DELETE_BATCH] for i in range(0, len(objects), S3_DELETE_BATCH)]
+
+    def delete_chunk(chunk):
+        try:
+            resp = s3.delete_objects(
+                Bucket='files',
+                Delete={'Objects': [{'Key': key} for key, _ in chunk], 'Quiet': True},
+            )
+        except Exception as e:
+            print(f'[s3 delete error] keys={len(chunk)} error={e}')
+            return 0, 0, len(chunk)
+        failed = {err['Key'] for err in resp.get('Errors', [])}
+        done = [(key, size) for key, size in chunk if key not in failed]
+        return len(done), sum(size for _, size in done), len(failed)
+
+    if not chunks:
+        return 0, 0, 0
+    with ThreadPoolExecutor(max_workers=min(S3_DELETE_WORKERS, len(chunks))) as pool:
+        results = list(pool.map(delete_chunk, chunks))
+    return tuple(sum(r[i] for r in results) for i in range(3))
+# end shared:backup_storage
+
+
+def delete_s3_folders(s3, folders):
+    """Удалить папки архивов: один листинг backups/ и пакетное удаление их объектов"""
+    if not folders:
+        return 0, 0, 0
+    listed = list_backup_objects(s3)
+    objects = [obj for folder in folders if folder in listed for obj in listed[folder]['objects']]
+    return delete_s3_keys(s3, objects)
 
 
 def delete_old_records(conn, retention_days, s3=None):
     if retention_days <= 0:
-        return 0
+        return 0, 0
     cutoff = datetime.now() - timedelta(days=retention_days)
     cur = conn.cursor()
+    # Цепочка base + delta удаляется целиком, когда устарела её последняя копия:
+    # без базовой или промежуточной дельты остальные не восстановить
     cur.execute(f'''
-        DELETE FROM "{SCHEMA}".backup_records
-        WHERE created_at < %s
+        DELETE FROM "{SCHEMA}".backup_records r
+        WHERE r.created_at < %s
+          AND (r.base_folder IS NULL OR NOT EXISTS (
+              SELECT 1 FROM "{SCHEMA}".backup_records n
+              WHERE n.base_folder = r.base_folder AND n.created_at >= %s
+          ))
         RETURNING folder
-    ''', (cutoff,))
+    ''', (cutoff, cutoff))
     deleted_folders = [r[0] for r in cur.fetchall()]
     conn.commit()
     cur.close()
+    reclaimed = 0
     if s3 and deleted_folders:
-        for folder in deleted_folders:
-            delete_s3_folder(s3, folder)
-    return len(deleted_folders)
+        _, reclaimed, errors = delete_s3_folders(s3, deleted_folders)
+        if errors:
+            print(f'[s3 delete error] retention objects not deleted: {errors}')
+    return len(deleted_folders), reclaimed
 
 
 def handler(event: dict, context) -> dict:
@@ -138,7 +1011,7 @@ def handler(event: dict, context) -> dict:
     if method == 'GET' and action == 'settings':
         conn = get_db()
         settings = get_backup_settings(conn)
-        conn.close()
+        release_db(conn)
         return {
             'statusCode': 200,
             'headers': {**CORS_HEADERS, 'Content-Type': 'application/json'},
@@ -150,14 +1023,15 @@ def handler(event: dict, context) -> dict:
         conn = get_db()
         cur = conn.cursor()
         cur.execute(f'''
-            INSERT INTO "{SCHEMA}".backup_settings (id, enabled, start_time, end_time, repeat_minutes, retention_days)
-            VALUES (1, %s, %s, %s, %s, %s)
+            INSERT INTO "{SCHEMA}".backup_settings (id, enabled, start_time, end_time, repeat_minutes, retention_days, baseline_hours)
+            VALUES (1, %s, %s, %s, %s, %s, %s)
             ON CONFLICT (id) DO UPDATE SET
                 enabled = EXCLUDED.enabled,
                 start_time = EXCLUDED.start_time,
                 end_time = EXCLUDED.end_time,
                 repeat_minutes = EXCLUDED.repeat_minutes,
                 retention_days = EXCLUDED.retention_days,
+                baseline_hours = EXCLUDED.baseline_hours,
                 updated_at = NOW()
         ''', (
             body.get('enabled', False),
@@ -165,10 +1039,11 @@ def handler(event: dict, context) -> dict:
             body.get('end_time', '04:00'),
             body.get('repeat_minutes', 0),
             body.get('retention_days', 0),
+            body.get('baseline_hours', 24),
         ))
         conn.commit()
         cur.close()
-        conn.close()
+        release_db(conn)
         return {
             'statusCode': 200,
             'headers': {**CORS_HEADERS, 'Content-Type': 'application/json'},
@@ -186,12 +1061,28 @@ def handler(event: dict, context) -> dict:
             }
         conn = get_db()
         s3 = get_s3()
-        deleted = delete_old_records(conn, retention_days, s3)
-        conn.close()
+        deleted, reclaimed = delete_old_records(conn, retention_days, s3)
+        release_db(conn)
+        return {
+            'statusCode': 200,
+            'headers': {**CORS_HEADERS, 'Content-Type': 'application/json'},
+            'body': json.dumps({'success': True, 'deleted': deleted, 'bytes_reclaimed': reclaimed}),
+        }
+
+    if method == 'GET' and action == 'job':
+        conn = get_db()
+        job = get_backup_job(conn, params.get('id'))
+        release_db(conn)
+        if not job:
+            return {
+                'statusCode': 404,
+                'headers': {**CORS_HEADERS, 'Content-Type': 'application/json'},
+                'body': json.dumps({'error': 'Задание не найдено'}),
+            }
         return {
             'statusCode': 200,
             'headers': {**CORS_HEADERS, 'Content-Type': 'application/json'},
-            'body': json.dumps({'success': True, 'deleted': deleted}),
+            'body': json.dumps({'success': True, 'job': job}, default=str),
         }
 
     if method == 'POST' and action == 'backup':
@@ -206,31 +1097,48 @@ def handler(event: dict, context) -> dict:
         else:
             folder = f'backups/{dt_str}'
 
-        conn = get_db()
-        s3 = get_s3()
-        results = []
-
-        tables = BACKUP_TABLES
-        if full:
-            cur = conn.cursor()
-            cur.execute(f'''
-                SELECT tablename FROM pg_tables WHERE schemaname = %s ORDER BY tablename
-            ''', (SCHEMA,))
-            tables = [row[0] for row in cur.fetchall()]
-            cur.close()
+        if body.get('background'):
+            # Архив выполнит job-worker в фоне; папка выбирается сейчас, чтобы повторы писали в неё же
+            conn = get_db()
+            job_id = enqueue_job(conn, 'db_backup', {'full': full, 'folder': folder},
+                                 priority=BACKUP_JOB_PRIORITY, dedupe_key='db_backup')
+            conn.commit()
+            job = get_backup_job(conn, job_id)
+            release_db(conn)
+            return {
+                'statusCode': 202,
+                'headers': {**CORS_HEADERS, 'Content-Type': 'application/json'},
+                'body': json.dumps({'success': True, 'queued': True, 'job_id': job_id,
+                                    'folder': job['payload'].get('folder', folder), 'status': job['status']}),
+            }
 
-        for table in tables:
+        conn = get_db()
+        if body.get('job_id'):
+            # Вызов из job-worker: тот же архив под блокировкой плановых копий, повтор после обрыва идемпотентен
+            folder = body.get('folder') or folder
+            if not acquire_backup_lock(conn):
+                release_db(conn)
+                return {
+                    'statusCode': 200,
+                    'headers': {**CORS_HEADERS, 'Content-Type': 'application/json'},
+                    'body': json.dumps({'success': True, 'status': 'running', 'reason': 'backup already running',
+                                        'retry_after': 60}),
+                }
             try:
-                csv_content, row_count = table_to_csv(conn, table)
-                key = f'{folder}/{table}.csv'
-                url, size = upload_csv(s3, key, csv_content)
-                results.append({'table': table, 'rows': row_count, 'url': url, 'size': size, 'success': True})
-            except Exception as e:
-                print(f'[backup error] table={table} error={e}')
-                results.append({'table': table, 'error': str(e), 'success': False})
-
-        save_backup_record(conn, folder, full, results)
-        conn.close()
+                existing = get_backup_record(conn, folder)
+                if existing is not None:
+                    return {
+                        'statusCode': 200,
+                        'headers': {**CORS_HEADERS, 'Content-Type': 'application/json'},
+                        'body': json.dumps({'success': True, 'folder': folder, 'already_done': True, **existing}),
+                    }
+                results = backup_tables(conn, folder, full)
+            finally:
+                release_backup_lock(conn)
+                release_db(conn)
+        else:
+            results = backup_tables(conn, folder, full)
+            release_db(conn)
 
         return {
             'statusCode': 200,
@@ -241,20 +1149,12 @@ def handler(event: dict, context) -> dict:
     if method == 'POST' and action == 'clear_all':
         conn = get_db()
         s3 = get_s3()
-        cur = conn.cursor()
-        cur.execute(f'SELECT folder FROM "{SCHEMA}".backup_records')
-        all_folders = [r[0] for r in cur.fetchall()]
-        cur.close()
-
+        deleted_files, reclaimed = 0, 0
         try:
-            paginator = s3.get_paginator('list_objects_v2')
-            pages = paginator.paginate(Bucket='files', Prefix='backups/')
-            keys = []
-            for page in pages:
-                for obj in page.get('Contents', []):
-                    keys.append({'Key': obj['Key']})
-            if keys:
-                s3.delete_objects(Bucket='files', Delete={'Objects': keys})
+            objects = [obj for folder in list_backup_objects(s3).values() for obj in folder['objects']]
+            deleted_files, reclaimed, errors = delete_s3_keys(s3, objects)
+            if errors:
+                print(f'[clear_all s3 error] objects not deleted: {errors}')
         except Exception as e:
             print(f'[clear_all s3 error] {e}')
 
@@ -263,80 +1163,111 @@ def handler(event: dict, context) -> dict:
         deleted_count = cur.rowcount
         conn.commit()
         cur.close()
-        conn.close()
+        release_db(conn)
 
         return {
             'statusCode': 200,
             'headers': {**CORS_HEADERS, 'Content-Type': 'application/json'},
-            'body': json.dumps({'success': True, 'deleted_records': deleted_count, 'deleted_s3_files': len(keys) if 'keys' in dir() else 0}),
+            'body': json.dumps({'success': True, 'deleted_records': deleted_count, 'deleted_s3_files': deleted_files, 'bytes_reclaimed': reclaimed}),
         }
 
     if method == 'POST' and action == 'scheduled':
         conn = get_db()
-        settings = get_backup_settings(conn)
-
-        if not settings['enabled']:
-            conn.close()
+        if not acquire_backup_lock(conn):
+            release_db(conn)
+            # Для задания job-worker это продолжение: запуск, не дождавшийся ответа, ещё идёт
             return {
                 'statusCode': 200,
                 'headers': {**CORS_HEADERS, 'Content-Type': 'application/json'},
-                'body': json.dumps({'success': True, 'skipped': True, 'reason': 'backup disabled'}),
+                'body': json.dumps({'success': True, 'skipped': True, 'status': 'running',
+                                    'reason': 'backup already running', 'retry_after': 60}),
             }
+        try:
+            return run_scheduled(conn)
+        finally:
+            release_backup_lock(conn)
+            release_db(conn)
 
-        now = datetime.now(timezone.utc) + timedelta(hours=3)
-        current_time = now.time()
-        start = time(*map(int, settings['start_time'].split(':')))
-        end = time(*map(int, settings['end_time'].split(':')))
+    if method == 'POST' and action == 'restore':
+        headers = event.get('headers') or {}
+        admin_token = headers.get('x-admin-token') or headers.get('X-Admin-Token')
+        body = json.loads(event.get('body') or '{}')
+        folder = body.get('folder', '')
+        requested = body.get('tables') or []
+        verify_only = body.get('verify_only', False)
+
+        conn = get_db()
+        if not verify_admin_token(admin_token, conn):
+            release_db(conn)
+            return {
+                'statusCode': 403,
+                'headers': {**CORS_HEADERS, 'Content-Type': 'application/json'},
+                'body': json.dumps({'error': 'Unauthorized'}),
+            }
 
-        if not (start <= current_time <= end):
-            conn.close()
+        if not folder.startswith('backups/'):
+            folder = f'backups/{folder}'
+        chain = load_restore_chain(conn, folder)
+        if not chain:
+            release_db(conn)
             return {
-                'statusCode': 200,
+                'statusCode': 404,
                 'headers': {**CORS_HEADERS, 'Content-Type': 'application/json'},
-                'body': json.dumps({'success': True, 'skipped': True, 'reason': 'outside time window'}),
+                'body': json.dumps({'error': 'Архив не найден или неполная цепочка копий'}),
             }
 
-        dt_str = now.strftime('%Y-%m-%d_%H-%M-%S')
-        folder = f'backups/{dt_str}'
+        tables = sorted(t for t in chain[0]['files'] if not requested or t in requested)
         s3 = get_s3()
-        results = []
+        cur = conn.cursor()
+        # В старых полных архивах секции лежат отдельными файлами: вместе с родителем строки загрузились бы дважды
+        tables = without_partitions(cur, tables)
+        cur.execute(f'CREATE SCHEMA IF NOT EXISTS "{RESTORE_SCHEMA}"')
+        conn.commit()
+        cur.close()
+
+        with ThreadPoolExecutor(max_workers=BACKUP_WORKERS) as workers:
+            reports = list(workers.map(lambda table: stage_table(s3, chain, table), tables))
 
-        for table in BACKUP_TABLES:
+        ok = all(r['ok'] for r in reports)
+        swapped = False
+        error = None
+        if ok and not verify_only:
             try:
-                csv_content, row_count = table_to_csv(conn, table)
-                key = f'{folder}/{table}.csv'
-                url, size = upload_csv(s3, key, csv_content)
-                results.append({'table': table, 'rows': row_count, 'url': url, 'size': size, 'success': True})
+                swap_restored(conn, tables)
+                swapped = True
             except Exception as e:
-                print(f'[scheduled error] table={table} error={e}')
-                results.append({'table': table, 'error': str(e), 'success': False})
-
-        save_backup_record(conn, folder, False, results)
-
-        deleted = 0
-        if settings['retention_days'] > 0:
-            deleted = delete_old_records(conn, settings['retention_days'], s3)
-
-        conn.close()
+                print(f'[restore swap error] folder={folder} error={e}')
+                error = str(e)
+        if ok:
+            # При ошибках сверки собранные таблицы остаются в RESTORE_SCHEMA для разбора
+            drop_staged(conn, tables)
+        release_db(conn)
 
         return {
-            'statusCode': 200,
+            'statusCode': 200 if ok and not error else (500 if error else 409),
             'headers': {**CORS_HEADERS, 'Content-Type': 'application/json'},
-            'body': json.dumps({'success': True, 'folder': folder, 'results': results, 'deleted_old': deleted}),
+            'body': json.dumps({
+                'success': ok and not error,
+                'folder': folder,
+                'chain': [c['folder'] for c in chain],
+                'tables': reports,
+                'swapped': swapped,
+                'error': error,
+            }),
         }
 
     if method == 'GET' and action == 'list':
         conn = get_db()
         cur = conn.cursor()
         cur.execute(f'''
-            SELECT folder, full_backup, tables_count, total_rows, files, created_at
+            SELECT folder, full_backup, tables_count, total_rows, files, created_at, mode, base_folder
             FROM "{SCHEMA}".backup_records
             ORDER BY created_at DESC
             LIMIT 500
         ''')
         rows = cur.fetchall()
         cur.close()
-        conn.close()
+        release_db(conn)
 
         folders = []
         for row in rows:
@@ -349,6 +1280,8 @@ def handler(event: dict, context) -> dict:
                     'size': f.get('size', 0),
                     'rows': f.get('rows', 0),
                     'url': f['url'],
+                    'table': f.get('table'),
+                    'kind': f.get('kind', 'rows'),
                     'last_modified': row[5].isoformat(),
                 }
                 for f in files_data
@@ -356,6 +1289,8 @@ def handler(event: dict, context) -> dict:
             folders.append({
                 'folder': folder_name,
                 'full': row[1],
+                'mode': row[6],
+                'base_folder': row[7].replace('backups/', '', 1) if row[7] else None,
                 'file_count': row[2],
                 'total_rows': row[3],
                 'total_size': sum(f['size'] for f in files),
@@ -1,7 +1,71 @@
 import json
 import os
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool, PoolError
 from datetime import datetime, timedelta
+from time import monotonic
+
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+DB_STATEMENT_TIMEOUT_MS = 10000
+DB_PING_AFTER_SECONDS = 30
+
+# shared:db_pool — копия tools/shared/db_pool.py, правится там (python tools/sync_shared.py)
+_db_pool = None
+_db_last_used = {}
+
+
+def _db_alive(conn) -> bool:
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def get_db():
+    """Соединение из пула, живущего между тёплыми вызовами функции.
+    Простаивавшее дольше DB_PING_AFTER_SECONDS соединение проверяется и при обрыве пересоздаётся."""
+    global _db_pool
+    dsn = os.environ['DATABASE_URL']
+    options = f'-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}'
+    if _db_pool is None or _db_pool.closed:
+        _db_pool = ThreadedConnectionPool(1, DB_POOL_MAX, dsn, options=options)
+    for _ in range(DB_POOL_MAX + 1):
+        try:
+            conn = _db_pool.getconn()
+        except PoolError:
+            return psycopg2.connect(dsn, options=options)
+        idle = monotonic() - _db_last_used.get(id(conn), monotonic())
+        if not conn.closed and (idle < DB_PING_AFTER_SECONDS or _db_alive(conn)):
+            return conn
+        _db_last_used.pop(id(conn), None)
+        _db_pool.putconn(conn, close=True)
+    return psycopg2.connect(dsn, options=options)
+
+
+def release_db(conn):
+    """Вернуть соединение в пул; незавершённая транзакция откатывается"""
+    broken = conn.closed
+    if not broken:
+        try:
+            conn.rollback()
+            conn.autocommit = False
+        except psycopg2.Error:
+            broken = True
+    if broken:
+        _db_last_used.pop(id(conn), None)
+    else:
+        _db_last_used[id(conn)] = monotonic()
+    try:
+        _db_pool.putconn(conn, close=broken)
+    except (PoolError, AttributeError):
+        conn.close()
+# end shared:db_pool
+
 
 def handler(event, context):
     """Отправка оценки врача (1 раз в 7 дней с одного IP/браузера на одного врача)"""
@@ -22,7 +86,7 @@ def handler(event, context):
             return {'statusCode': 400, 'headers': {'Access-Control-Allow-Origin': '*'}, 'body': json.dumps({'error': 'doctor_id required'})}
 
         week_ago = datetime.now() - timedelta(days=7)
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        conn = get_db()
         cur = conn.cursor()
         cur.execute(
             "SELECT id FROM t_p30358746_hospital_website_red.doctor_ratings WHERE doctor_id = %s AND voted_at >= %s AND fingerprint = %s",
@@ -30,7 +94,7 @@ def handler(event, context):
         )
         row = cur.fetchone()
         cur.close()
-        conn.close()
+        release_db(conn)
         already_voted = row is not None
         return {'statusCode': 200, 'headers': {'Access-Control-Allow-Origin': '*'}, 'body': json.dumps({'already_voted': already_voted})}
 
@@ -50,7 +114,7 @@ def handler(event, context):
         return {'statusCode': 400, 'headers': {'Access-Control-Allow-Origin': '*'}, 'body': json.dumps({'error': 'Оценка должна быть от 1 до 5'}, ensure_ascii=False)}
 
     week_ago = datetime.now() - timedelta(days=7)
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = get_db()
     cur = conn.cursor()
 
     cur.execute(
@@ -59,7 +123,7 @@ def handler(event, context):
     )
     if cur.fetchone():
         cur.close()
-        conn.close()
+        release_db(conn)
         return {'statusCode': 429, 'headers': {'Access-Control-Allow-Origin': '*'}, 'body': json.dumps({'error': 'Вы уже голосовали за этого врача на этой неделе'}, ensure_ascii=False)}
 
     cur.execute(
@@ -68,6 +132,6 @@ def handler(event, context):
     )
     conn.commit()
     cur.close()
-    conn.close()
+    release_db(conn)
 
     return {'statusCode': 200, 'headers': {'Access-Control-Allow-Origin': '*'}, 'body': json.dumps({'success': True, 'message': 'Спасибо за вашу оценку!'}, ensure_ascii=False)}
\ No newline at end of file
@@ -1,8 +1,131 @@
+import hashlib
 import json
 import os
+from collections import OrderedDict
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool, PoolError
 from psycopg2.extras import RealDictCursor
 from typing import Dict, Any
+from time import monotonic
+
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+DB_STATEMENT_TIMEOUT_MS = 10000
+DB_PING_AFTER_SECONDS = 30
+
+# shared:db_pool — копия tools/shared/db_pool.py, правится там (python tools/sync_shared.py)
+_db_pool = None
+_db_last_used = {}
+
+
+def _db_alive(conn) -> bool:
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def get_db():
+    """Соединение из пула, живущего между тёплыми вызовами функции.
+    Простаивавшее дольше DB_PING_AFTER_SECONDS соединение проверяется и при обрыве пересоздаётся."""
+    global _db_pool
+    dsn = os.environ['DATABASE_URL']
+    options = f'-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}'
+    if _db_pool is None or _db_pool.closed:
+        _db_pool = ThreadedConnectionPool(1, DB_POOL_MAX, dsn, options=options)
+    for _ in range(DB_POOL_MAX + 1):
+        try:
+            conn = _db_pool.getconn()
+        except PoolError:
+            return psycopg2.connect(dsn, options=options)
+        idle = monotonic() - _db_last_used.get(id(conn), monotonic())
+        if not conn.closed and (idle < DB_PING_AFTER_SECONDS or _db_alive(conn)):
+            return conn
+        _db_last_used.pop(id(conn), None)
+        _db_pool.putconn(conn, close=True)
+    return psycopg2.connect(dsn, options=options)
+
+
+def release_db(conn):
+    """Вернуть соединение в пул; незавершённая транзакция откатывается"""
+    broken = conn.closed
+    if not broken:
+        try:
+            conn.rollback()
+            conn.autocommit = False
+        except psycopg2.Error:
+            broken = True
+    if broken:
+        _db_last_used.pop(id(conn), None)
+    else:
+        _db_last_used[id(conn)] = monotonic()
+    try:
+        _db_pool.putconn(conn, close=broken)
+    except (PoolError, AttributeError):
+        conn.close()
+# end shared:db_pool
+
+
+# shared:response_cache — копия tools/shared/response_cache.py, правится там (python tools/sync_shared.py)
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', '60'))
+RESPONSE_CACHE_MAX = 128
+
+_response_cache = OrderedDict()
+
+
+def cached_response(event, key, build):
+    """Ответ на GET из кэша тёплого экземпляра: build() вызывается, только если записи нет или истёк TTL.
+    Кэшируются только ответы 200; ETag — хэш тела, совпавший If-None-Match (или If-None-Match: *) даёт 304 без тела."""
+    entry = _response_cache.get(key)
+    if entry is None or entry['expires'] <= monotonic():
+        response = build()
+        if response['statusCode'] != 200:
+            return response
+        entry = {
+            'expires': monotonic() + RESPONSE_CACHE_TTL,
+            'response': response,
+            'etag': '"' + hashlib.sha256(response['body'].encode()).hexdigest()[:32] + '"',
+        }
+        _response_cache[key] = entry
+        while len(_response_cache) > RESPONSE_CACHE_MAX:
+            _response_cache.popitem(last=False)
+    _response_cache.move_to_end(key)
+    headers = {**entry['response']['headers'], 'ETag': entry['etag'], 'Cache-Control': 'no-cache'}
+    request_headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    if_none_match = request_headers.get('if-none-match', '')
+    if if_none_match.strip() == '*' or entry['etag'] in if_none_match:
+        return {'statusCode': 304, 'headers': headers, 'body': '', 'isBase64Encoded': False}
+    return {**entry['response'], 'headers': headers}
+
+
+def invalidate_cache():
+    """Сбросить кэш ответов после изменения данных этим экземпляром"""
+    _response_cache.clear()
+# end shared:response_cache
+
+
+def build_doctors_list():
+    """Список врачей; соединение берётся только на промахе кэша"""
+    conn = get_db()
+    try:
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute("SELECT id, full_name, phone, position, specialization, login, photo_url, is_active, clinic, education, work_experience, office_number, category, created_at FROM doctors ORDER BY clinic, full_name")
+        doctors = cursor.fetchall()
+        cursor.close()
+    finally:
+        release_db(conn)
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'doctors': doctors}, default=str),
+        'isBase64Encoded': False
+    }
+
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
@@ -39,7 +162,11 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
-    conn = psycopg2.connect(database_url)
+    # Попадание в кэш списка отвечает без соединения с БД
+    if method == 'GET' and not (event.get('queryStringParameters') or {}).get('id'):
+        return cached_response(event, 'doctors', build_doctors_list)
+    
+    conn = get_db()
     
     try:
         if method == 'GET':
@@ -67,17 +194,6 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'body': json.dumps({'doctor': doctor}, default=str),
                     'isBase64Encoded': False
                 }
-            else:
-                cursor.execute("SELECT id, full_name, phone, position, specialization, login, photo_url, is_active, clinic, education, work_experience, office_number, category, created_at FROM doctors ORDER BY clinic, full_name")
-                doctors = cursor.fetchall()
-                cursor.close()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'doctors': doctors}, default=str),
-                    'isBase64Encoded': False
-                }
         
         elif method == 'POST':
             body = json.loads(event.get('body', '{}'))
@@ -112,6 +228,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             doctor = cursor.fetchone()
             conn.commit()
             cursor.close()
+            invalidate_cache()
             
             return {
                 'statusCode': 201,
@@ -198,6 +315,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             doctor = cursor.fetchone()
             conn.commit()
             cursor.close()
+            invalidate_cache()
             
             if not doctor:
                 return {
@@ -230,6 +348,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             cursor.execute("UPDATE doctors SET is_active = false WHERE id = %s", (doctor_id,))
             conn.commit()
             cursor.close()
+            invalidate_cache()
             
             return {
                 'statusCode': 200,
@@ -247,4 +366,4 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             }
     
     finally:
-        conn.close()
\ No newline at end of file
+        release_db(conn)
\ No newline at end of file
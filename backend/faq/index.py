@@ -1,8 +1,135 @@
+import hashlib
 import json
 import os
+from collections import OrderedDict
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool, PoolError
 from psycopg2.extras import RealDictCursor
 from typing import Dict, Any
+from time import monotonic
+
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+DB_STATEMENT_TIMEOUT_MS = 10000
+DB_PING_AFTER_SECONDS = 30
+
+# shared:db_pool — копия tools/shared/db_pool.py, правится там (python tools/sync_shared.py)
+_db_pool = None
+_db_last_used = {}
+
+
+def _db_alive(conn) -> bool:
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def get_db():
+    """Соединение из пула, живущего между тёплыми вызовами функции.
+    Простаивавшее дольше DB_PING_AFTER_SECONDS соединение проверяется и при обрыве пересоздаётся."""
+    global _db_pool
+    dsn = os.environ['DATABASE_URL']
+    options = f'-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}'
+    if _db_pool is None or _db_pool.closed:
+        _db_pool = ThreadedConnectionPool(1, DB_POOL_MAX, dsn, options=options)
+    for _ in range(DB_POOL_MAX + 1):
+        try:
+            conn = _db_pool.getconn()
+        except PoolError:
+            return psycopg2.connect(dsn, options=options)
+        idle = monotonic() - _db_last_used.get(id(conn), monotonic())
+        if not conn.closed and (idle < DB_PING_AFTER_SECONDS or _db_alive(conn)):
+            return conn
+        _db_last_used.pop(id(conn), None)
+        _db_pool.putconn(conn, close=True)
+    return psycopg2.connect(dsn, options=options)
+
+
+def release_db(conn):
+    """Вернуть соединение в пул; незавершённая транзакция откатывается"""
+    broken = conn.closed
+    if not broken:
+        try:
+            conn.rollback()
+            conn.autocommit = False
+        except psycopg2.Error:
+            broken = True
+    if broken:
+        _db_last_used.pop(id(conn), None)
+    else:
+        _db_last_used[id(conn)] = monotonic()
+    try:
+        _db_pool.putconn(conn, close=broken)
+    except (PoolError, AttributeError):
+        conn.close()
+# end shared:db_pool
+
+
+# shared:response_cache — копия tools/shared/response_cache.py, правится там (python tools/sync_shared.py)
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', '60'))
+RESPONSE_CACHE_MAX = 128
+
+_response_cache = OrderedDict()
+
+
+def cached_response(event, key, build):
+    """Ответ на GET из кэша тёплого экземпляра: build() вызывается, только если записи нет или истёк TTL.
+    Кэшируются только ответы 200; ETag — хэш тела, совпавший If-None-Match (или If-None-Match: *) даёт 304 без тела."""
+    entry = _response_cache.get(key)
+    if entry is None or entry['expires'] <= monotonic():
+        response = build()
+        if response['statusCode'] != 200:
+            return response
+        entry = {
+            'expires': monotonic() + RESPONSE_CACHE_TTL,
+            'response': response,
+            'etag': '"' + hashlib.sha256(response['body'].encode()).hexdigest()[:32] + '"',
+        }
+        _response_cache[key] = entry
+        while len(_response_cache) > RESPONSE_CACHE_MAX:
+            _response_cache.popitem(last=False)
+    _response_cache.move_to_end(key)
+    headers = {**entry['response']['headers'], 'ETag': entry['etag'], 'Cache-Control': 'no-cache'}
+    request_headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    if_none_match = request_headers.get('if-none-match', '')
+    if if_none_match.strip() == '*' or entry['etag'] in if_none_match:
+        return {'statusCode': 304, 'headers': headers, 'body': '', 'isBase64Encoded': False}
+    return {**entry['response'], 'headers': headers}
+
+
+def invalidate_cache():
+    """Сбросить кэш ответов после изменения данных этим экземпляром"""
+    _response_cache.clear()
+# end shared:response_cache
+
+
+def build_faq_list(show_all):
+    """Список вопросов; соединение берётся только на промахе кэша"""
+    conn = get_db()
+    try:
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        if show_all:
+            cursor.execute("SELECT * FROM faq ORDER BY display_order, created_at DESC")
+        else:
+            cursor.execute("SELECT * FROM faq WHERE is_active = true ORDER BY display_order, created_at DESC")
+        
+        faqs = cursor.fetchall()
+        cursor.close()
+    finally:
+        release_db(conn)
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'faqs': faqs}, default=str),
+        'isBase64Encoded': False
+    }
+
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
@@ -38,13 +165,18 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
-    conn = psycopg2.connect(database_url)
+    # Попадание в кэш списка отвечает без соединения с БД
+    list_params = event.get('queryStringParameters') or {}
+    if method == 'GET' and not list_params.get('id'):
+        show_all = list_params.get('all') == 'true'
+        return cached_response(event, f'faqs:{show_all}', lambda: build_faq_list(show_all))
+    
+    conn = get_db()
     
     try:
         if method == 'GET':
             query_params = event.get('queryStringParameters') or {}
             faq_id = query_params.get('id')
-            show_all = query_params.get('all') == 'true'
             
             cursor = conn.cursor(cursor_factory=RealDictCursor)
             
@@ -67,21 +199,6 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'body': json.dumps({'faq': faq_item}, default=str),
                     'isBase64Encoded': False
                 }
-            else:
-                if show_all:
-                    cursor.execute("SELECT * FROM faq ORDER BY display_order, created_at DESC")
-                else:
-                    cursor.execute("SELECT * FROM faq WHERE is_active = true ORDER BY display_order, created_at DESC")
-                
-                faqs = cursor.fetchall()
-                cursor.close()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'faqs': faqs}, default=str),
-                    'isBase64Encoded': False
-                }
         
         elif method == 'POST':
             body = json.loads(event.get('body', '{}'))
@@ -106,6 +223,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             faq_item = cursor.fetchone()
             conn.commit()
             cursor.close()
+            invalidate_cache()
             
             return {
                 'statusCode': 201,
@@ -162,6 +280,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             faq_item = cursor.fetchone()
             conn.commit()
             cursor.close()
+            invalidate_cache()
             
             if not faq_item:
                 return {
@@ -194,6 +313,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             cursor.execute("DELETE FROM faq WHERE id = %s", (faq_id,))
             conn.commit()
             cursor.close()
+            invalidate_cache()
             
             return {
                 'statusCode': 200,
@@ -211,4 +331,4 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             }
     
     finally:
-        conn.close()
+        release_db(conn)
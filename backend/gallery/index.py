@@ -1,10 +1,14 @@
 """Галерея: управление разделами, изображениями (S3) и настройками задержки."""
+import hashlib
 import json
 import os
 import uuid
 import base64
+from collections import OrderedDict
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool, PoolError
 import boto3
+from time import monotonic
 
 CORS_HEADERS = {
     'Access-Control-Allow-Origin': '*',
@@ -12,8 +16,67 @@ CORS_HEADERS = {
     'Access-Control-Allow-Headers': 'Content-Type, X-Admin-Id',
 }
 
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+DB_STATEMENT_TIMEOUT_MS = 10000
+DB_PING_AFTER_SECONDS = 30
+
+# shared:db_pool — копия tools/shared/db_pool.py, правится там (python tools/sync_shared.py)
+_db_pool = None
+_db_last_used = {}
+
+
+def _db_alive(conn) -> bool:
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
 def get_db():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+    """Соединение из пула, живущего между тёплыми вызовами функции.
+    Простаивавшее дольше DB_PING_AFTER_SECONDS соединение проверяется и при обрыве пересоздаётся."""
+    global _db_pool
+    dsn = os.environ['DATABASE_URL']
+    options = f'-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}'
+    if _db_pool is None or _db_pool.closed:
+        _db_pool = ThreadedConnectionPool(1, DB_POOL_MAX, dsn, options=options)
+    for _ in range(DB_POOL_MAX + 1):
+        try:
+            conn = _db_pool.getconn()
+        except PoolError:
+            return psycopg2.connect(dsn, options=options)
+        idle = monotonic() - _db_last_used.get(id(conn), monotonic())
+        if not conn.closed and (idle < DB_PING_AFTER_SECONDS or _db_alive(conn)):
+            return conn
+        _db_last_used.pop(id(conn), None)
+        _db_pool.putconn(conn, close=True)
+    return psycopg2.connect(dsn, options=options)
+
+
+def release_db(conn):
+    """Вернуть соединение в пул; незавершённая транзакция откатывается"""
+    broken = conn.closed
+    if not broken:
+        try:
+            conn.rollback()
+            conn.autocommit = False
+        except psycopg2.Error:
+            broken = True
+    if broken:
+        _db_last_used.pop(id(conn), None)
+    else:
+        _db_last_used[id(conn)] = monotonic()
+    try:
+        _db_pool.putconn(conn, close=broken)
+    except (PoolError, AttributeError):
+        conn.close()
+# end shared:db_pool
+
 
 def get_s3():
     return boto3.client(
@@ -23,6 +86,45 @@ def get_s3():
         aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
     )
 
+
+# shared:response_cache — копия tools/shared/response_cache.py, правится там (python tools/sync_shared.py)
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', '60'))
+RESPONSE_CACHE_MAX = 128
+
+_response_cache = OrderedDict()
+
+
+def cached_response(event, key, build):
+    """Ответ на GET из кэша тёплого экземпляра: build() вызывается, только если записи нет или истёк TTL.
+    Кэшируются только ответы 200; ETag — хэш тела, совпавший If-None-Match (или If-None-Match: *) даёт 304 без тела."""
+    entry = _response_cache.get(key)
+    if entry is None or entry['expires'] <= monotonic():
+        response = build()
+        if response['statusCode'] != 200:
+            return response
+        entry = {
+            'expires': monotonic() + RESPONSE_CACHE_TTL,
+            'response': response,
+            'etag': '"' + hashlib.sha256(response['body'].encode()).hexdigest()[:32] + '"',
+        }
+        _response_cache[key] = entry
+        while len(_response_cache) > RESPONSE_CACHE_MAX:
+            _response_cache.popitem(last=False)
+    _response_cache.move_to_end(key)
+    headers = {**entry['response']['headers'], 'ETag': entry['etag'], 'Cache-Control': 'no-cache'}
+    request_headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    if_none_match = request_headers.get('if-none-match', '')
+    if if_none_match.strip() == '*' or entry['etag'] in if_none_match:
+        return {'statusCode': 304, 'headers': headers, 'body': '', 'isBase64Encoded': False}
+    return {**entry['response'], 'headers': headers}
+
+
+def invalidate_cache():
+    """Сбросить кэш ответов после изменения данных этим экземпляром"""
+    _response_cache.clear()
+# end shared:response_cache
+
+
 def ok(data):
     return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': json.dumps(data, ensure_ascii=False)}
 
@@ -41,9 +143,25 @@ def verify_admin(headers, params, body):
     cur = conn.cursor()
     cur.execute("SELECT id FROM admins WHERE id = %s AND is_active = TRUE", (int(admin_id),))
     row = cur.fetchone()
-    conn.close()
+    release_db(conn)
     return row is not None
 
+def section_images(section):
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT id, image_url, sort_order FROM gallery_images WHERE section_number = %s ORDER BY sort_order, id",
+        (section,)
+    )
+    rows = cur.fetchall()
+    cur.execute("SELECT slide_delay FROM gallery_settings WHERE section_number = %s", (section,))
+    setting = cur.fetchone()
+    release_db(conn)
+    return ok({
+        'images': [{'id': r[0], 'url': r[1], 'sort_order': r[2]} for r in rows],
+        'slide_delay': setting[0] if setting else 5,
+    })
+
 def handler(event: dict, context) -> dict:
     if event.get('httpMethod') == 'OPTIONS':
         return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': ''}
@@ -63,20 +181,7 @@ def handler(event: dict, context) -> dict:
         section = params.get('section')
         if not section:
             return err('section required')
-        conn = get_db()
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT id, image_url, sort_order FROM gallery_images WHERE section_number = %s ORDER BY sort_order, id",
-            (int(section),)
-        )
-        rows = cur.fetchall()
-        cur.execute("SELECT slide_delay FROM gallery_settings WHERE section_number = %s", (int(section),))
-        setting = cur.fetchone()
-        conn.close()
-        return ok({
-            'images': [{'id': r[0], 'url': r[1], 'sort_order': r[2]} for r in rows],
-            'slide_delay': setting[0] if setting else 5,
-        })
+        return cached_response(event, f'images:{int(section)}', lambda: section_images(int(section)))
 
     # GET /gallery?action=all_images&admin_id=N
     if method == 'GET' and action == 'all_images':
@@ -88,7 +193,7 @@ def handler(event: dict, context) -> dict:
         rows = cur.fetchall()
         cur.execute("SELECT section_number, slide_delay FROM gallery_settings ORDER BY section_number")
         settings = cur.fetchall()
-        conn.close()
+        release_db(conn)
         return ok({
             'images': [{'id': r[0], 'section': r[1], 'url': r[2], 'sort_order': r[3]} for r in rows],
             'settings': {str(s[0]): s[1] for s in settings},
@@ -117,7 +222,8 @@ def handler(event: dict, context) -> dict:
         )
         new_id = cur.fetchone()[0]
         conn.commit()
-        conn.close()
+        release_db(conn)
+        invalidate_cache()
         return ok({'id': new_id, 'url': cdn_url})
 
     # DELETE /gallery?action=delete&id=N&admin_id=N
@@ -132,12 +238,13 @@ def handler(event: dict, context) -> dict:
         cur.execute("SELECT file_key FROM gallery_images WHERE id = %s", (int(img_id),))
         row = cur.fetchone()
         if not row:
-            conn.close()
+            release_db(conn)
             return err('not found', 404)
         file_key = row[0]
         cur.execute("DELETE FROM gallery_images WHERE id = %s", (int(img_id),))
         conn.commit()
-        conn.close()
+        release_db(conn)
+        invalidate_cache()
         try:
             s3 = get_s3()
             s3.delete_object(Bucket='files', Key=file_key)
@@ -161,7 +268,8 @@ def handler(event: dict, context) -> dict:
             (delay, int(section))
         )
         conn.commit()
-        conn.close()
+        release_db(conn)
+        invalidate_cache()
         return ok({'updated': True, 'delay': delay})
 
     # POST /gallery?action=reorder
@@ -177,7 +285,8 @@ def handler(event: dict, context) -> dict:
         for i, img_id in enumerate(ids):
             cur.execute("UPDATE gallery_images SET sort_order = %s WHERE id = %s", (i, int(img_id)))
         conn.commit()
-        conn.close()
+        release_db(conn)
+        invalidate_cache()
         return ok({'updated': True})
 
     return err('Unknown action', 404)
\ No newline at end of file
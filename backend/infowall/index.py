@@ -1,10 +1,14 @@
 """Управление информационной стеной больницы: разделы, темы, посты."""
+import hashlib
 import json
 import os
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool, PoolError
 import base64
 import boto3
 import uuid
+from collections import OrderedDict
+from time import monotonic
 
 CORS = {
     'Access-Control-Allow-Origin': '*',
@@ -12,8 +16,109 @@ CORS = {
     'Access-Control-Allow-Headers': 'Content-Type, X-Authorization',
 }
 
-def get_conn():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+DB_STATEMENT_TIMEOUT_MS = 10000
+DB_PING_AFTER_SECONDS = 30
+
+# shared:db_pool — копия tools/shared/db_pool.py, правится там (python tools/sync_shared.py)
+_db_pool = None
+_db_last_used = {}
+
+
+def _db_alive(conn) -> bool:
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def get_db():
+    """Соединение из пула, живущего между тёплыми вызовами функции.
+    Простаивавшее дольше DB_PING_AFTER_SECONDS соединение проверяется и при обрыве пересоздаётся."""
+    global _db_pool
+    dsn = os.environ['DATABASE_URL']
+    options = f'-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}'
+    if _db_pool is None or _db_pool.closed:
+        _db_pool = ThreadedConnectionPool(1, DB_POOL_MAX, dsn, options=options)
+    for _ in range(DB_POOL_MAX + 1):
+        try:
+            conn = _db_pool.getconn()
+        except PoolError:
+            return psycopg2.connect(dsn, options=options)
+        idle = monotonic() - _db_last_used.get(id(conn), monotonic())
+        if not conn.closed and (idle < DB_PING_AFTER_SECONDS or _db_alive(conn)):
+            return conn
+        _db_last_used.pop(id(conn), None)
+        _db_pool.putconn(conn, close=True)
+    return psycopg2.connect(dsn, options=options)
+
+
+def release_db(conn):
+    """Вернуть соединение в пул; незавершённая транзакция откатывается"""
+    broken = conn.closed
+    if not broken:
+        try:
+            conn.rollback()
+            conn.autocommit = False
+        except psycopg2.Error:
+            broken = True
+    if broken:
+        _db_last_used.pop(id(conn), None)
+    else:
+        _db_last_used[id(conn)] = monotonic()
+    try:
+        _db_pool.putconn(conn, close=broken)
+    except (PoolError, AttributeError):
+        conn.close()
+# end shared:db_pool
+
+
+# Публичные чтения, которые отдаются из кэша; любое успешное изменение сбрасывает кэш
+CACHED_ACTIONS = ('get_sections', 'get_topics', 'get_posts', 'get_all')
+
+
+# shared:response_cache — копия tools/shared/response_cache.py, правится там (python tools/sync_shared.py)
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', '60'))
+RESPONSE_CACHE_MAX = 128
+
+_response_cache = OrderedDict()
+
+
+def cached_response(event, key, build):
+    """Ответ на GET из кэша тёплого экземпляра: build() вызывается, только если записи нет или истёк TTL.
+    Кэшируются только ответы 200; ETag — хэш тела, совпавший If-None-Match (или If-None-Match: *) даёт 304 без тела."""
+    entry = _response_cache.get(key)
+    if entry is None or entry['expires'] <= monotonic():
+        response = build()
+        if response['statusCode'] != 200:
+            return response
+        entry = {
+            'expires': monotonic() + RESPONSE_CACHE_TTL,
+            'response': response,
+            'etag': '"' + hashlib.sha256(response['body'].encode()).hexdigest()[:32] + '"',
+        }
+        _response_cache[key] = entry
+        while len(_response_cache) > RESPONSE_CACHE_MAX:
+            _response_cache.popitem(last=False)
+    _response_cache.move_to_end(key)
+    headers = {**entry['response']['headers'], 'ETag': entry['etag'], 'Cache-Control': 'no-cache'}
+    request_headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    if_none_match = request_headers.get('if-none-match', '')
+    if if_none_match.strip() == '*' or entry['etag'] in if_none_match:
+        return {'statusCode': 304, 'headers': headers, 'body': '', 'isBase64Encoded': False}
+    return {**entry['response'], 'headers': headers}
+
+
+def invalidate_cache():
+    """Сбросить кэш ответов после изменения данных этим экземпляром"""
+    _response_cache.clear()
+# end shared:response_cache
+
 
 def resp(status, body):
     return {'statusCode': status, 'headers': {**CORS, 'Content-Type': 'application/json'}, 'body': json.dumps(body, ensure_ascii=False, default=str)}
@@ -36,6 +141,26 @@ def handler(event: dict, context) -> dict:
     if event.get('httpMethod') == 'OPTIONS':
         return {'statusCode': 200, 'headers': CORS, 'body': ''}
 
+    method = event.get('httpMethod', 'GET')
+    params = event.get('queryStringParameters') or {}
+    action = params.get('action', '')
+    if method == 'GET' and action in CACHED_ACTIONS:
+        key = f"{action}:{params.get('section_id', '')}:{params.get('topic_id', '')}"
+        return cached_response(event, key, lambda: run_route(event))
+
+    response = run_route(event)
+    if method != 'GET' and response['statusCode'] == 200:
+        invalidate_cache()
+    return response
+
+def run_route(event: dict) -> dict:
+    conn = get_db()
+    try:
+        return route(event, conn)
+    finally:
+        release_db(conn)
+
+def route(event: dict, conn) -> dict:
     method = event.get('httpMethod', 'GET')
     params = event.get('queryStringParameters') or {}
     action = params.get('action', '')
@@ -43,7 +168,6 @@ def handler(event: dict, context) -> dict:
     if event.get('body'):
         body = json.loads(event['body'])
 
-    conn = get_conn()
     cur = conn.cursor()
 
     # ───── РАЗДЕЛЫ ─────
@@ -0,0 +1,529 @@
+import json
+import os
+import socket
+import urllib.error
+import urllib.request
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from psycopg2.pool import ThreadedConnectionPool, PoolError
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+
+
+SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 't_p30358746_hospital_website_red')
+
+PATIENT_REGISTRY_URL = 'https://functions.poehali.dev/e644fdea-011f-4d16-b984-98838c4e6c69'
+DB_BACKUP_URL = 'https://functions.poehali.dev/44a9271b-91c3-434f-a4ed-a10b64718f46'
+BACKUP_CLEANUP_URL = 'https://functions.poehali.dev/69caec0e-b26b-4ac4-9c75-f8b2ad9397f5'
+APPOINTMENTS_URL = 'https://functions.poehali.dev/b3b698ed-7035-4503-8c49-85be11de75e5'
+GREEN_API_URL = os.environ.get('GREEN_API_URL', 'https://api.green-api.com')
+
+WORKER_TIME_BUDGET = 30
+WORKER_CONCURRENCY = int(os.environ.get('WORKER_CONCURRENCY', '3'))
+# Вызов задания не дольше JOB_CALL_TIMEOUT и не дольше остатка WORKER_TIME_BUDGET; при остатке меньше
+# JOB_MIN_CALL_SECONDS новое задание не берётся. Ответ, не пришедший вовремя, считается продолжением
+# работы (функция могла её не прервать), а не неудачной попыткой — но не больше JOB_TIMEOUTS_MAX раз подряд
+JOB_CALL_TIMEOUT = 25
+JOB_MIN_CALL_SECONDS = 5
+JOB_TIMEOUTS_MAX = 10
+JOB_STALE_SECONDS = 300
+JOB_RETRY_BASE_SECONDS = 30
+JOB_RETENTION_DAYS = 30
+MAX_HTTP_TIMEOUT = 10
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, X-Admin-Token',
+}
+
+
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+DB_STATEMENT_TIMEOUT_MS = 10000
+DB_PING_AFTER_SECONDS = 30
+
+# shared:db_pool — копия tools/shared/db_pool.py, правится там (python tools/sync_shared.py)
+_db_pool = None
+_db_last_used = {}
+
+
+def _db_alive(conn) -> bool:
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def get_db():
+    """Соединение из пула, живущего между тёплыми вызовами функции.
+    Простаивавшее дольше DB_PING_AFTER_SECONDS соединение проверяется и при обрыве пересоздаётся."""
+    global _db_pool
+    dsn = os.environ['DATABASE_URL']
+    options = f'-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}'
+    if _db_pool is None or _db_pool.closed:
+        _db_pool = ThreadedConnectionPool(1, DB_POOL_MAX, dsn, options=options)
+    for _ in range(DB_POOL_MAX + 1):
+        try:
+            conn = _db_pool.getconn()
+        except PoolError:
+            return psycopg2.connect(dsn, options=options)
+        idle = monotonic() - _db_last_used.get(id(conn), monotonic())
+        if not conn.closed and (idle < DB_PING_AFTER_SECONDS or _db_alive(conn)):
+            return conn
+        _db_last_used.pop(id(conn), None)
+        _db_pool.putconn(conn, close=True)
+    return psycopg2.connect(dsn, options=options)
+
+
+def release_db(conn):
+    """Вернуть соединение в пул; незавершённая транзакция откатывается"""
+    broken = conn.closed
+    if not broken:
+        try:
+            conn.rollback()
+            conn.autocommit = False
+        except psycopg2.Error:
+            broken = True
+    if broken:
+        _db_last_used.pop(id(conn), None)
+    else:
+        _db_last_used[id(conn)] = monotonic()
+    try:
+        _db_pool.putconn(conn, close=broken)
+    except (PoolError, AttributeError):
+        conn.close()
+# end shared:db_pool
+
+
+def verify_admin_token(token, conn) -> bool:
+    """Проверка токена администратора через БД"""
+    if not token:
+        return False
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            f'SELECT id FROM "{SCHEMA}".admins WHERE password_hash = %s AND is_active = true',
+            (token,)
+        )
+        return cur.fetchone() is not None
+    finally:
+        cur.close()
+
+
+def is_timer_event(event) -> bool:
+    """Вызов таймерным триггером (см. trigger.json), а не по HTTP: у такого события нет httpMethod"""
+    return 'httpMethod' not in event and any(
+        (m.get('event_metadata') or {}).get('event_type', '').endswith('TimerMessage')
+        for m in event.get('messages') or []
+    )
+
+
+class JobError(Exception):
+    """Ошибка выполнения задания; retry=False — повтор бесполезен (неверные данные, 4xx)"""
+
+    def __init__(self, message, retry=True):
+        super().__init__(message)
+        self.retry = retry
+
+
+class JobTimeout(JobError):
+    """Ответ не пришёл за отведённое время: задание, возможно, ещё выполняется"""
+
+
+def call_function(url, action, body, timeout):
+    """POST в другую функцию проекта. Ответ со status='running' означает, что работа продолжается частями:
+    возвращается ('continue', ответ), иначе ('done', ответ). 409/429 и 5xx — временные ошибки."""
+    query = f'?action={action}' if action else ''
+    req = urllib.request.Request(
+        f'{url}{query}',
+        method='POST',
+        headers={'Content-Type': 'application/json'},
+        data=json.dumps(body).encode('utf-8'),
+    )
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            result = json.loads(resp.read().decode('utf-8') or '{}')
+    except urllib.error.HTTPError as e:
+        detail = e.read().decode('utf-8', 'replace')[:500]
+        raise JobError(f'HTTP {e.code}: {detail}', retry=e.code in (409, 429) or e.code >= 500)
+    except (socket.timeout, TimeoutError) as e:
+        # Функция могла продолжить работу и без нас: повтор должен быть безопасен (см. обработчики заданий)
+        raise JobTimeout(f'нет ответа за {timeout:.0f} c: {e}')
+    except urllib.error.URLError as e:
+        if isinstance(e.reason, (socket.timeout, TimeoutError)):
+            raise JobTimeout(f'нет ответа за {timeout:.0f} c: {e}')
+        raise JobError(f'{url}: {e}')
+    if result.get('status') == 'running':
+        return 'continue', result
+    return 'done', result
+
+
+def run_registry_send(payload, job_id, timeout):
+    """Порция рассылки по реестру: patient-registry сам продолжает задание рассылки с места остановки"""
+    return call_function(PATIENT_REGISTRY_URL, '', {
+        'action': f"send_{payload['channel']}",
+        'job_id': payload['send_job_id'],
+    }, timeout)
+
+
+def run_db_backup(payload, job_id, timeout):
+    """Полный архив в заранее выбранную папку: повтор после обрыва не создаёт вторую копию.
+    Плановая копия (ставит backup-cron) сама продолжает прерванный запуск по журналу backup_runs."""
+    if payload.get('scheduled'):
+        return call_function(DB_BACKUP_URL, 'scheduled', {'job_id': job_id}, timeout)
+    return call_function(DB_BACKUP_URL, 'backup', {
+        'full': payload.get('full', False),
+        'folder': payload['folder'],
+        'job_id': job_id,
+    }, timeout)
+
+
+def run_backup_cleanup(payload, job_id, timeout):
+    return call_function(BACKUP_CLEANUP_URL, 'run', {}, timeout)
+
+
+def run_booking_drain(payload, job_id, timeout):
+    """Разбор очереди записи в режиме наплыва: продолжается, пока в очереди есть ожидающие заявки"""
+    return call_function(APPOINTMENTS_URL, '', {'action': 'drain-queue'}, timeout)
+
+
+def run_max_message(payload, job_id, timeout):
+    """Одно сообщение пациенту в MAX через GREEN-API"""
+    instance_id = os.environ.get('GREEN_API_INSTANCE_ID')
+    token = os.environ.get('GREEN_API_TOKEN')
+    if not instance_id or not token:
+        raise JobError('Настройки GREEN-API не указаны', retry=False)
+    phone = ''.join(filter(str.isdigit, payload.get('phone', '')))
+    if not phone:
+        raise JobError('Нет номера телефона', retry=False)
+    data = json.dumps({'chatId': f'{phone}@c.us', 'message': payload.get('message', '')}).encode('utf-8')
+    req = urllib.request.Request(
+        f'{GREEN_API_URL}/v3/waInstance{instance_id}/sendMessage/{token}',
+        data=data,
+        headers={'Content-Type': 'application/json'},
+        method='POST',
+    )
+    try:
+        with urllib.request.urlopen(req, timeout=min(MAX_HTTP_TIMEOUT, timeout)) as resp:
+            result = json.loads(resp.read().decode('utf-8') or '{}')
+    except urllib.error.HTTPError as e:
+        raise JobError(f'GREEN-API HTTP {e.code}', retry=e.code == 429 or e.code >= 500)
+    except (socket.timeout, TimeoutError, urllib.error.URLError) as e:
+        raise JobError(f'GREEN-API: {e}')
+    return 'done', {'id_message': result.get('idMessage')}
+
+
+JOB_RUNNERS = {
+    'registry_send': run_registry_send,
+    'db_backup': run_db_backup,
+    'backup_cleanup': run_backup_cleanup,
+    'max_message': run_max_message,
+    'booking_drain': run_booking_drain,
+}
+
+
+def backup_already_done(conn, payload):
+    """Архив в папку задания уже записан в backup_records — обрыв случился после сохранения"""
+    if not payload.get('folder'):
+        # Плановая копия: готовность видна только db-backup по backup_runs — задание продолжится
+        return None
+    cur = conn.cursor()
+    cur.execute(f'''
+        SELECT tables_count, total_rows, created_at FROM "{SCHEMA}".backup_records WHERE folder = %s
+    ''', (payload.get('folder'),))
+    row = cur.fetchone()
+    cur.close()
+    if not row:
+        return None
+    return {'success': True, 'folder': payload.get('folder'), 'already_done': True,
+            'tables_count': row[0], 'total_rows': row[1], 'created_at': row[2].isoformat()}
+
+
+# Проверка после таймаута вызова: ответ задания, если оно успело завершиться, иначе None
+JOB_TIMEOUT_CHECKS = {
+    'db_backup': backup_already_done,
+}
+
+
+def claim_job(conn):
+    """Взять готовое задание с наибольшим приоритетом. Задание, зависшее в running дольше JOB_STALE_SECONDS
+    (обработчик упал), берётся повторно; строки, занятые параллельным обработчиком, пропускаются."""
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute(f'''
+        UPDATE "{SCHEMA}".background_jobs
+        SET status = 'running', attempts = attempts + 1, locked_at = NOW(), updated_at = NOW()
+        WHERE id = (
+            SELECT id FROM "{SCHEMA}".background_jobs
+            WHERE (status = 'queued' AND run_after <= NOW())
+               OR (status = 'running' AND locked_at < NOW() - %s * INTERVAL '1 second')
+            ORDER BY priority DESC, run_after, id
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, kind, payload, attempts, max_attempts, progress
+    ''', (JOB_STALE_SECONDS,))
+    job = cur.fetchone()
+    conn.commit()
+    cur.close()
+    return job
+
+
+def finish_job(conn, job_id, result):
+    cur = conn.cursor()
+    cur.execute(f'''
+        UPDATE "{SCHEMA}".background_jobs
+        SET status = 'done', result = %s, last_error = NULL, locked_at = NULL,
+            finished_at = NOW(), updated_at = NOW()
+        WHERE id = %s
+    ''', (json.dumps(result, default=str), job_id))
+    conn.commit()
+    cur.close()
+
+
+def continue_job(conn, job_id, progress):
+    """Вернуть в очередь задание, выполненное частично; retry_after в ответе — когда продолжать"""
+    delay = int(progress.get('retry_after') or 0)
+    cur = conn.cursor()
+    cur.execute(f'''
+        UPDATE "{SCHEMA}".background_jobs
+        SET status = 'queued', attempts = attempts - 1, progress = %s, locked_at = NULL,
+            run_after = NOW() + %s * INTERVAL '1 second', updated_at = NOW()
+        WHERE id = %s
+    ''', (json.dumps(progress, default=str), delay, job_id))
+    conn.commit()
+    cur.close()
+
+
+def fail_job(conn, job, error, retry):
+    """Повтор через JOB_RETRY_BASE_SECONDS * 2^(попытка-1); после max_attempts или без retry — failed"""
+    retry = retry and job['attempts'] < job['max_attempts']
+    cur = conn.cursor()
+    cur.execute(f'''
+        UPDATE "{SCHEMA}".background_jobs
+        SET status = %s, last_error = %s, locked_at = NULL,
+            run_after = NOW() + %s * POWER(2, attempts - 1) * INTERVAL '1 second',
+            finished_at = CASE WHEN %s THEN NULL ELSE NOW() END,
+            updated_at = NOW()
+        WHERE id = %s
+    ''', ('queued' if retry else 'failed', error[:2000], JOB_RETRY_BASE_SECONDS, retry, job['id']))
+    conn.commit()
+    cur.close()
+    return retry
+
+
+def timed_out_job(conn, job, error):
+    """Таймаут вызова: завершённое задание закрывается, иначе продолжается без траты попытки"""
+    check = JOB_TIMEOUT_CHECKS.get(job['kind'])
+    result = check(conn, job['payload'] or {}) if check else None
+    if result is not None:
+        finish_job(conn, job['id'], result)
+        return 'done'
+    progress = job['progress'] or {}
+    timeouts = progress.get('timeouts', 0) + 1
+    if timeouts > JOB_TIMEOUTS_MAX:
+        fail_job(conn, job, error, False)
+        return 'failed'
+    continue_job(conn, job['id'], {**progress, 'timeouts': timeouts, 'last_timeout': error,
+                                   'retry_after': JOB_RETRY_BASE_SECONDS})
+    return 'timeout'
+
+
+def run_job(conn, job, timeout):
+    runner = JOB_RUNNERS.get(job['kind'])
+    try:
+        if runner is None:
+            raise JobError(f"Неизвестный тип задания: {job['kind']}", retry=False)
+        outcome, result = runner(job['payload'] or {}, job['id'], timeout)
+    except JobTimeout as e:
+        outcome = timed_out_job(conn, job, str(e))
+        print(f"[job-worker] job={job['id']} kind={job['kind']} attempt={job['attempts']} timeout={e} outcome={outcome}")
+        return outcome
+    except JobError as e:
+        retried = fail_job(conn, job, str(e), e.retry)
+        print(f"[job-worker] job={job['id']} kind={job['kind']} attempt={job['attempts']} error={e} retry={retried}")
+        return 'retry' if retried else 'failed'
+    except Exception as e:
+        retried = fail_job(conn, job, f'{type(e).__name__}: {e}', True)
+        print(f"[job-worker] job={job['id']} kind={job['kind']} attempt={job['attempts']} crash={e!r} retry={retried}")
+        return 'retry' if retried else 'failed'
+    if outcome == 'continue':
+        continue_job(conn, job['id'], result)
+    else:
+        finish_job(conn, job['id'], result)
+    return outcome
+
+
+def work_loop(deadline):
+    """Брать и выполнять задания, пока есть готовые и остатка бюджета хватает на вызов"""
+    counts = {}
+    conn = get_db()
+    try:
+        while deadline - monotonic() >= JOB_MIN_CALL_SECONDS:
+            job = claim_job(conn)
+            if job is None:
+                break
+            outcome = run_job(conn, job, min(JOB_CALL_TIMEOUT, deadline - monotonic()))
+            counts[outcome] = counts.get(outcome, 0) + 1
+    finally:
+        release_db(conn)
+    return counts
+
+
+def prune_jobs(conn):
+    cur = conn.cursor()
+    cur.execute(f'''
+        DELETE FROM "{SCHEMA}".background_jobs
+        WHERE status IN ('done', 'failed') AND finished_at < NOW() - %s * INTERVAL '1 day'
+    ''', (JOB_RETENTION_DAYS,))
+    deleted = cur.rowcount
+    conn.commit()
+    cur.close()
+    return deleted
+
+
+def job_view(row):
+    return {
+        'id': row['id'],
+        'kind': row['kind'],
+        'status': row['status'],
+        'priority': row['priority'],
+        'attempts': row['attempts'],
+        'max_attempts': row['max_attempts'],
+        'progress': row['progress'],
+        'result': row['result'],
+        'last_error': row['last_error'],
+        'run_after': row['run_after'].isoformat() if row['run_after'] else None,
+        'created_at': row['created_at'].isoformat() if row['created_at'] else None,
+        'finished_at': row['finished_at'].isoformat() if row['finished_at'] else None,
+    }
+
+
+JOB_COLUMNS = 'id, kind, status, priority, attempts, max_attempts, progress, result, last_error, run_after, created_at, finished_at'
+
+
+def handler(event: dict, context) -> dict:
+    """
+    Обработчик очереди фоновых заданий background_jobs: таймерный триггер раз в минуту (trigger.json).
+    GET ?action=status&id= — состояние задания, прогресс и результат
+    GET ?action=list[&status=][&kind=][&limit=] — последние задания
+    POST (и вызов таймером) — выполнить готовые задания в пределах WORKER_TIME_BUDGET
+    HTTP-вызовы — только с X-Admin-Token администратора.
+    """
+    if event.get('httpMethod') == 'OPTIONS':
+        return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': ''}
+
+    method = event.get('httpMethod', 'POST')
+    params = event.get('queryStringParameters') or {}
+    action = params.get('action', '')
+
+    if not is_timer_event(event):
+        headers = event.get('headers') or {}
+        admin_token = headers.get('x-admin-token') or headers.get('X-Admin-Token')
+        conn = get_db()
+        try:
+            authorized = verify_admin_token(admin_token, conn)
+        finally:
+            release_db(conn)
+        if not authorized:
+            return {
+                'statusCode': 403,
+                'headers': {**CORS_HEADERS, 'Content-Type': 'application/json'},
+                'body': json.dumps({'error': 'Unauthorized'}),
+            }
+
+    if method == 'GET' and action == 'status':
+        try:
+            job_id = int(params.get('id', ''))
+        except ValueError:
+            return {
+                'statusCode': 400,
+                'headers': {**CORS_HEADERS, 'Content-Type': 'application/json'},
+                'body': json.dumps({'error': 'Invalid id'}),
+            }
+        conn = get_db()
+        try:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            cur.execute(f'SELECT {JOB_COLUMNS} FROM "{SCHEMA}".background_jobs WHERE id = %s', (job_id,))
+            row = cur.fetchone()
+            cur.close()
+        finally:
+            release_db(conn)
+        if not row:
+            return {
+                'statusCode': 404,
+                'headers': {**CORS_HEADERS, 'Content-Type': 'application/json'},
+                'body': json.dumps({'error': 'Задание не найдено'}),
+            }
+        return {
+            'statusCode': 200,
+            'headers': {**CORS_HEADERS, 'Content-Type': 'application/json'},
+            'body': json.dumps({'success': True, 'job': job_view(row)}, default=str),
+        }
+
+    if method == 'GET' and action == 'list':
+        conditions, values = [], []
+        if params.get('status'):
+            conditions.append('status = %s')
+            values.append(params['status'])
+        if params.get('kind'):
+            conditions.append('kind = %s')
+            values.append(params['kind'])
+        where = (' WHERE ' + ' AND '.join(conditions)) if conditions else ''
+        try:
+            limit = max(1, min(int(params.get('limit', 50)), 200))
+        except ValueError:
+            return {
+                'statusCode': 400,
+                'headers': {**CORS_HEADERS, 'Content-Type': 'application/json'},
+                'body': json.dumps({'error': 'Invalid limit'}),
+            }
+        conn = get_db()
+        try:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            cur.execute(
+                f'SELECT {JOB_COLUMNS} FROM "{SCHEMA}".background_jobs{where} ORDER BY id DESC LIMIT %s',
+                (*values, limit),
+            )
+            rows = cur.fetchall()
+            cur.close()
+        finally:
+            release_db(conn)
+        return {
+            'statusCode': 200,
+            'headers': {**CORS_HEADERS, 'Content-Type': 'application/json'},
+            'body': json.dumps({'success': True, 'jobs': [job_view(r) for r in rows]}, default=str),
+        }
+
+    if method == 'GET':
+        return {
+            'statusCode': 400,
+            'headers': {**CORS_HEADERS, 'Content-Type': 'application/json'},
+            'body': json.dumps({'error': 'Unknown action'}),
+        }
+
+    # Несколько потоков, чтобы долгое задание (архив) не задерживало короткие (уведомления пациентам)
+    deadline = monotonic() + WORKER_TIME_BUDGET
+    with ThreadPoolExecutor(max_workers=WORKER_CONCURRENCY) as workers:
+        per_worker = list(workers.map(lambda _: work_loop(deadline), range(WORKER_CONCURRENCY)))
+    counts = {}
+    for worker_counts in per_worker:
+        for outcome, n in worker_counts.items():
+            counts[outcome] = counts.get(outcome, 0) + n
+
+    conn = get_db()
+    try:
+        pruned = prune_jobs(conn)
+    finally:
+        release_db(conn)
+
+    print(f'[job-worker] processed={counts} pruned={pruned}')
+    return {
+        'statusCode': 200,
+        'headers': {**CORS_HEADERS, 'Content-Type': 'application/json'},
+        'body': json.dumps({'success': True, 'processed': counts, 'pruned': pruned}),
+    }
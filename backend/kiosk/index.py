@@ -6,7 +6,9 @@ import os
 import random
 import string
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool, PoolError
 from datetime import datetime, timezone, timedelta
+from time import monotonic
 
 SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 't_p30358746_hospital_website_red')
 
@@ -17,8 +19,94 @@ CORS_HEADERS = {
 }
 
 
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+DB_STATEMENT_TIMEOUT_MS = 5000
+DB_PING_AFTER_SECONDS = 30
+
+# shared:db_pool — копия tools/shared/db_pool.py, правится там (python tools/sync_shared.py)
+_db_pool = None
+_db_last_used = {}
+
+
+def _db_alive(conn) -> bool:
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
 def get_db():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+    """Соединение из пула, живущего между тёплыми вызовами функции.
+    Простаивавшее дольше DB_PING_AFTER_SECONDS соединение проверяется и при обрыве пересоздаётся."""
+    global _db_pool
+    dsn = os.environ['DATABASE_URL']
+    options = f'-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}'
+    if _db_pool is None or _db_pool.closed:
+        _db_pool = ThreadedConnectionPool(1, DB_POOL_MAX, dsn, options=options)
+    for _ in range(DB_POOL_MAX + 1):
+        try:
+            conn = _db_pool.getconn()
+        except PoolError:
+            return psycopg2.connect(dsn, options=options)
+        idle = monotonic() - _db_last_used.get(id(conn), monotonic())
+        if not conn.closed and (idle < DB_PING_AFTER_SECONDS or _db_alive(conn)):
+            return conn
+        _db_last_used.pop(id(conn), None)
+        _db_pool.putconn(conn, close=True)
+    return psycopg2.connect(dsn, options=options)
+
+
+def release_db(conn):
+    """Вернуть соединение в пул; незавершённая транзакция откатывается"""
+    broken = conn.closed
+    if not broken:
+        try:
+            conn.rollback()
+            conn.autocommit = False
+        except psycopg2.Error:
+            broken = True
+    if broken:
+        _db_last_used.pop(id(conn), None)
+    else:
+        _db_last_used[id(conn)] = monotonic()
+    try:
+        _db_pool.putconn(conn, close=broken)
+    except (PoolError, AttributeError):
+        conn.close()
+# end shared:db_pool
+
+
+def sync_day_slots(cur, doctor_id, slot_date):
+    """Пересчитать занятые минуты дня врача в doctor_day_slots внутри текущей транзакции"""
+    cur.execute(f'''
+        INSERT INTO "{SCHEMA}".doctor_day_slots (doctor_id, slot_date)
+        VALUES (%s, %s)
+        ON CONFLICT (doctor_id, slot_date) DO UPDATE SET updated_at = NOW()
+    ''', (doctor_id, slot_date))
+    cur.execute(f'''
+        UPDATE "{SCHEMA}".doctor_day_slots SET booked_minutes = ARRAY(
+            SELECT DISTINCT (EXTRACT(HOUR FROM appointment_time) * 60 + EXTRACT(MINUTE FROM appointment_time))::int
+            FROM "{SCHEMA}".appointments_v2
+            WHERE doctor_id = %s AND appointment_date = %s AND status IN (\'scheduled\', \'completed\')
+            ORDER BY 1
+        ), updated_at = NOW()
+        WHERE doctor_id = %s AND slot_date = %s
+    ''', (doctor_id, slot_date, doctor_id, slot_date))
+    # Ждущие appointments?action=slot-updates получат уведомление после коммита
+    cur.execute('SELECT pg_notify(%s, %s)', ('slot_changes', f'{doctor_id}:{slot_date}'))
+
+
+# shared:phone — копия tools/shared/phone.py, правится там (python tools/sync_shared.py)
+def normalize_phone(phone):
+    """Последние 10 цифр номера — значение patient_phone_norm, по которому ищутся записи пациента"""
+    digits = ''.join(filter(str.isdigit, phone or ''))
+    return digits[-10:] or None
+# end shared:phone
 
 
 def generate_code():
@@ -55,31 +143,27 @@ def handler(event: dict, context) -> dict:
         cur = conn.cursor()
 
         cur.execute(f'''
-            SELECT COUNT(*) FROM "{SCHEMA}".appointments_v2
-            WHERE doctor_id = %s AND appointment_date = %s AND appointment_time = %s
-            AND status NOT IN (\'cancelled\')
-        ''', (doctor_id, appointment_date, appointment_time))
-        count = cur.fetchone()[0]
-        if count > 0:
+            INSERT INTO "{SCHEMA}".appointments_v2
+            (doctor_id, patient_name, patient_phone, patient_phone_norm, patient_snils, patient_oms,
+             appointment_date, appointment_time, description, status, created_by)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, 'scheduled', 4)
+            ON CONFLICT (doctor_id, appointment_date, appointment_time) WHERE status != \'cancelled\'
+            DO NOTHING
+            RETURNING id, created_at
+        ''', (doctor_id, patient_name, patient_phone, normalize_phone(patient_phone), patient_snils, patient_oms,
+              appointment_date, appointment_time, description))
+        row = cur.fetchone()
+        if not row:
             cur.close()
-            conn.close()
+            release_db(conn)
             return {
                 'statusCode': 409,
                 'headers': {**CORS_HEADERS, 'Content-Type': 'application/json'},
                 'body': json.dumps({'error': 'Выбранное время уже занято'}),
             }
-
-        cur.execute(f'''
-            INSERT INTO "{SCHEMA}".appointments_v2
-            (doctor_id, patient_name, patient_phone, patient_snils, patient_oms,
-             appointment_date, appointment_time, description, status, created_by)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, 'scheduled', 4)
-            RETURNING id, created_at
-        ''', (doctor_id, patient_name, patient_phone, patient_snils, patient_oms,
-              appointment_date, appointment_time, description))
-        row = cur.fetchone()
         appointment_id = row[0]
         created_at = row[1]
+        sync_day_slots(cur, doctor_id, appointment_date)
 
         code = generate_code()
         cur.execute(f'''
@@ -89,7 +173,7 @@ def handler(event: dict, context) -> dict:
 
         conn.commit()
         cur.close()
-        conn.close()
+        release_db(conn)
 
         return {
             'statusCode': 200,
@@ -117,7 +201,7 @@ def handler(event: dict, context) -> dict:
         cur = conn.cursor()
         cur.execute(f'''
             SELECT ic.appointment_id, a.status, a.appointment_date, a.appointment_time,
-                   a.patient_name, d.full_name
+                   a.patient_name, d.full_name, a.doctor_id
             FROM "{SCHEMA}".id_codes ic
             JOIN "{SCHEMA}".appointments_v2 a ON a.id = ic.appointment_id
             JOIN "{SCHEMA}".doctors d ON d.id = a.doctor_id
@@ -127,18 +211,18 @@ def handler(event: dict, context) -> dict:
 
         if not row:
             cur.close()
-            conn.close()
+            release_db(conn)
             return {
                 'statusCode': 404,
                 'headers': {**CORS_HEADERS, 'Content-Type': 'application/json'},
                 'body': json.dumps({'error': 'Запись с таким кодом не найдена'}),
             }
 
-        appointment_id, status, apt_date, apt_time, patient_name, doctor_name = row
+        appointment_id, status, apt_date, apt_time, patient_name, doctor_name, doctor_id = row
 
         if status == 'cancelled':
             cur.close()
-            conn.close()
+            release_db(conn)
             return {
                 'statusCode': 409,
                 'headers': {**CORS_HEADERS, 'Content-Type': 'application/json'},
@@ -146,11 +230,12 @@ def handler(event: dict, context) -> dict:
             }
 
         cur.execute(f'''
-            UPDATE "{SCHEMA}".appointments_v2 SET status = 'cancelled' WHERE id = %s
+            UPDATE "{SCHEMA}".appointments_v2 SET status = 'cancelled', updated_at = CURRENT_TIMESTAMP WHERE id = %s
         ''', (appointment_id,))
+        sync_day_slots(cur, doctor_id, apt_date)
         conn.commit()
         cur.close()
-        conn.close()
+        release_db(conn)
 
         return {
             'statusCode': 200,
@@ -1,16 +1,106 @@
 import json
 import os
+import re
 import smtplib
+import threading
 import urllib.request
 import urllib.error
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue, Empty
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.pool import ThreadedConnectionPool, PoolError
+from psycopg2.extras import RealDictCursor, execute_values
 from typing import Dict, Any
+from time import monotonic, sleep
+
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+DB_STATEMENT_TIMEOUT_MS = 30000
+DB_PING_AFTER_SECONDS = 30
+
+# shared:db_pool — копия tools/shared/db_pool.py, правится там (python tools/sync_shared.py)
+_db_pool = None
+_db_last_used = {}
+
+
+def _db_alive(conn) -> bool:
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def get_db():
+    """Соединение из пула, живущего между тёплыми вызовами функции.
+    Простаивавшее дольше DB_PING_AFTER_SECONDS соединение проверяется и при обрыве пересоздаётся."""
+    global _db_pool
+    dsn = os.environ['DATABASE_URL']
+    options = f'-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}'
+    if _db_pool is None or _db_pool.closed:
+        _db_pool = ThreadedConnectionPool(1, DB_POOL_MAX, dsn, options=options)
+    for _ in range(DB_POOL_MAX + 1):
+        try:
+            conn = _db_pool.getconn()
+        except PoolError:
+            return psycopg2.connect(dsn, options=options)
+        idle = monotonic() - _db_last_used.get(id(conn), monotonic())
+        if not conn.closed and (idle < DB_PING_AFTER_SECONDS or _db_alive(conn)):
+            return conn
+        _db_last_used.pop(id(conn), None)
+        _db_pool.putconn(conn, close=True)
+    return psycopg2.connect(dsn, options=options)
+
+
+def release_db(conn):
+    """Вернуть соединение в пул; незавершённая транзакция откатывается"""
+    broken = conn.closed
+    if not broken:
+        try:
+            conn.rollback()
+            conn.autocommit = False
+        except psycopg2.Error:
+            broken = True
+    if broken:
+        _db_last_used.pop(id(conn), None)
+    else:
+        _db_last_used[id(conn)] = monotonic()
+    try:
+        _db_pool.putconn(conn, close=broken)
+    except (PoolError, AttributeError):
+        conn.close()
+# end shared:db_pool
+
 
 SCHEMA = 't_p30358746_hospital_website_red'
+
+# Массовая рассылка: время работы одного вызова, после которого незаконченное задание
+# продолжается следующим вызовом, и повторы временных ошибок с растущей паузой
+SEND_TIME_BUDGET = 20
+SEND_CLAIM_TIMEOUT_MINUTES = 5
+SEND_MAX_ATTEMPTS = 4
+SEND_RETRY_BASE_SECONDS = 2
+SEND_ERRORS_MAX = 50
+# С background=true рассылку выполняет job-worker; приоритет выше архивов, ниже уведомлений пациентам
+SEND_JOB_PRIORITY = 0
+
+# Email: параллельные SMTP-сессии и размер пачки получателей
+EMAIL_WORKERS = int(os.environ.get('EMAIL_WORKERS', '4'))
+EMAIL_BATCH = 100
+SMTP_TIMEOUT = 20
+SMTP_SESSION_MESSAGES = 100
+
+# MAX через GREEN-API: параллельные запросы и общий предел запросов в секунду
+GREEN_API_URL = os.environ.get('GREEN_API_URL', 'https://api.green-api.com')
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', '8'))
+MAX_RATE_PER_SECOND = float(os.environ.get('MAX_RATE_PER_SECOND', '10'))
+MAX_BATCH = 100
+MAX_HTTP_TIMEOUT = 10
 CORS_HEADERS = {
     'Content-Type': 'application/json',
     'Access-Control-Allow-Origin': '*'
@@ -37,13 +127,15 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     if not database_url:
         return resp(500, {'error': 'Ошибка конфигурации БД'})
 
-    conn = psycopg2.connect(database_url)
+    conn = get_db()
 
     try:
         if method == 'GET':
             params = event.get('queryStringParameters') or {}
             if params.get('action') == 'logs':
                 return handle_get_logs(conn, params)
+            if params.get('action') == 'send_job':
+                return handle_get_send_job(conn, params)
             return handle_get(conn, event)
         elif method == 'POST':
             body = json.loads(event.get('body', '{}'))
@@ -59,17 +151,95 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 return handle_delete(conn, body)
             elif action == 'log':
                 return handle_log(conn, body, event)
+            elif action == 'recount_stats':
+                return handle_recount_stats(conn)
             else:
                 return resp(400, {'error': 'Неизвестное действие'})
         else:
             return resp(405, {'error': 'Метод не поддерживается'})
     finally:
-        conn.close()
+        release_db(conn)
+
+
+# Поиск по реестру под индексы V0081: цифры телефона сравниваются по последним 10
+REGISTRY_PHONE_DIGITS = "RIGHT(REGEXP_REPLACE(phone, '[^0-9]', '', 'g'), 10)"
+REGISTRY_PHONE_TERM = re.compile(r'[\d\s()+\-]+')
+# Триграммный индекс не помогает LIKE по строке короче триграммы: одна-две цифры номера — это полный
+# просмотр реестра с REGEXP_REPLACE на каждой строке, поэтому такой запрос фильтром не считается
+REGISTRY_PHONE_MIN_DIGITS = 3
+
+
+def like_escape(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def registry_search(search, mode):
+    """Условие поиска по реестру и выражение релевантности для сортировки (или None).
+    contains — подстрока по триграммным индексам: email, если в запросе есть «@»; телефон, если запрос
+    состоит из цифр и знаков номера; иначе ФИО или email.
+    Номер короче REGISTRY_PHONE_MIN_DIGITS цифр — пустой фильтр: возвращается None.
+    prefix — начала слов ФИО по полнотекстовому индексу (to_tsquery с :*), результаты по релевантности."""
+    term = search.strip()
+    if '@' in term:
+        pattern = like_escape(term) + '%' if mode == 'prefix' else f'%{like_escape(term)}%'
+        return "email ILIKE %s", [pattern], None, []
+    if REGISTRY_PHONE_TERM.fullmatch(term):
+        digits = re.sub(r'\D', '', term)
+        if len(digits) < REGISTRY_PHONE_MIN_DIGITS:
+            return None
+        if len(digits) > REGISTRY_PHONE_MIN_DIGITS and len(digits) < 11 and digits[0] in '78':
+            # Неполный номер с кодом страны («+7912», «8912»): в индексе номер хранится без кода,
+            # поэтому ищем и подстроку как есть, и начало номера без первой цифры
+            return (
+                f"({REGISTRY_PHONE_DIGITS} LIKE %s OR {REGISTRY_PHONE_DIGITS} LIKE %s)",
+                [f'%{digits}%', f'{digits[1:]}%'], None, [],
+            )
+        return f"{REGISTRY_PHONE_DIGITS} LIKE %s", [f'%{digits[-10:]}%'], None, []
+    if mode == 'prefix':
+        words = re.findall(r'[^\W_]+', term.lower())
+        if words:
+            query = ' & '.join(f'{word}:*' for word in words)
+            return (
+                "to_tsvector('russian', full_name) @@ to_tsquery('russian', %s)", [query],
+                "ts_rank(to_tsvector('russian', full_name), to_tsquery('russian', %s))", [query],
+            )
+    pattern = f'%{like_escape(term)}%'
+    return "(full_name ILIKE %s OR email ILIKE %s)", [pattern, pattern], None, []
+
+
+# Число найденных записей: точно — только с count=exact. Без фильтров и с фильтром по источнику — из
+# счётчиков registry_source_stats, иначе подсчёт не дальше REGISTRY_COUNT_CAP строк и оценка планировщика сверх него
+REGISTRY_COUNT_CAP = 5000
+
+
+def registry_source_stats(conn):
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT source, records FROM {SCHEMA}.registry_source_stats")
+    counters = {name: int(records) for name, records in cursor.fetchall()}
+    cursor.close()
+    return counters
+
+
+def count_registry(cursor, where, query_params, cap):
+    """Число строк под фильтром, считая не дальше cap. Возвращает (число, точное ли оно)"""
+    cursor.execute(
+        f"SELECT COUNT(*) FROM (SELECT 1 FROM {SCHEMA}.reest_phone_max{where} LIMIT %s) t",
+        tuple(query_params) + (cap + 1,)
+    )
+    counted = int(cursor.fetchone()['count'])
+    if counted <= cap:
+        return counted, True
+    cursor.execute(f"EXPLAIN (FORMAT JSON) SELECT 1 FROM {SCHEMA}.reest_phone_max{where}", tuple(query_params))
+    plan = cursor.fetchone()['QUERY PLAN']
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return max(int(plan[0]['Plan']['Plan Rows']), counted), False
 
 
 def handle_get(conn, event):
     params = event.get('queryStringParameters') or {}
     search = params.get('search', '')
+    search_mode = 'prefix' if params.get('search_mode') == 'prefix' else 'contains'
     source = params.get('source', '')
     date_from = params.get('date_from', '')
     date_to = params.get('date_to', '')
@@ -81,11 +251,13 @@ def handle_get(conn, event):
 
     conditions = []
     query_params = []
+    rank, rank_params = None, []
 
-    if search:
-        conditions.append("(full_name ILIKE %s OR phone ILIKE %s OR email ILIKE %s)")
-        s = f'%{search}%'
-        query_params += [s, s, s]
+    search_filter = registry_search(search, search_mode) if search.strip() else None
+    if search_filter:
+        condition, values, rank, rank_params = search_filter
+        conditions.append(condition)
+        query_params += values
 
     if source and source != 'all':
         conditions.append("source = %s")
@@ -101,167 +273,468 @@ def handle_get(conn, event):
 
     where = (' WHERE ' + ' AND '.join(conditions)) if conditions else ''
 
-    count_query = f"SELECT COUNT(*) FROM {SCHEMA}.reest_phone_max" + where
-    cursor.execute(count_query, tuple(query_params))
-    total = int(cursor.fetchone()['count'])
+    counters = registry_source_stats(conn)
+    stats = {name: records for name, records in counters.items() if name and records > 0}
 
-    stats_query = f"""
-        SELECT source, COUNT(*) as cnt FROM {SCHEMA}.reest_phone_max
-        GROUP BY source
-    """
-    cursor.execute(stats_query)
-    stats_rows = cursor.fetchall()
-    stats = {r['source']: int(r['cnt']) for r in stats_rows if r['source']}
+    if params.get('count') == 'exact':
+        cursor.execute(f"SELECT COUNT(*) FROM {SCHEMA}.reest_phone_max" + where, tuple(query_params))
+        total, total_exact = int(cursor.fetchone()['count']), True
+    elif not search_filter and not date_from and not date_to:
+        total = counters.get(source, 0) if source and source != 'all' else sum(counters.values())
+        total_exact = True
+    else:
+        total, total_exact = count_registry(cursor, where, query_params, max(REGISTRY_COUNT_CAP, offset + page_size))
 
-    query = f"SELECT * FROM {SCHEMA}.reest_phone_max" + where + " ORDER BY created_at DESC LIMIT %s OFFSET %s"
-    cursor.execute(query, tuple(query_params) + (page_size, offset))
+    order = f"{rank} DESC, created_at DESC" if rank else "created_at DESC"
+    query = f"SELECT * FROM {SCHEMA}.reest_phone_max" + where + f" ORDER BY {order} LIMIT %s OFFSET %s"
+    cursor.execute(query, tuple(query_params) + tuple(rank_params) + (page_size, offset))
     rows = cursor.fetchall()
     cursor.close()
 
-    return resp(200, {'records': rows, 'total': total, 'page': page, 'page_size': page_size, 'stats': stats})
+    return resp(200, {'records': rows, 'total': total, 'total_exact': total_exact, 'page': page,
+                      'page_size': page_size, 'stats': stats, 'search_mode': search_mode})
 
 
 def handle_send_email(conn, body):
+    settings = smtp_settings()
+    if not settings['user'] or not settings['password']:
+        return resp(500, {'error': 'Настройки SMTP не указаны'})
+    return handle_send_job(conn, body, 'email', 'SMTP', EMAIL_BATCH,
+                           lambda message_text, batch: send_email_batch(settings, message_text, batch))
+
+
+def handle_send_max(conn, body):
+    instance_id = os.environ.get('GREEN_API_INSTANCE_ID')
+    token = os.environ.get('GREEN_API_TOKEN')
+    if not instance_id or not token:
+        return resp(500, {'error': 'Настройки GREEN-API не указаны'})
+    url = f'{GREEN_API_URL}/v3/waInstance{instance_id}/sendMessage/{token}'
+    return handle_send_job(conn, body, 'max', 'GREEN-API', MAX_BATCH,
+                           lambda message_text, batch: send_max_batch(url, message_text, batch))
+
+
+def handle_send_job(conn, body, channel, channel_name, batch_size, send_batch):
+    """Массовая рассылка заданием: получатели сохраняются в registry_send_items и отправляются пачками,
+    пока не истечёт SEND_TIME_BUDGET. Незаконченное задание продолжается повторным вызовом с job_id.
+    С background=true задание только ставится в очередь job-worker, ответ 202 приходит сразу,
+    а ход рассылки читается через GET ?action=send_job&id=.
+    send_batch(текст, пачка) возвращает ([(record_id, адрес, sent|failed|retry, ошибка)], фатальная ошибка)."""
+    job_id = body.get('job_id')
     ids = body.get('ids', [])
     message_text = body.get('message', '')
 
-    if not ids or not message_text:
+    if not job_id and (not ids or not message_text):
         return resp(400, {'error': 'Укажите получателей и текст сообщения'})
 
-    smtp_server = os.environ.get('SMTP_SERVER', 'smtp.gmail.com')
-    smtp_port = int(os.environ.get('SMTP_PORT', '587'))
-    smtp_user = os.environ.get('SMTP_USER')
-    smtp_password = os.environ.get('SMTP_PASSWORD')
-    from_email = os.environ.get('FROM_EMAIL', smtp_user)
+    if job_id:
+        job = get_send_job(conn, job_id)
+        if not job or job['channel'] != channel:
+            return resp(404, {'error': 'Задание рассылки не найдено'})
+        if job['status'] == 'failed':
+            reopen_send_job(conn, job_id)
+            job = get_send_job(conn, job_id)
+    else:
+        job_id = create_send_job(conn, channel, message_text, ids)
+        job = get_send_job(conn, job_id)
+        if body.get('background') and job['status'] == 'running':
+            background_job_id = enqueue_job(
+                conn, 'registry_send', {'channel': channel, 'send_job_id': job_id},
+                priority=SEND_JOB_PRIORITY, dedupe_key=f'registry_send:{job_id}',
+            )
+            conn.commit()
+            return resp(202, {
+                'success': True,
+                'queued': True,
+                'job_id': job_id,
+                'background_job_id': background_job_id,
+                'status': job['status'],
+                'total': job['total'],
+                'sent_count': job['sent'],
+                'failed': job['failed'],
+                'pending': job['total'] - job['sent'] - job['failed'],
+            })
 
-    if not smtp_user or not smtp_password:
-        return resp(500, {'error': 'Настройки SMTP не указаны'})
+    errors = []
+    deadline = monotonic() + SEND_TIME_BUDGET
+    while job['status'] == 'running' and monotonic() < deadline:
+        batch = claim_send_items(conn, job_id, batch_size)
+        if not batch:
+            # Остались только получатели, ждущие повтора: подождать ближайшего, если он успевает в бюджет
+            delay = next_retry_delay(conn, job_id)
+            if delay is None or monotonic() + delay >= deadline:
+                break
+            sleep(delay)
+            continue
+        results, fatal = send_batch(job['message'], batch)
+        record_send_results(conn, job, results)
+        errors += [f"{address}: {error}" for _, address, status, error in results if status == 'failed']
+        if fatal:
+            done = {record_id for record_id, _, _, _ in results}
+            release_send_items(conn, job_id, [item['record_id'] for item in batch if item['record_id'] not in done])
+            fail_send_job(conn, job_id, fatal)
+            return resp(500, {'error': f'Ошибка {channel_name}: {fatal}', 'job_id': job_id})
+        job = get_send_job(conn, job_id)
 
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    return resp(200, {
+        'success': True,
+        'job_id': job_id,
+        'status': job['status'],
+        'total': job['total'],
+        'sent_count': job['sent'],
+        'failed': job['failed'],
+        'pending': job['total'] - job['sent'] - job['failed'],
+        'errors': errors[:SEND_ERRORS_MAX],
+    })
 
-    placeholders = ','.join(['%s'] * len(ids))
-    cursor.execute(
-        f"SELECT * FROM {SCHEMA}.reest_phone_max WHERE id IN ({placeholders})",
-        tuple(ids)
-    )
-    records = cursor.fetchall()
 
-    sent_count = 0
-    errors = []
+def handle_get_send_job(conn, params):
+    job = get_send_job(conn, params.get('id'))
+    if not job:
+        return resp(404, {'error': 'Задание рассылки не найдено'})
+    return resp(200, {'job': {**job, 'pending': job['total'] - job['sent'] - job['failed']}})
 
-    try:
-        server = smtplib.SMTP(smtp_server, smtp_port)
-        server.starttls()
-        server.login(smtp_user, smtp_password)
-
-        for rec in records:
-            email = rec.get('email')
-            if not email:
-                errors.append(f"{rec.get('full_name', '?')}: нет email")
-                continue
-
-            msg = MIMEMultipart()
-            msg['From'] = from_email
-            msg['To'] = email
-            msg['Subject'] = 'Сообщение от ГБУЗ АЦГМБ ЛНР'
-            msg.attach(MIMEText(message_text, 'plain', 'utf-8'))
-
-            try:
-                server.send_message(msg)
-                sent_count += 1
-                now = datetime.now().isoformat()
-                cursor.execute(
-                    f"UPDATE {SCHEMA}.reest_phone_max SET last_email_text = %s, last_email_sent_at = %s, updated_at = NOW() WHERE id = %s",
-                    (message_text, now, rec['id'])
-                )
-            except Exception as e:
-                errors.append(f"{email}: {str(e)}")
 
-        server.quit()
-    except Exception as e:
-        return resp(500, {'error': f'Ошибка SMTP: {str(e)}'})
+def smtp_settings():
+    user = os.environ.get('SMTP_USER')
+    return {
+        'server': os.environ.get('SMTP_SERVER', 'smtp.gmail.com'),
+        'port': int(os.environ.get('SMTP_PORT', '587')),
+        'user': user,
+        'password': os.environ.get('SMTP_PASSWORD'),
+        'from_email': os.environ.get('FROM_EMAIL', user),
+        'starttls': os.environ.get('SMTP_STARTTLS', '1') != '0',
+    }
 
+
+def open_smtp(settings):
+    server = smtplib.SMTP(settings['server'], settings['port'], timeout=SMTP_TIMEOUT)
+    try:
+        if settings['starttls']:
+            server.starttls()
+        server.login(settings['user'], settings['password'])
+    except Exception:
+        server.close()
+        raise
+    return server
+
+
+def close_smtp(server):
+    if server is None:
+        return
+    try:
+        server.quit()
+    except (smtplib.SMTPException, OSError):
+        server.close()
+
+
+def send_email_batch(settings, message_text, batch):
+    """Отправить пачку писем EMAIL_WORKERS потоками; у каждого своя SMTP-сессия на много писем,
+    переоткрываемая после SMTP_SESSION_MESSAGES писем или обрыва. Обрыв связи — повтор позже,
+    отказ сервера принять письмо — окончательная ошибка."""
+    pending = Queue()
+    for item in batch:
+        pending.put(item)
+    results = []
+    fatal = []
+
+    def worker():
+        server = None
+        session_sent = 0
+        try:
+            while not fatal:
+                try:
+                    item = pending.get_nowait()
+                except Empty:
+                    return
+                msg = MIMEMultipart()
+                msg['From'] = settings['from_email']
+                msg['To'] = item['address']
+                msg['Subject'] = 'Сообщение от ГБУЗ АЦГМБ ЛНР'
+                msg.attach(MIMEText(message_text, 'plain', 'utf-8'))
+                try:
+                    if server is None or session_sent >= SMTP_SESSION_MESSAGES:
+                        close_smtp(server)
+                        server = None
+                        server = open_smtp(settings)
+                        session_sent = 0
+                    server.send_message(msg)
+                    session_sent += 1
+                    results.append((item['record_id'], item['address'], 'sent', None))
+                except smtplib.SMTPAuthenticationError as e:
+                    # Неверные учётные данные не исправятся повтором: задание останавливается,
+                    # а письмо возвращается в очередь
+                    fatal.append(str(e))
+                    return
+                except (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError, smtplib.SMTPSenderRefused) as e:
+                    results.append((item['record_id'], item['address'], 'failed', str(e)))
+                except (smtplib.SMTPException, OSError) as e:
+                    results.append((item['record_id'], item['address'], 'retry', str(e)))
+                    close_smtp(server)
+                    server = None
+        finally:
+            close_smtp(server)
+
+    threads = [threading.Thread(target=worker) for _ in range(min(EMAIL_WORKERS, len(batch)))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results, (fatal[0] if fatal else None)
+
+
+class RateLimiter:
+    """Общий для потоков предел запросов в секунду; pause() сдвигает следующий запрос,
+    когда провайдер ответил 429"""
+
+    def __init__(self, per_second):
+        self.interval = 1.0 / per_second
+        self.next_at = monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = monotonic()
+            wait = self.next_at - now
+            self.next_at = max(now, self.next_at) + self.interval
+        if wait > 0:
+            sleep(wait)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.next_at = max(self.next_at, monotonic() + seconds)
+
+
+def send_max_batch(url, message_text, batch):
+    """Отправить пачку сообщений через GREEN-API MAX_WORKERS потоками не чаще MAX_RATE_PER_SECOND.
+    429, 5xx и сетевые ошибки — повтор позже, прочие 4xx — окончательная ошибка,
+    401/403 (неверный токен или экземпляр) останавливают задание."""
+    limiter = RateLimiter(MAX_RATE_PER_SECOND)
+    fatal = []
+
+    def send(item):
+        clean_phone = ''.join(filter(str.isdigit, item['address'] or ''))
+        if len(clean_phone) < 10:
+            return item['record_id'], item['address'], 'failed', 'некорректный номер'
+        if fatal:
+            return None
+        request_data = json.dumps({'chatId': f'{clean_phone}@c.us', 'message': message_text}).encode('utf-8')
+        req = urllib.request.Request(url, data=request_data, headers={'Content-Type': 'application/json'}, method='POST')
+        limiter.acquire()
+        try:
+            with urllib.request.urlopen(req, timeout=MAX_HTTP_TIMEOUT) as response:
+                response.read()
+            return item['record_id'], item['address'], 'sent', None
+        except urllib.error.HTTPError as e:
+            if e.code in (401, 403):
+                fatal.append(f'HTTP {e.code}')
+                return None
+            if e.code == 429:
+                limiter.pause(float(e.headers.get('Retry-After') or 1))
+            status = 'retry' if e.code == 429 or e.code >= 500 else 'failed'
+            return item['record_id'], item['address'], status, f'HTTP {e.code}'
+        except (urllib.error.URLError, OSError) as e:
+            return item['record_id'], item['address'], 'retry', str(e)
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        results = [r for r in executor.map(send, batch) if r]
+    return results, (fatal[0] if fatal else None)
+
+
+def create_send_job(conn, channel, message_text, ids):
+    """Задание рассылки и его получатели одной транзакцией; без адреса получатель сразу failed"""
+    address_column = 'email' if channel == 'email' else 'phone'
+    missing = 'нет email' if channel == 'email' else 'нет телефона'
+    cursor = conn.cursor()
+    cursor.execute(
+        f"INSERT INTO {SCHEMA}.registry_send_jobs (channel, message) VALUES (%s, %s) RETURNING id",
+        (channel, message_text)
+    )
+    job_id = cursor.fetchone()[0]
+    cursor.execute(f"""
+        INSERT INTO {SCHEMA}.registry_send_items (job_id, record_id, address, status, error)
+        SELECT %s, id, NULLIF({address_column}, ''),
+               CASE WHEN NULLIF({address_column}, '') IS NULL THEN 'failed' ELSE 'pending' END,
+               CASE WHEN NULLIF({address_column}, '') IS NULL THEN full_name || ': ' || %s END
+        FROM {SCHEMA}.reest_phone_max
+        WHERE id = ANY(%s)
+    """, (job_id, missing, [int(i) for i in ids]))
+    cursor.execute(f"""
+        UPDATE {SCHEMA}.registry_send_jobs j
+        SET total = c.total, failed = c.failed,
+            status = CASE WHEN c.total = c.failed THEN 'done' ELSE 'running' END,
+            finished_at = CASE WHEN c.total = c.failed THEN NOW() END
+        FROM (
+            SELECT COUNT(*) AS total, COUNT(*) FILTER (WHERE status = 'failed') AS failed
+            FROM {SCHEMA}.registry_send_items WHERE job_id = %s
+        ) c
+        WHERE j.id = %s
+    """, (job_id, job_id))
     conn.commit()
     cursor.close()
+    return job_id
 
-    return resp(200, {
-        'success': True,
-        'sent_count': sent_count,
-        'errors': errors
-    })
 
+def get_send_job(conn, job_id):
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    cursor.execute(
+        f"SELECT id, channel, message, status, total, sent, failed, last_error, created_at, updated_at, finished_at "
+        f"FROM {SCHEMA}.registry_send_jobs WHERE id = %s",
+        (job_id,)
+    )
+    job = cursor.fetchone()
+    cursor.close()
+    return job
 
-def handle_send_max(conn, body):
-    ids = body.get('ids', [])
-    message_text = body.get('message', '')
 
-    if not ids or not message_text:
-        return resp(400, {'error': 'Укажите получателей и текст сообщения'})
+def claim_send_items(conn, job_id, limit):
+    """Взять пачку получателей, которым пора отправлять; брошенные упавшим вызовом (sending дольше
+    SEND_CLAIM_TIMEOUT_MINUTES) берутся повторно, параллельный вызов пропускает занятые строки"""
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    cursor.execute(f"""
+        UPDATE {SCHEMA}.registry_send_items i
+        SET status = 'sending', claimed_at = NOW()
+        FROM (
+            SELECT record_id FROM {SCHEMA}.registry_send_items
+            WHERE job_id = %s
+              AND ((status = 'pending' AND (next_attempt_at IS NULL OR next_attempt_at <= NOW()))
+                   OR (status = 'sending' AND claimed_at < NOW() - %s * INTERVAL '1 minute'))
+            ORDER BY record_id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        ) c
+        WHERE i.job_id = %s AND i.record_id = c.record_id
+        RETURNING i.record_id, i.address
+    """, (job_id, SEND_CLAIM_TIMEOUT_MINUTES, limit, job_id))
+    items = cursor.fetchall()
+    conn.commit()
+    cursor.close()
+    return items
 
-    green_api_instance_id = os.environ.get('GREEN_API_INSTANCE_ID')
-    green_api_token = os.environ.get('GREEN_API_TOKEN')
 
-    if not green_api_instance_id or not green_api_token:
-        return resp(500, {'error': 'Настройки GREEN-API не указаны'})
+def next_retry_delay(conn, job_id):
+    """Секунд до ближайшего повтора в задании; None, если ждущих повтора нет"""
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT GREATEST(EXTRACT(EPOCH FROM MIN(next_attempt_at) - NOW()), 0)
+        FROM {SCHEMA}.registry_send_items
+        WHERE job_id = %s AND status = 'pending'
+    """, (job_id,))
+    delay = cursor.fetchone()[0]
+    conn.commit()
+    cursor.close()
+    return float(delay) if delay is not None else None
 
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
 
-    placeholders = ','.join(['%s'] * len(ids))
+def release_send_items(conn, job_id, record_ids):
+    if not record_ids:
+        return
+    cursor = conn.cursor()
     cursor.execute(
-        f"SELECT * FROM {SCHEMA}.reest_phone_max WHERE id IN ({placeholders})",
-        tuple(ids)
+        f"UPDATE {SCHEMA}.registry_send_items SET status = 'pending', claimed_at = NULL "
+        f"WHERE job_id = %s AND record_id = ANY(%s) AND status = 'sending'",
+        (job_id, record_ids)
     )
-    records = cursor.fetchall()
+    conn.commit()
+    cursor.close()
 
-    sent_count = 0
-    errors = []
 
-    for rec in records:
-        phone = rec.get('phone')
-        if not phone:
-            errors.append(f"{rec.get('full_name', '?')}: нет телефона")
-            continue
-
-        clean_phone = ''.join(filter(str.isdigit, phone))
-        if len(clean_phone) < 10:
-            errors.append(f"{phone}: некорректный номер")
-            continue
+def record_send_results(conn, job, results):
+    """Итоги пачки тремя запросами: статусы получателей, отметки в реестре и счётчики задания.
+    Повтор откладывается на SEND_RETRY_BASE_SECONDS * 2^попытка, после SEND_MAX_ATTEMPTS попыток — failed."""
+    if not results:
+        return
+    sent_column, text_column = (
+        ('last_email_sent_at', 'last_email_text') if job['channel'] == 'email'
+        else ('last_max_sent_at', 'last_max_text')
+    )
+    cursor = conn.cursor()
+    statuses = execute_values(cursor, f"""
+        UPDATE {SCHEMA}.registry_send_items AS i
+        SET status = CASE
+                WHEN v.status <> 'retry' THEN v.status
+                WHEN i.attempts + 1 < {SEND_MAX_ATTEMPTS} THEN 'pending'
+                ELSE 'failed'
+            END,
+            error = v.error,
+            attempts = i.attempts + 1,
+            next_attempt_at = CASE
+                WHEN v.status = 'retry' THEN NOW() + {SEND_RETRY_BASE_SECONDS} * POWER(2, i.attempts) * INTERVAL '1 second'
+            END,
+            sent_at = CASE WHEN v.status = 'sent' THEN NOW() END
+        FROM (VALUES %s) AS v(job_id, record_id, status, error)
+        WHERE i.job_id = v.job_id AND i.record_id = v.record_id
+        RETURNING i.record_id, i.status
+    """, [(job['id'], record_id, status, error) for record_id, _, status, error in results],
+        template='(%s, %s, %s, %s::text)', page_size=1000, fetch=True)
+    sent_ids = [record_id for record_id, status in statuses if status == 'sent']
+    failed = sum(1 for _, status in statuses if status == 'failed')
+    if sent_ids:
+        cursor.execute(f"""
+            UPDATE {SCHEMA}.reest_phone_max AS r
+            SET {text_column} = j.message, {sent_column} = NOW(), updated_at = NOW()
+            FROM {SCHEMA}.registry_send_jobs j
+            WHERE j.id = %s AND r.id = ANY(%s)
+        """, (job['id'], sent_ids))
+    cursor.execute(f"""
+        UPDATE {SCHEMA}.registry_send_jobs j
+        SET sent = sent + %s, failed = failed + %s, updated_at = NOW(),
+            status = CASE WHEN EXISTS (
+                SELECT 1 FROM {SCHEMA}.registry_send_items
+                WHERE job_id = j.id AND status IN ('pending', 'sending')
+            ) THEN status ELSE 'done' END,
+            finished_at = CASE WHEN EXISTS (
+                SELECT 1 FROM {SCHEMA}.registry_send_items
+                WHERE job_id = j.id AND status IN ('pending', 'sending')
+            ) THEN NULL ELSE NOW() END
+        WHERE j.id = %s
+    """, (len(sent_ids), failed, job['id']))
+    conn.commit()
+    cursor.close()
 
-        chat_id = f"{clean_phone}@c.us"
-        request_data = json.dumps({
-            'chatId': chat_id,
-            'message': message_text
-        }).encode('utf-8')
 
-        url = f'https://api.green-api.com/v3/waInstance{green_api_instance_id}/sendMessage/{green_api_token}'
+def reopen_send_job(conn, job_id):
+    cursor = conn.cursor()
+    cursor.execute(
+        f"UPDATE {SCHEMA}.registry_send_jobs SET status = 'running', last_error = NULL, updated_at = NOW() WHERE id = %s",
+        (job_id,)
+    )
+    conn.commit()
+    cursor.close()
 
-        try:
-            req = urllib.request.Request(
-                url,
-                data=request_data,
-                headers={'Content-Type': 'application/json'},
-                method='POST'
-            )
-            with urllib.request.urlopen(req, timeout=15) as response:
-                json.loads(response.read().decode('utf-8'))
-
-            sent_count += 1
-            now = datetime.now().isoformat()
-            cursor.execute(
-                f"UPDATE {SCHEMA}.reest_phone_max SET last_max_text = %s, last_max_sent_at = %s, updated_at = NOW() WHERE id = %s",
-                (message_text, now, rec['id'])
-            )
-        except Exception as e:
-            errors.append(f"{phone}: {str(e)}")
 
+def fail_send_job(conn, job_id, error):
+    cursor = conn.cursor()
+    cursor.execute(
+        f"UPDATE {SCHEMA}.registry_send_jobs SET status = 'failed', last_error = %s, updated_at = NOW() WHERE id = %s",
+        (error, job_id)
+    )
     conn.commit()
     cursor.close()
 
-    return resp(200, {
-        'success': True,
-        'sent_count': sent_count,
-        'errors': errors
-    })
+
+# shared:background_jobs — копия tools/shared/background_jobs.py, правится там (python tools/sync_shared.py)
+def enqueue_job(conn, kind, payload, priority=0, dedupe_key=None):
+    """Поставить задание в background_jobs в текущей транзакции (коммитит вызывающий).
+    Пока задание с тем же dedupe_key ждёт или выполняется, возвращается его id."""
+    cur = conn.cursor()
+    for _ in range(2):
+        cur.execute(f'''
+            INSERT INTO "{SCHEMA}".background_jobs (kind, payload, priority, dedupe_key)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (dedupe_key) WHERE status IN ('queued', 'running') DO NOTHING
+            RETURNING id
+        ''', (kind, json.dumps(payload), priority, dedupe_key))
+        row = cur.fetchone()
+        if row is None:
+            cur.execute(f'''
+                SELECT id FROM "{SCHEMA}".background_jobs WHERE dedupe_key = %s AND status IN ('queued', 'running')
+            ''', (dedupe_key,))
+            row = cur.fetchone()
+        if row is not None:
+            break
+    cur.close()
+    return row[0]
+# end shared:background_jobs
 
 
 def handle_update(conn, body):
@@ -306,21 +779,45 @@ def handle_delete(conn, body):
     if not rec_id and not ids:
         return resp(400, {'error': 'Не указан id записи'})
 
+    # Счётчики по источникам уменьшаются той же транзакцией, что и удаление
     cursor = conn.cursor()
-
-    if ids:
-        placeholders = ','.join(['%s'] * len(ids))
-        cursor.execute(f"DELETE FROM {SCHEMA}.reest_phone_max WHERE id IN ({placeholders})", tuple(ids))
-        deleted = cursor.rowcount
-    else:
-        cursor.execute(f"DELETE FROM {SCHEMA}.reest_phone_max WHERE id = %s", (rec_id,))
-        deleted = cursor.rowcount
+    cursor.execute(f"""
+        WITH deleted AS (
+            DELETE FROM {SCHEMA}.reest_phone_max WHERE id = ANY(%s)
+            RETURNING COALESCE(source, '') AS source
+        ), counted AS (
+            SELECT source, COUNT(*) AS records FROM deleted GROUP BY source
+        ), adjusted AS (
+            UPDATE {SCHEMA}.registry_source_stats s
+            SET records = GREATEST(s.records - c.records, 0), updated_at = NOW()
+            FROM counted c
+            WHERE s.source = c.source
+        )
+        SELECT COALESCE(SUM(records), 0) FROM counted
+    """, ([int(i) for i in (ids or [rec_id])],))
+    deleted = int(cursor.fetchone()[0])
 
     conn.commit()
     cursor.close()
     return resp(200, {'success': True, 'deleted': deleted})
 
 
+def handle_recount_stats(conn):
+    """Пересчитать registry_source_stats по таблице. Блокировка счётчиков не даёт параллельной вставке
+    в реестр учесть свою запись дважды: её прибавка дождётся коммита пересчёта."""
+    cursor = conn.cursor()
+    cursor.execute(f"LOCK TABLE {SCHEMA}.registry_source_stats IN EXCLUSIVE MODE")
+    cursor.execute(f"DELETE FROM {SCHEMA}.registry_source_stats")
+    cursor.execute(f"""
+        INSERT INTO {SCHEMA}.registry_source_stats (source, records)
+        SELECT COALESCE(source, ''), COUNT(*) FROM {SCHEMA}.reest_phone_max
+        GROUP BY COALESCE(source, '')
+    """)
+    conn.commit()
+    cursor.close()
+    return resp(200, {'success': True, 'stats': registry_source_stats(conn)})
+
+
 def handle_log(conn, body, event):
     admin_login = body.get('admin_login', '')
     action_type = body.get('action_type', '')
@@ -1,8 +1,74 @@
 import json
 import os
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool, PoolError
 from typing import Dict, Any, Optional, Tuple
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from time import monotonic, time
+from collections import OrderedDict
+import threading
+
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+DB_STATEMENT_TIMEOUT_MS = 2000
+DB_PING_AFTER_SECONDS = 30
+
+# shared:db_pool — копия tools/shared/db_pool.py, правится там (python tools/sync_shared.py)
+_db_pool = None
+_db_last_used = {}
+
+
+def _db_alive(conn) -> bool:
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def get_db():
+    """Соединение из пула, живущего между тёплыми вызовами функции.
+    Простаивавшее дольше DB_PING_AFTER_SECONDS соединение проверяется и при обрыве пересоздаётся."""
+    global _db_pool
+    dsn = os.environ['DATABASE_URL']
+    options = f'-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}'
+    if _db_pool is None or _db_pool.closed:
+        _db_pool = ThreadedConnectionPool(1, DB_POOL_MAX, dsn, options=options)
+    for _ in range(DB_POOL_MAX + 1):
+        try:
+            conn = _db_pool.getconn()
+        except PoolError:
+            return psycopg2.connect(dsn, options=options)
+        idle = monotonic() - _db_last_used.get(id(conn), monotonic())
+        if not conn.closed and (idle < DB_PING_AFTER_SECONDS or _db_alive(conn)):
+            return conn
+        _db_last_used.pop(id(conn), None)
+        _db_pool.putconn(conn, close=True)
+    return psycopg2.connect(dsn, options=options)
+
+
+def release_db(conn):
+    """Вернуть соединение в пул; незавершённая транзакция откатывается"""
+    broken = conn.closed
+    if not broken:
+        try:
+            conn.rollback()
+            conn.autocommit = False
+        except psycopg2.Error:
+            broken = True
+    if broken:
+        _db_last_used.pop(id(conn), None)
+    else:
+        _db_last_used[id(conn)] = monotonic()
+    try:
+        _db_pool.putconn(conn, close=broken)
+    except (PoolError, AttributeError):
+        conn.close()
+# end shared:db_pool
+
 
 def verify_admin_token(token: str, conn) -> bool:
     """Проверка токена администратора через БД"""
@@ -53,7 +119,33 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
-    conn = psycopg2.connect(dsn)
+    if method == 'POST':
+        try:
+            body_data = json.loads(event.get('body', '{}'))
+        except (TypeError, ValueError):
+            body_data = {}
+        action = body_data.get('action', '')
+        ip_address = body_data.get('ip', '')
+        endpoint = body_data.get('endpoint', 'unknown')
+        fingerprint = body_data.get('fingerprint', '')
+
+        # Быстрый путь без соединения с БД — ключи с запасом до лимита в рамках аренды экземпляра
+        if action == 'check_and_record' and ip_address and local_check_and_record(ip_address, endpoint, fingerprint):
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'allowed': True, 'reason': None}),
+                'isBase64Encoded': False
+            }
+        if action == 'record' and local_record(ip_address, endpoint, fingerprint):
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'success': True}),
+                'isBase64Encoded': False
+            }
+
+    conn = get_db()
     conn.autocommit = True
     cursor = conn.cursor()
     
@@ -75,10 +167,12 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'isBase64Encoded': False
                     }
                 
-                is_blocked, reason = check_rate_limit(cursor, ip_address, endpoint, fingerprint)
+                if action == 'check_and_record':
+                    is_blocked, reason = check_and_record(cursor, ip_address, endpoint, fingerprint)
+                else:
+                    is_blocked, reason = check_rate_limit(cursor, ip_address, endpoint, fingerprint)
                 
-                if not is_blocked and action == 'check_and_record':
-                    record_request(cursor, ip_address, endpoint, fingerprint)
+                prune_expired(cursor)
                 
                 return {
                     'statusCode': 200,
@@ -96,6 +190,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 fingerprint = body_data.get('fingerprint', '')
                 
                 record_request(cursor, ip_address, endpoint, fingerprint)
+                prune_expired(cursor)
                 
                 return {
                     'statusCode': 200,
@@ -145,106 +240,381 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     finally:
         cursor.close()
-        conn.close()
+        release_db(conn)
+
+
+# (ключ счётчика, окно в секундах, порог, причина блокировки)
+RATE_LIMITS = [
+    ('ip', 60, 60, 'Превышен лимит: более 60 запросов в минуту'),
+    ('ip', 3600, 1000, 'Превышен лимит: более 1000 запросов в час'),
+    ('endpoint', 60, 10, 'Превышен лимит для {endpoint}: более 10 запросов в минуту'),
+    ('fingerprint', 60, 60, 'Превышен лимит для устройства'),
+]
+
+PRUNE_INTERVAL_SECONDS = 300
+_last_prune = None
+
+# Локальный быстрый путь: после сверки с общими счётчиками экземпляр получает «аренду» —
+# долю LOCAL_SHARE от оставшегося до лимита запаса по каждому ключу, поделённую на
+# RATE_LIMIT_INSTANCES — ожидаемое число тёплых экземпляров. Аренды разных экземпляров
+# не видят друг друга, поэтому вместе они не должны превышать оставшийся запас. Пока аренда не истекла
+# и в ней есть токены, запросы пропускаются без обращения к БД и копятся в _pending_*,
+# которые сбрасываются в общие счётчики при следующем походе в БД (не реже LOCAL_SYNC_SECONDS).
+# Ключи у самого лимита токенов не получают и всегда сверяются с БД.
+#
+# Предел недосчёта: экземпляр пропускает по аренде не больше floor(LOCAL_SHARE × limit / RATE_LIMIT_INSTANCES)
+# запросов ключа, которых не видят остальные. При N тёплых экземплярах лимит ключа может быть превышен
+# не больше чем на N × LOCAL_SHARE × limit / RATE_LIMIT_INSTANCES — при верной оценке N это LOCAL_SHARE × limit
+# (для 60 в минуту по IP — 30), и растёт, если экземпляров больше, чем RATE_LIMIT_INSTANCES.
+#
+# Несброшенные _pending_* пропадают вместе с экземпляром, когда платформа его выгружает.
+# Потеря ограничена: быстрый путь отказывает, как только в буфере LOCAL_FLUSH_MAX запросов,
+# а по каждому ключу в буфере не больше его аренды — то есть в пределах недосчёта выше.
+LOCAL_KEYS_MAX = int(os.environ.get('RATE_LIMIT_LOCAL_KEYS', '10000'))
+LOCAL_SHARE = 0.5
+LOCAL_INSTANCES = max(1, int(os.environ.get('RATE_LIMIT_INSTANCES', '4')))
+LOCAL_SYNC_SECONDS = 5
+LOCAL_FLUSH_MAX = 200
+
+_local_lock = threading.Lock()
+_leases = OrderedDict()
+_pending_hits = {}
+_pending_logs = []
+_pending_since = None
+
+
+def window_start(seconds: int, now: float) -> int:
+    return int(now // seconds) * seconds
+
+
+def limit_buckets(ip_address: str, endpoint: str, fingerprint: str):
+    buckets = []
+    for kind, seconds, limit, reason in RATE_LIMITS:
+        if kind == 'ip':
+            key = f'{seconds}:ip:{ip_address}'
+        elif kind == 'endpoint':
+            key = f'{seconds}:ep:{ip_address}:{endpoint}'
+        elif fingerprint:
+            key = f'{seconds}:fp:{fingerprint}'
+        else:
+            continue
+        buckets.append((key, seconds, limit, reason.format(endpoint=endpoint)))
+    return buckets
+
+
+def estimate_requests(hits: int, prev_hits: int, start: float, seconds: int, now: float) -> float:
+    """Скользящее окно по двум фиксированным: предыдущее берётся с весом непрошедшей доли текущего"""
+    elapsed = (now - start) / seconds
+    return prev_hits * max(0.0, 1.0 - elapsed) + hits
+
+
+def evaluate_limits(buckets, rows, now: float, include_current: bool) -> Tuple[bool, Optional[str]]:
+    counters = {row[0]: row[1:] for row in rows}
+    for key, seconds, limit, reason in buckets:
+        start, hits, prev_hits = counters.get(key, (window_start(seconds, now), 0, 0))
+        previous_requests = estimate_requests(hits, prev_hits, float(start), seconds, now) - (1 if include_current else 0)
+        if previous_requests > limit:
+            return True, reason
+    return False, None
+
+
+def grant_leases(buckets, rows, now: float):
+    """Выдать экземпляру токены на запросы по ключам, далёким от лимита"""
+    counters = {row[0]: row[1:4] for row in rows}
+    expires_at = monotonic() + LOCAL_SYNC_SECONDS
+    with _local_lock:
+        for key, seconds, limit, _ in buckets:
+            start, hits, prev_hits = counters.get(key, (window_start(seconds, now), 0, 0))
+            tokens = int((limit - estimate_requests(hits, prev_hits, float(start), seconds, now)) * LOCAL_SHARE / LOCAL_INSTANCES)
+            if tokens <= 0:
+                _leases.pop(key, None)
+                continue
+            _leases[key] = [int(start), tokens, expires_at]
+            _leases.move_to_end(key)
+        while len(_leases) > LOCAL_KEYS_MAX:
+            _leases.popitem(last=False)
+
+
+def pend_request(ip_address: str, endpoint: str, fingerprint: str, buckets, now: float):
+    """Учесть запрос локально до ближайшего сброса в БД (вызывается под _local_lock)"""
+    global _pending_since
+    for key, seconds, _, _ in buckets:
+        slot = (key, seconds, window_start(seconds, now))
+        _pending_hits[slot] = _pending_hits.get(slot, 0) + 1
+    _pending_logs.append((ip_address, endpoint, fingerprint or None, datetime.now()))
+    if _pending_since is None:
+        _pending_since = monotonic()
+
+
+def flush_due() -> bool:
+    return _pending_since is not None and (
+        len(_pending_logs) >= LOCAL_FLUSH_MAX or monotonic() - _pending_since >= LOCAL_SYNC_SECONDS
+    )
+
+
+def local_check_and_record(ip_address: str, endpoint: str, fingerprint: str) -> bool:
+    """Пропустить запрос по локальной аренде без БД. False — нужен полный путь через общие счётчики."""
+    buckets = limit_buckets(ip_address, endpoint, fingerprint)
+    now = time()
+    with _local_lock:
+        if flush_due():
+            return False
+        leases = []
+        for key, seconds, _, _ in buckets:
+            lease = _leases.get(key)
+            if lease is None or lease[0] != window_start(seconds, now) or lease[1] < 1 or lease[2] < monotonic():
+                return False
+            leases.append((key, lease))
+        for key, lease in leases:
+            lease[1] -= 1
+            _leases.move_to_end(key)
+        pend_request(ip_address, endpoint, fingerprint, buckets, now)
+    return True
+
+
+def local_record(ip_address: str, endpoint: str, fingerprint: str) -> bool:
+    """Отложить запись запроса до ближайшего сброса в БД. False — пора сбрасывать."""
+    with _local_lock:
+        if flush_due():
+            return False
+        pend_request(ip_address, endpoint, fingerprint, limit_buckets(ip_address, endpoint, fingerprint), time())
+    return True
+
+
+def take_pending():
+    global _pending_hits, _pending_logs, _pending_since
+    with _local_lock:
+        hits, logs = _pending_hits, _pending_logs
+        _pending_hits, _pending_logs, _pending_since = {}, [], None
+    return hits, logs
+
+
+def restore_pending(hits, logs):
+    global _pending_since
+    with _local_lock:
+        for slot, count in hits.items():
+            _pending_hits[slot] = _pending_hits.get(slot, 0) + count
+        _pending_logs.extend(logs)
+        if _pending_since is None:
+            _pending_since = monotonic()
+
+
+def hit_counters(cursor, ip_address: Optional[str], endpoint: str, fingerprint: str, buckets, now: float,
+                 conditional: bool = False):
+    '''Сбросить накопленные локально запросы вместе с текущим в лог и счётчики окон — один запрос к БД.
+    При conditional текущий запрос учитывается, только если ни один ключ не превышает лимит:
+    условие проверяется в самом ON CONFLICT DO UPDATE ... WHERE по заблокированной строке счётчика,
+    поэтому параллельные запросы у порога не проходят вместе. Не вернувшаяся из upsert строка — отказ.
+    Возвращает (ключ, начало окна, hits, hits предыдущего окна, учтён ли текущий запрос, был ли запас по снимку)
+    по всем затронутым ключам.'''
+    hits, logs = take_pending()
+    merged = {slot: [count, None] for slot, count in hits.items()}
+    current_logs = [(*log, False) for log in logs]
+    if ip_address is not None:
+        for key, seconds, limit, _ in buckets:
+            slot = (key, seconds, window_start(seconds, now))
+            merged.setdefault(slot, [0, None])[0] += 1
+            if conditional:
+                merged[slot][1] = limit
+        current_logs.append((ip_address, endpoint, fingerprint or None, datetime.now(), conditional))
+    if not merged:
+        return []
+    slots = list(merged.items())
+    try:
+        cursor.execute('''
+            WITH state AS (
+                SELECT k.key, k.seconds, k.start, k.hits, k.lim IS NOT NULL AS is_current,
+                    COALESCE(cur.hits, 0) AS cur_hits, COALESCE(prev.hits, 0) AS prev_hits,
+                    k.lim - COALESCE(prev.hits, 0) * GREATEST(0, 1 - (%s - k.start) / k.seconds::float) AS allowance
+                FROM unnest(%s::text[], %s::int[], %s::bigint[], %s::int[], %s::int[]) AS k(key, seconds, start, hits, lim)
+                LEFT JOIN rate_limit_counters cur
+                    ON cur.bucket_key = k.key AND cur.window_start = to_timestamp(k.start)
+                LEFT JOIN rate_limit_counters prev
+                    ON prev.bucket_key = k.key AND prev.window_start = to_timestamp(k.start - k.seconds)
+            ), verdict AS (
+                SELECT COALESCE(bool_and(cur_hits + hits - 1 <= allowance) FILTER (WHERE is_current), TRUE) AS fits
+                FROM state
+            ), hit AS (
+                INSERT INTO rate_limit_counters (bucket_key, window_seconds, window_start, hits)
+                SELECT s.key, s.seconds, to_timestamp(s.start), s.hits
+                FROM state s, verdict v
+                WHERE NOT s.is_current OR v.fits
+                ON CONFLICT (bucket_key, window_start) DO UPDATE SET hits = rate_limit_counters.hits + EXCLUDED.hits
+                WHERE rate_limit_counters.hits + EXCLUDED.hits - 1 <= COALESCE((
+                    SELECT s.allowance FROM state s
+                    WHERE s.is_current AND s.key = rate_limit_counters.bucket_key
+                        AND to_timestamp(s.start) = rate_limit_counters.window_start
+                ), 'Infinity')
+                RETURNING bucket_key, window_start, hits
+            ), outcome AS (
+                SELECT count(*) = (SELECT count(*) FROM state WHERE is_current) AS allowed
+                FROM hit
+                JOIN state s ON s.is_current AND s.key = hit.bucket_key AND to_timestamp(s.start) = hit.window_start
+            ), accepted AS (
+                SELECT l.ip_address, l.endpoint, l.fingerprint, l.created_at
+                FROM unnest(%s::varchar[], %s::varchar[], %s::varchar[], %s::timestamp[], %s::bool[])
+                    AS l(ip_address, endpoint, fingerprint, created_at, conditional)
+                WHERE NOT l.conditional OR (SELECT allowed FROM outcome)
+            ), logged AS (
+                INSERT INTO rate_limit_logs (ip_address, endpoint, fingerprint, created_at)
+                SELECT * FROM accepted
+            ), rolled AS (
+                INSERT INTO rate_limit_stats_hourly (bucket_hour, endpoint, ip_address, fingerprint, requests, first_seen, last_seen)
+                SELECT date_trunc('hour', created_at), endpoint, ip_address, COALESCE(fingerprint, ''),
+                    count(*), min(created_at), max(created_at)
+                FROM accepted
+                GROUP BY 1, 2, 3, 4
+                ON CONFLICT (bucket_hour, endpoint, ip_address, fingerprint) DO UPDATE SET
+                    requests = rate_limit_stats_hourly.requests + EXCLUDED.requests,
+                    first_seen = LEAST(rate_limit_stats_hourly.first_seen, EXCLUDED.first_seen),
+                    last_seen = GREATEST(rate_limit_stats_hourly.last_seen, EXCLUDED.last_seen)
+            )
+            SELECT s.key, s.start, COALESCE(hit.hits, s.cur_hits), s.prev_hits,
+                hit.bucket_key IS NOT NULL, s.cur_hits + s.hits - 1 <= s.allowance
+            FROM state s
+            LEFT JOIN hit ON hit.bucket_key = s.key AND hit.window_start = to_timestamp(s.start)
+        ''', (
+            now,
+            [slot[0][0] for slot in slots], [slot[0][1] for slot in slots],
+            [slot[0][2] for slot in slots], [slot[1][0] for slot in slots], [slot[1][1] for slot in slots],
+            [row[0] for row in current_logs], [row[1] for row in current_logs],
+            [row[2] for row in current_logs], [row[3] for row in current_logs], [row[4] for row in current_logs],
+        ))
+    except Exception:
+        restore_pending(hits, logs)
+        raise
+    rows = cursor.fetchall()
+    # Отклонённая строка текущего окна не учла и отложенные по ней запросы — вернуть их до следующего сброса
+    refused = {(row[0], row[1]) for row in rows if not row[4]}
+    unsaved = {slot: count for slot, count in hits.items() if (slot[0], slot[2]) in refused}
+    if unsaved:
+        restore_pending(unsaved, [])
+    # По ключу могут вернуться строки прошлого окна из отложенных запросов — берём текущее
+    latest = {}
+    for row in rows:
+        if row[0] not in latest or row[1] > latest[row[0]][1]:
+            latest[row[0]] = row
+    return list(latest.values())
 
 
 def check_rate_limit(cursor, ip_address: str, endpoint: str, fingerprint: str) -> Tuple[bool, Optional[str]]:
-    '''Проверка rate limit для IP/fingerprint'''
-    
-    now = datetime.now()
-    
-    cursor.execute('''
-        SELECT COUNT(*), MAX(created_at) 
-        FROM rate_limit_logs 
-        WHERE ip_address = %s 
-        AND created_at > %s
-    ''', (ip_address, now - timedelta(minutes=1)))
-    
-    result = cursor.fetchone()
-    requests_per_minute = result[0] if result else 0
-    
-    if requests_per_minute > 60:
-        return True, 'Превышен лимит: более 60 запросов в минуту'
-    
+    '''Проверка rate limit для IP/fingerprint одним чтением счётчиков'''
+    hit_counters(cursor, None, endpoint, fingerprint, [], time())
+    buckets = limit_buckets(ip_address, endpoint, fingerprint)
+    now = time()
+    starts = [window_start(b[1], now) for b in buckets]
     cursor.execute('''
-        SELECT COUNT(*) 
-        FROM rate_limit_logs 
-        WHERE ip_address = %s 
-        AND created_at > %s
-    ''', (ip_address, now - timedelta(hours=1)))
-    
-    result = cursor.fetchone()
-    requests_per_hour = result[0] if result else 0
-    
-    if requests_per_hour > 1000:
-        return True, 'Превышен лимит: более 1000 запросов в час'
-    
-    cursor.execute('''
-        SELECT COUNT(*) 
-        FROM rate_limit_logs 
-        WHERE ip_address = %s 
-        AND endpoint = %s 
-        AND created_at > %s
-    ''', (ip_address, endpoint, now - timedelta(minutes=1)))
-    
-    result = cursor.fetchone()
-    endpoint_requests = result[0] if result else 0
-    
-    if endpoint_requests > 10:
-        return True, f'Превышен лимит для {endpoint}: более 10 запросов в минуту'
-    
-    if fingerprint:
-        cursor.execute('''
-            SELECT COUNT(*) 
-            FROM rate_limit_logs 
-            WHERE fingerprint = %s 
-            AND created_at > %s
-        ''', (fingerprint, now - timedelta(minutes=1)))
-        
-        result = cursor.fetchone()
-        fingerprint_requests = result[0] if result else 0
-        
-        if fingerprint_requests > 60:
-            return True, 'Превышен лимит для устройства'
-    
-    return False, None
+        SELECT k.key, k.start, COALESCE(cur.hits, 0), COALESCE(prev.hits, 0)
+        FROM unnest(%s::text[], %s::int[], %s::bigint[]) AS k(key, seconds, start)
+        LEFT JOIN rate_limit_counters cur
+            ON cur.bucket_key = k.key AND cur.window_start = to_timestamp(k.start)
+        LEFT JOIN rate_limit_counters prev
+            ON prev.bucket_key = k.key AND prev.window_start = to_timestamp(k.start - k.seconds)
+    ''', ([b[0] for b in buckets], [b[1] for b in buckets], starts))
+    rows = cursor.fetchall()
+    grant_leases(buckets, rows, now)
+    return evaluate_limits(buckets, rows, now, include_current=False)
+
+
+def check_and_record(cursor, ip_address: str, endpoint: str, fingerprint: str) -> Tuple[bool, Optional[str]]:
+    '''Проверить лимиты и учесть запрос, только если он пропущен — один условный upsert (см. hit_counters).
+    Заблокированные запросы в счётчики не попадают, как и при раздельных check/record:
+    иначе клиент у порога, продолжая стучаться, сам продлевал бы себе блокировку.
+    Если два ключа одного запроса упираются в лимит одновременно с чужими запросами, по ключу,
+    где запас ещё был, отказанный запрос может учесться — не больше одного на каждый параллельный запрос.'''
+    buckets = limit_buckets(ip_address, endpoint, fingerprint)
+    now = time()
+    rows = hit_counters(cursor, ip_address, endpoint, fingerprint, buckets, now, conditional=True)
+    counters = {row[0]: row for row in rows}
+    refused = [b for b in buckets if not counters[b[0]][4]]
+    if not refused:
+        grant_leases(buckets, rows, now)
+        return False, None
+    with _local_lock:
+        for key, _, _, _ in buckets:
+            _leases.pop(key, None)
+    # Причина — ключ, у которого не было запаса; если его не было ни у одного, отказ из-за гонки у порога
+    over = [b for b in refused if not counters[b[0]][5]]
+    return True, (over or refused)[0][3]
 
 
 def record_request(cursor, ip_address: str, endpoint: str, fingerprint: str):
     '''Записать запрос в лог'''
-    
-    cursor.execute('''
-        INSERT INTO rate_limit_logs (ip_address, endpoint, fingerprint, created_at)
-        VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
-    ''', (ip_address, endpoint, fingerprint or None))
-    
+    hit_counters(cursor, ip_address, endpoint, fingerprint, limit_buckets(ip_address, endpoint, fingerprint), time())
+
+
+LOG_RETENTION_DAYS = 1
+LOG_PARTITIONS_AHEAD = 2
+STATS_RETENTION_HOURS = 48
+
+
+def prune_expired(cursor):
+    '''Очистка устаревших счётчиков, агрегатов и секций логов — не чаще раза в PRUNE_INTERVAL_SECONDS на экземпляр'''
+    global _last_prune
+    now = monotonic()
+    if _last_prune is not None and now - _last_prune < PRUNE_INTERVAL_SECONDS:
+        return
+    _last_prune = now
+    cursor.execute("DELETE FROM rate_limit_counters WHERE window_start < NOW() - INTERVAL '2 hours'")
+    cursor.execute(
+        "DELETE FROM rate_limit_stats_hourly WHERE bucket_hour < %s",
+        (datetime.now() - timedelta(hours=STATS_RETENTION_HOURS),)
+    )
+    maintain_log_partitions(cursor)
+
+
+def maintain_log_partitions(cursor):
+    '''Создать секции rate_limit_logs на ближайшие дни и удалить секции старше срока хранения.
+    Секция на текущий день заранее не создаётся: если её нет, строки уже лежат в rate_limit_logs_default.'''
+    today = date.today()
+    for offset in range(1, LOG_PARTITIONS_AHEAD + 1):
+        day = today + timedelta(days=offset)
+        try:
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS rate_limit_logs_p{day:%Y%m%d} PARTITION OF rate_limit_logs "
+                f"FOR VALUES FROM ('{day.isoformat()}') TO ('{(day + timedelta(days=1)).isoformat()}')"
+            )
+        except psycopg2.Error:
+            # Секцию одновременно создал другой экземпляр — следующая очистка её увидит
+            pass
+
     cursor.execute('''
-        DELETE FROM rate_limit_logs 
-        WHERE created_at < %s
-    ''', (datetime.now() - timedelta(days=1),))
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'rate_limit_logs'::regclass
+    ''')
+    oldest_kept = f'rate_limit_logs_p{today - timedelta(days=LOG_RETENTION_DAYS):%Y%m%d}'
+    for (name,) in cursor.fetchall():
+        if name.startswith('rate_limit_logs_p') and name < oldest_kept:
+            cursor.execute(f'DROP TABLE IF EXISTS {name}')
+    cursor.execute(
+        "DELETE FROM rate_limit_logs_default WHERE created_at < %s",
+        (datetime.now() - timedelta(days=LOG_RETENTION_DAYS),)
+    )
 
 
 def get_statistics(cursor) -> Dict[str, Any]:
-    '''Получить статистику запросов'''
+    '''Получить статистику запросов за сутки из почасовых агрегатов'''
+    since = (datetime.now() - timedelta(hours=24)).replace(minute=0, second=0, microsecond=0)
     
     cursor.execute('''
         SELECT 
             endpoint,
-            COUNT(*) as total_requests,
+            SUM(requests) as total_requests,
             COUNT(DISTINCT ip_address) as unique_ips,
-            COUNT(DISTINCT fingerprint) as unique_devices
-        FROM rate_limit_logs
-        WHERE created_at > %s
+            COUNT(DISTINCT NULLIF(fingerprint, '')) as unique_devices
+        FROM rate_limit_stats_hourly
+        WHERE bucket_hour >= %s
         GROUP BY endpoint
         ORDER BY total_requests DESC
         LIMIT 20
-    ''', (datetime.now() - timedelta(hours=24),))
+    ''', (since,))
     
     endpoint_stats = []
     for row in cursor.fetchall():
         endpoint_stats.append({
             'endpoint': row[0],
-            'total_requests': row[1],
+            'total_requests': int(row[1]),
             'unique_ips': row[2],
             'unique_devices': row[3]
         })
@@ -252,22 +622,22 @@ def get_statistics(cursor) -> Dict[str, Any]:
     cursor.execute('''
         SELECT 
             ip_address,
-            COUNT(*) as request_count,
-            MIN(created_at) as first_seen,
-            MAX(created_at) as last_seen
-        FROM rate_limit_logs
-        WHERE created_at > %s
+            SUM(requests) as request_count,
+            MIN(first_seen) as first_seen,
+            MAX(last_seen) as last_seen
+        FROM rate_limit_stats_hourly
+        WHERE bucket_hour >= %s
         GROUP BY ip_address
-        HAVING COUNT(*) > 500
+        HAVING SUM(requests) > 500
         ORDER BY request_count DESC
         LIMIT 10
-    ''', (datetime.now() - timedelta(hours=24),))
+    ''', (since,))
     
     suspicious_ips = []
     for row in cursor.fetchall():
         suspicious_ips.append({
             'ip_address': row[0],
-            'request_count': row[1],
+            'request_count': int(row[1]),
             'first_seen': row[2].isoformat() if row[2] else None,
             'last_seen': row[3].isoformat() if row[3] else None
         })
@@ -275,4 +645,4 @@ def get_statistics(cursor) -> Dict[str, Any]:
     return {
         'endpoint_stats': endpoint_stats,
         'suspicious_ips': suspicious_ips
-    }
\ No newline at end of file
+    }
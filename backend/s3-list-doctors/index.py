@@ -1,15 +1,62 @@
+import hashlib
 import json
 import os
+from collections import OrderedDict
+from time import monotonic
 import boto3
 
+# shared:response_cache — копия tools/shared/response_cache.py, правится там (python tools/sync_shared.py)
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', '60'))
+RESPONSE_CACHE_MAX = 128
+
+_response_cache = OrderedDict()
+
+
+def cached_response(event, key, build):
+    """Ответ на GET из кэша тёплого экземпляра: build() вызывается, только если записи нет или истёк TTL.
+    Кэшируются только ответы 200; ETag — хэш тела, совпавший If-None-Match (или If-None-Match: *) даёт 304 без тела."""
+    entry = _response_cache.get(key)
+    if entry is None or entry['expires'] <= monotonic():
+        response = build()
+        if response['statusCode'] != 200:
+            return response
+        entry = {
+            'expires': monotonic() + RESPONSE_CACHE_TTL,
+            'response': response,
+            'etag': '"' + hashlib.sha256(response['body'].encode()).hexdigest()[:32] + '"',
+        }
+        _response_cache[key] = entry
+        while len(_response_cache) > RESPONSE_CACHE_MAX:
+            _response_cache.popitem(last=False)
+    _response_cache.move_to_end(key)
+    headers = {**entry['response']['headers'], 'ETag': entry['etag'], 'Cache-Control': 'no-cache'}
+    request_headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    if_none_match = request_headers.get('if-none-match', '')
+    if if_none_match.strip() == '*' or entry['etag'] in if_none_match:
+        return {'statusCode': 304, 'headers': headers, 'body': '', 'isBase64Encoded': False}
+    return {**entry['response'], 'headers': headers}
+
+
+def invalidate_cache():
+    """Сбросить кэш ответов после изменения данных этим экземпляром"""
+    _response_cache.clear()
+# end shared:response_cache
+
+
 def handler(event: dict, context) -> dict:
     """
     Получить список файлов из S3 папки Врачи
     GET / - список всех файлов в папке Врачи/
+    Список кэшируется на RESPONSE_CACHE_TTL секунд: файлы загружаются вне этой функции,
+    поэтому сбросить кэш при изменении здесь нечем.
     """
     if event.get('httpMethod') == 'OPTIONS':
         return {'statusCode': 200, 'headers': {'Access-Control-Allow-Origin': '*', 'Access-Control-Allow-Methods': 'GET, OPTIONS', 'Access-Control-Allow-Headers': 'Content-Type', 'Access-Control-Max-Age': '86400'}, 'body': ''}
 
+    return cached_response(event, 'doctors', list_doctor_files)
+
+
+def list_doctor_files() -> dict:
     s3 = boto3.client(
         's3',
         endpoint_url='https://bucket.poehali.dev',
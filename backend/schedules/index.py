@@ -2,8 +2,108 @@ import json
 import os
 import logging
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool, PoolError
 from psycopg2.extras import RealDictCursor
 from typing import Dict, Any
+from time import monotonic
+
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+DB_STATEMENT_TIMEOUT_MS = 10000
+DB_PING_AFTER_SECONDS = 30
+
+# Изменения расписания публикуются ждущим slot-updates (appointments) так же, как изменения занятости:
+# поднимается updated_at дня в doctor_day_slots и уходит уведомление в SLOT_CHANNEL.
+# Недельное расписание отмечает свой день недели на SLOT_TOUCH_DAYS вперёд
+SLOT_CHANNEL = 'slot_changes'
+SLOT_TOUCH_DAYS = 120
+
+# shared:db_pool — копия tools/shared/db_pool.py, правится там (python tools/sync_shared.py)
+_db_pool = None
+_db_last_used = {}
+
+
+def _db_alive(conn) -> bool:
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def get_db():
+    """Соединение из пула, живущего между тёплыми вызовами функции.
+    Простаивавшее дольше DB_PING_AFTER_SECONDS соединение проверяется и при обрыве пересоздаётся."""
+    global _db_pool
+    dsn = os.environ['DATABASE_URL']
+    options = f'-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}'
+    if _db_pool is None or _db_pool.closed:
+        _db_pool = ThreadedConnectionPool(1, DB_POOL_MAX, dsn, options=options)
+    for _ in range(DB_POOL_MAX + 1):
+        try:
+            conn = _db_pool.getconn()
+        except PoolError:
+            return psycopg2.connect(dsn, options=options)
+        idle = monotonic() - _db_last_used.get(id(conn), monotonic())
+        if not conn.closed and (idle < DB_PING_AFTER_SECONDS or _db_alive(conn)):
+            return conn
+        _db_last_used.pop(id(conn), None)
+        _db_pool.putconn(conn, close=True)
+    return psycopg2.connect(dsn, options=options)
+
+
+def release_db(conn):
+    """Вернуть соединение в пул; незавершённая транзакция откатывается"""
+    broken = conn.closed
+    if not broken:
+        try:
+            conn.rollback()
+            conn.autocommit = False
+        except psycopg2.Error:
+            broken = True
+    if broken:
+        _db_last_used.pop(id(conn), None)
+    else:
+        _db_last_used[id(conn)] = monotonic()
+    try:
+        _db_pool.putconn(conn, close=broken)
+    except (PoolError, AttributeError):
+        conn.close()
+# end shared:db_pool
+
+
+# shared:phone — копия tools/shared/phone.py, правится там (python tools/sync_shared.py)
+def normalize_phone(phone):
+    """Последние 10 цифр номера — значение patient_phone_norm, по которому ищутся записи пациента"""
+    digits = ''.join(filter(str.isdigit, phone or ''))
+    return digits[-10:] or None
+# end shared:phone
+
+
+def touch_slot_days(cursor, doctor_id, dates=None, day_of_week=None):
+    """Отметить дни врача изменившимися для slot-updates внутри текущей транзакции: по списку дат
+    или по дню недели недельного расписания. Уведомление в SLOT_CHANNEL уходит только после коммита."""
+    if dates is not None:
+        cursor.execute("""
+            INSERT INTO doctor_day_slots (doctor_id, slot_date)
+            SELECT DISTINCT %s, day FROM unnest(%s::date[]) AS day
+            ON CONFLICT (doctor_id, slot_date) DO UPDATE SET updated_at = NOW()
+        """, (doctor_id, [str(d) for d in dates]))
+    else:
+        cursor.execute("""
+            INSERT INTO doctor_day_slots (doctor_id, slot_date)
+            SELECT %(doctor_id)s, day::date
+            FROM generate_series(CURRENT_DATE, CURRENT_DATE + %(days)s, INTERVAL '1 day') AS day
+            WHERE EXTRACT(DOW FROM day)::int = %(day_of_week)s
+            ON CONFLICT (doctor_id, slot_date) DO UPDATE SET updated_at = NOW()
+        """, {'doctor_id': doctor_id, 'days': SLOT_TOUCH_DAYS, 'day_of_week': int(day_of_week)})
+    # Пустой день в уведомлении — изменились несколько дней врача, ждущие перечитывают весь диапазон
+    day = str(dates[0]) if dates is not None and len(dates) == 1 else ''
+    cursor.execute("SELECT pg_notify(%s, %s)", (SLOT_CHANNEL, f'{doctor_id}:{day}'))
+
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
@@ -35,7 +135,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
-    conn = psycopg2.connect(database_url)
+    conn = get_db()
     
     try:
         if method == 'GET':
@@ -163,6 +263,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     (doctor_id, calendar_date, is_working, note)
                 )
                 calendar_day = cursor.fetchone()
+                touch_slot_days(cursor, doctor_id, [calendar_day['calendar_date']])
                 conn.commit()
                 cursor.close()
                 
@@ -208,6 +309,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     (doctor_id, schedule_date, start_time, end_time, break_start_time, break_end_time, slot_duration, is_active)
                 )
                 daily_schedule = cursor.fetchone()
+                touch_slot_days(cursor, doctor_id, [daily_schedule['schedule_date']])
                 conn.commit()
                 cursor.close()
                 
@@ -239,6 +341,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                            DO UPDATE SET is_working = EXCLUDED.is_working, updated_at = CURRENT_TIMESTAMP""",
                         (doctor_id, date, is_working)
                     )
+                touch_slot_days(cursor, doctor_id, dates)
                 
                 conn.commit()
                 cursor.close()
@@ -272,7 +375,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 
                 if existing:
                     cursor.execute(
-                        "UPDATE doctor_schedules SET start_time = %s, end_time = %s, break_start_time = %s, break_end_time = %s, slot_duration = %s, is_active = true WHERE doctor_id = %s AND day_of_week = %s RETURNING *",
+                        "UPDATE doctor_schedules SET start_time = %s, end_time = %s, break_start_time = %s, break_end_time = %s, slot_duration = %s, is_active = true, updated_at = CURRENT_TIMESTAMP WHERE doctor_id = %s AND day_of_week = %s RETURNING *",
                         (start_time, end_time, break_start_time, break_end_time, slot_duration, doctor_id, day_of_week)
                     )
                 else:
@@ -282,6 +385,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     )
                 
                 schedule = cursor.fetchone()
+                touch_slot_days(cursor, doctor_id, day_of_week=day_of_week)
                 conn.commit()
                 cursor.close()
                 
@@ -327,10 +431,10 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 
                 cursor.execute(
                     """UPDATE appointments_v2 
-                       SET patient_name = %s, patient_phone = %s, patient_snils = %s, 
-                           patient_oms = %s, description = %s 
+                       SET patient_name = %s, patient_phone = %s, patient_phone_norm = %s, patient_snils = %s, 
+                           patient_oms = %s, description = %s, updated_at = CURRENT_TIMESTAMP 
                        WHERE id = %s RETURNING *""",
-                    (name, phone, snils, oms, desc, apt_id)
+                    (name, phone, normalize_phone(phone), snils, oms, desc, apt_id)
                 )
                 
                 result = cursor.fetchone()
@@ -388,6 +492,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     }
                 
                 daily_schedule = cursor.fetchone()
+                if daily_schedule:
+                    touch_slot_days(cursor, daily_schedule['doctor_id'], [daily_schedule['schedule_date']])
                 conn.commit()
                 cursor.close()
                 
@@ -399,9 +505,9 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 }
             else:
                 if is_active is not None:
-                    cursor.execute("UPDATE doctor_schedules SET is_active = %s WHERE id = %s RETURNING *", (is_active, schedule_id))
+                    cursor.execute("UPDATE doctor_schedules SET is_active = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s RETURNING *", (is_active, schedule_id))
                 elif start_time and end_time:
-                    cursor.execute("UPDATE doctor_schedules SET start_time = %s, end_time = %s, break_start_time = %s, break_end_time = %s, slot_duration = %s WHERE id = %s RETURNING *", (start_time, end_time, break_start_time, break_end_time, slot_duration, schedule_id))
+                    cursor.execute("UPDATE doctor_schedules SET start_time = %s, end_time = %s, break_start_time = %s, break_end_time = %s, slot_duration = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s RETURNING *", (start_time, end_time, break_start_time, break_end_time, slot_duration, schedule_id))
                 else:
                     cursor.close()
                     return {
@@ -412,6 +518,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     }
                 
                 schedule = cursor.fetchone()
+                if schedule:
+                    touch_slot_days(cursor, schedule['doctor_id'], day_of_week=schedule['day_of_week'])
                 conn.commit()
                 cursor.close()
                 
@@ -438,9 +546,15 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             cursor = conn.cursor()
             
             if action == 'daily':
-                cursor.execute("DELETE FROM daily_schedules WHERE id = %s", (schedule_id,))
+                cursor.execute("DELETE FROM daily_schedules WHERE id = %s RETURNING doctor_id, schedule_date", (schedule_id,))
+                deleted = cursor.fetchone()
+                if deleted:
+                    touch_slot_days(cursor, deleted[0], [deleted[1]])
             else:
-                cursor.execute("DELETE FROM doctor_schedules WHERE id = %s", (schedule_id,))
+                cursor.execute("DELETE FROM doctor_schedules WHERE id = %s RETURNING doctor_id, day_of_week", (schedule_id,))
+                deleted = cursor.fetchone()
+                if deleted:
+                    touch_slot_days(cursor, deleted[0], day_of_week=deleted[1])
             
             conn.commit()
             cursor.close()
@@ -461,4 +575,4 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             }
     
     finally:
-        conn.close()
\ No newline at end of file
+        release_db(conn)
\ No newline at end of file
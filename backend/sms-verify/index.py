@@ -1,48 +1,194 @@
 import json
 import os
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool, PoolError
 from psycopg2.extras import RealDictCursor
 from typing import Dict, Any
 from datetime import datetime, timedelta
 import random
 import urllib.request
 import urllib.parse
+from time import monotonic, time
+from collections import OrderedDict
+
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+DB_STATEMENT_TIMEOUT_MS = 5000
+DB_PING_AFTER_SECONDS = 30
+
+# shared:db_pool — копия tools/shared/db_pool.py, правится там (python tools/sync_shared.py)
+_db_pool = None
+_db_last_used = {}
+
+
+def _db_alive(conn) -> bool:
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def get_db():
+    """Соединение из пула, живущего между тёплыми вызовами функции.
+    Простаивавшее дольше DB_PING_AFTER_SECONDS соединение проверяется и при обрыве пересоздаётся."""
+    global _db_pool
+    dsn = os.environ['DATABASE_URL']
+    options = f'-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}'
+    if _db_pool is None or _db_pool.closed:
+        _db_pool = ThreadedConnectionPool(1, DB_POOL_MAX, dsn, options=options)
+    for _ in range(DB_POOL_MAX + 1):
+        try:
+            conn = _db_pool.getconn()
+        except PoolError:
+            return psycopg2.connect(dsn, options=options)
+        idle = monotonic() - _db_last_used.get(id(conn), monotonic())
+        if not conn.closed and (idle < DB_PING_AFTER_SECONDS or _db_alive(conn)):
+            return conn
+        _db_last_used.pop(id(conn), None)
+        _db_pool.putconn(conn, close=True)
+    return psycopg2.connect(dsn, options=options)
+
+
+def release_db(conn):
+    """Вернуть соединение в пул; незавершённая транзакция откатывается"""
+    broken = conn.closed
+    if not broken:
+        try:
+            conn.rollback()
+            conn.autocommit = False
+        except psycopg2.Error:
+            broken = True
+    if broken:
+        _db_last_used.pop(id(conn), None)
+    else:
+        _db_last_used[id(conn)] = monotonic()
+    try:
+        _db_pool.putconn(conn, close=broken)
+    except (PoolError, AttributeError):
+        conn.close()
+# end shared:db_pool
 
-def check_rate_limit(conn, ip_address: str, phone_number: str) -> tuple:
-    """Проверка rate limit для SMS"""
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    
-    cursor.execute(
-        "SELECT COUNT(*) as count FROM t_p30358746_hospital_website_red.rate_limit_logs WHERE ip_address = %s AND endpoint = 'sms-verify' AND created_at > NOW() - INTERVAL '1 minute'",
-        (ip_address,)
-    )
-    result = cursor.fetchone()
-    if result and result['count'] >= 5:
-        cursor.close()
-        return False, 'Превышен лимит: более 5 SMS запросов в минуту'
-    
-    cursor.execute(
-        "SELECT COUNT(*) as count FROM t_p30358746_hospital_website_red.rate_limit_logs WHERE endpoint = 'sms-verify' AND fingerprint = %s AND created_at > NOW() - INTERVAL '1 hour'",
-        (phone_number,)
-    )
-    result = cursor.fetchone()
-    if result and result['count'] >= 3:
-        cursor.close()
-        return False, 'Превышен лимит: более 3 SMS на один номер в час'
-    
-    cursor.close()
-    return True, None
 
-def record_request(conn, ip_address: str, phone_number: str):
-    """Записать запрос"""
+# Лимиты отправки SMS: (ключ, окно в секундах, порог, причина)
+SMS_LIMITS = {
+    'ip': (60, 5, 'Превышен лимит: более 5 SMS запросов в минуту'),
+    'phone': (3600, 3, 'Превышен лимит: более 3 SMS на один номер в час'),
+}
+SMS_LOCAL_KEYS_MAX = 5000
+
+# Ключи, упёршиеся в лимит, запоминаются в тёплом экземпляре до освобождения окна
+# и отклоняются без соединения с БД. Ограниченный LRU: ключ -> (момент освобождения, причина)
+_sms_blocked = OrderedDict()
+
+
+def local_rate_limit(ip_address: str, phone_number: str):
+    """Отказ по локальному кэшу блокировок; None — нужно сверяться с БД"""
+    now = monotonic()
+    for key in (f'ip:{ip_address}', f'phone:{phone_number}'):
+        blocked = _sms_blocked.get(key)
+        if blocked is None:
+            continue
+        if blocked[0] > now:
+            return blocked[1]
+        _sms_blocked.pop(key, None)
+    return None
+
+
+def remember_block(key: str, retry_after: float, reason: str):
+    _sms_blocked[key] = (monotonic() + retry_after, reason)
+    _sms_blocked.move_to_end(key)
+    while len(_sms_blocked) > SMS_LOCAL_KEYS_MAX:
+        _sms_blocked.popitem(last=False)
+
+
+def free_after(limit: int, seconds: int, start: float, hits: int, prev_hits: int, now: float) -> float:
+    """Через сколько секунд ключ с hits запросами в текущем окне пропустит следующий (нижняя граница):
+    вес предыдущего окна убывает до его конца, дальше — не раньше смены окна"""
+    if hits + 1 > limit or prev_hits <= 0:
+        return max(0.0, start + seconds - now)
+    return max(0.0, start + seconds * (1 - (limit - hits - 1) / prev_hits) - now)
+
+
+def check_and_record(conn, ip_address: str, phone_number: str) -> tuple:
+    """Проверить лимиты SMS и учесть запрос одним условным upsert счётчиков окон rate_limit_counters.
+    Раньше каждый запрос считал COUNT по rate_limit_logs за час; счётчики читаются по первичному ключу.
+    Окно скользящее, как в rate_limiter: предыдущее фиксированное окно берётся с весом непрошедшей доли.
+    Условие проверяется в ON CONFLICT DO UPDATE ... WHERE по заблокированной строке, поэтому параллельные
+    запросы у порога не проходят вместе; не вернувшийся из upsert ключ — отказ.
+    Возвращает (разрешено, причина, блокировки): блокировки — ключи, которые этот запрос исчерпал,
+    их можно запоминать локально после commit."""
+    now = time()
+    buckets = []
+    for kind, value in (('ip', ip_address), ('phone', phone_number)):
+        seconds, limit, reason = SMS_LIMITS[kind]
+        buckets.append((f'{kind}:{value}', f'sms:{seconds}:{kind}:{value}', seconds,
+                        int(now // seconds) * seconds, limit, reason))
     cursor = conn.cursor()
     cursor.execute(
-        "INSERT INTO t_p30358746_hospital_website_red.rate_limit_logs (ip_address, endpoint, fingerprint) VALUES (%s, 'sms-verify', %s)",
-        (ip_address, phone_number)
+        """
+        WITH state AS (
+            SELECT k.key, k.seconds, k.start, COALESCE(cur.hits, 0) AS cur_hits, COALESCE(prev.hits, 0) AS prev_hits,
+                k.lim - COALESCE(prev.hits, 0) * GREATEST(0, 1 - (%s - k.start) / k.seconds::float) AS allowance
+            FROM unnest(%s::text[], %s::int[], %s::bigint[], %s::int[]) AS k(key, seconds, start, lim)
+            LEFT JOIN t_p30358746_hospital_website_red.rate_limit_counters cur
+                ON cur.bucket_key = k.key AND cur.window_start = to_timestamp(k.start)
+            LEFT JOIN t_p30358746_hospital_website_red.rate_limit_counters prev
+                ON prev.bucket_key = k.key AND prev.window_start = to_timestamp(k.start - k.seconds)
+        ), hit AS (
+            INSERT INTO t_p30358746_hospital_website_red.rate_limit_counters (bucket_key, window_seconds, window_start, hits)
+            SELECT s.key, s.seconds, to_timestamp(s.start), 1
+            FROM state s
+            WHERE (SELECT bool_and(cur_hits + 1 <= allowance) FROM state)
+            ON CONFLICT (bucket_key, window_start) DO UPDATE SET hits = rate_limit_counters.hits + 1
+            WHERE rate_limit_counters.hits + 1 <= (
+                SELECT s.allowance FROM state s WHERE s.key = rate_limit_counters.bucket_key
+            )
+            RETURNING bucket_key, hits
+        ), logged AS (
+            INSERT INTO t_p30358746_hospital_website_red.rate_limit_logs (ip_address, endpoint, fingerprint)
+            SELECT %s, 'sms-verify', %s
+            WHERE (SELECT count(*) FROM hit) = (SELECT count(*) FROM state)
+            RETURNING ip_address, endpoint, fingerprint, created_at
+        ), rolled AS (
+            INSERT INTO t_p30358746_hospital_website_red.rate_limit_stats_hourly
+                (bucket_hour, endpoint, ip_address, fingerprint, requests, first_seen, last_seen)
+            SELECT date_trunc('hour', created_at), endpoint, ip_address, COALESCE(fingerprint, ''), 1, created_at, created_at
+            FROM logged
+            ON CONFLICT (bucket_hour, endpoint, ip_address, fingerprint) DO UPDATE SET
+                requests = rate_limit_stats_hourly.requests + 1,
+                last_seen = GREATEST(rate_limit_stats_hourly.last_seen, EXCLUDED.last_seen)
+        )
+        SELECT s.key, s.cur_hits, s.prev_hits, hit.hits
+        FROM state s
+        LEFT JOIN hit ON hit.bucket_key = s.key
+        """,
+        (now, [b[1] for b in buckets], [b[2] for b in buckets], [b[3] for b in buckets], [b[4] for b in buckets],
+         ip_address, phone_number)
     )
+    counters = {row[0]: row[1:] for row in cursor.fetchall()}
     conn.commit()
     cursor.close()
 
+    allowed = all(counters[b[1]][2] is not None for b in buckets)
+    exhausting = []
+    for local_key, key, seconds, start, limit, reason in buckets:
+        cur_hits, prev_hits, hits = counters[key]
+        if not allowed:
+            if hits is None:
+                remember_block(local_key, free_after(limit, seconds, start, cur_hits, prev_hits, now), reason)
+                return False, reason, []
+            continue
+        # Следующий запрос этот ключ уже не пропустит — запомнить до освобождения окна
+        weight = max(0.0, 1 - (now - start) / seconds)
+        if prev_hits * weight + hits + 1 > limit:
+            exhausting.append((local_key, free_after(limit, seconds, start, hits, prev_hits, now), reason))
+    return True, None, exhausting
+
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     Верификация номера телефона через GREEN-API (мессенджер MAX)
@@ -74,17 +220,28 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
-    conn = psycopg2.connect(database_url)
     body = json.loads(event.get('body', '{}'))
     action = body.get('action', 'send')
     
     ip_address = event.get('requestContext', {}).get('identity', {}).get('sourceIp', 'unknown')
     
+    if action == 'send':
+        blocked_reason = local_rate_limit(ip_address, body.get('phone_number', '').strip())
+        if blocked_reason:
+            return {
+                'statusCode': 429,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': blocked_reason}),
+                'isBase64Encoded': False
+            }
+    
+    conn = get_db()
+    
     try:
         if action == 'send':
             phone_number = body.get('phone_number', '').strip()
             
-            allowed, reason = check_rate_limit(conn, ip_address, phone_number)
+            allowed, reason, exhausting = check_and_record(conn, ip_address, phone_number)
             if not allowed:
                 return {
                     'statusCode': 429,
@@ -93,7 +250,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False
                 }
             
-            record_request(conn, ip_address, phone_number)
+            for block in exhausting:
+                remember_block(*block)
             
             if not phone_number:
                 return {
@@ -347,4 +505,4 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     finally:
         if conn:
-            conn.close()
\ No newline at end of file
+            release_db(conn)
\ No newline at end of file
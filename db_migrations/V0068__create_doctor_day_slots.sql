@@ -0,0 +1,23 @@
+-- Материализованная занятость слотов: одна строка на врача и день
+CREATE TABLE IF NOT EXISTS t_p30358746_hospital_website_red.doctor_day_slots (
+    doctor_id INTEGER NOT NULL,
+    slot_date DATE NOT NULL,
+    booked_minutes INTEGER[] NOT NULL DEFAULT '{}',
+    updated_at TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY (doctor_id, slot_date)
+);
+
+-- Заполняем по уже существующим записям
+INSERT INTO t_p30358746_hospital_website_red.doctor_day_slots (doctor_id, slot_date, booked_minutes)
+SELECT
+    doctor_id,
+    appointment_date,
+    ARRAY_AGG(DISTINCT (EXTRACT(HOUR FROM appointment_time) * 60 + EXTRACT(MINUTE FROM appointment_time))::int
+              ORDER BY (EXTRACT(HOUR FROM appointment_time) * 60 + EXTRACT(MINUTE FROM appointment_time))::int)
+FROM t_p30358746_hospital_website_red.appointments_v2
+WHERE status IN ('scheduled', 'completed') AND appointment_date IS NOT NULL
+GROUP BY doctor_id, appointment_date
+ON CONFLICT (doctor_id, slot_date) DO NOTHING;
+
+COMMENT ON TABLE t_p30358746_hospital_website_red.doctor_day_slots IS 'Занятые слоты врача по дням, обновляются всеми путями записи и отмены';
+COMMENT ON COLUMN t_p30358746_hospital_website_red.doctor_day_slots.booked_minutes IS 'Начала занятых слотов в минутах от полуночи (status scheduled/completed)';
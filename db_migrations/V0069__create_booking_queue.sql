@@ -0,0 +1,24 @@
+-- Очередь заявок на запись в часы открытия нового дня (режим наплыва)
+CREATE TABLE IF NOT EXISTS t_p30358746_hospital_website_red.booking_queue (
+    id BIGSERIAL PRIMARY KEY,
+    doctor_id INTEGER NOT NULL,
+    patient_name VARCHAR(255) NOT NULL,
+    patient_phone VARCHAR(50) NOT NULL,
+    patient_snils VARCHAR(14),
+    patient_oms VARCHAR(50),
+    appointment_date DATE NOT NULL,
+    appointment_time TIME NOT NULL,
+    description TEXT,
+    created_by INTEGER DEFAULT 1,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    appointment_id INTEGER,
+    created_at TIMESTAMP DEFAULT NOW(),
+    processed_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_booking_queue_pending
+ON t_p30358746_hospital_website_red.booking_queue (id)
+WHERE status = 'pending';
+
+COMMENT ON TABLE t_p30358746_hospital_website_red.booking_queue IS 'Заявки на запись, принятые в режиме наплыва; проводятся пачками в порядке id';
+COMMENT ON COLUMN t_p30358746_hospital_website_red.booking_queue.status IS 'pending=ожидает, booked=записан (appointment_id), rejected=слот уже занят';
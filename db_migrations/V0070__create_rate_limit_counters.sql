@@ -0,0 +1,14 @@
+-- Счётчики rate limiting по фиксированным окнам (минута/час) вместо COUNT(*) по rate_limit_logs
+CREATE TABLE IF NOT EXISTS rate_limit_counters (
+    bucket_key VARCHAR(600) NOT NULL,
+    window_seconds INTEGER NOT NULL,
+    window_start TIMESTAMPTZ NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket_key, window_start)
+);
+
+CREATE INDEX IF NOT EXISTS idx_rate_limit_counters_window_start ON rate_limit_counters(window_start);
+
+COMMENT ON TABLE rate_limit_counters IS 'Счётчики запросов по ключу (ip, ip+endpoint, fingerprint) и окну времени';
+COMMENT ON COLUMN rate_limit_counters.bucket_key IS 'Ключ вида <окно_сек>:ip:<ip>, <окно_сек>:ep:<ip>:<endpoint>, <окно_сек>:fp:<fingerprint>';
+COMMENT ON COLUMN rate_limit_counters.window_start IS 'Начало окна, кратное window_seconds';
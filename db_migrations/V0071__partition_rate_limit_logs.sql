@@ -0,0 +1,52 @@
+-- Почасовые агрегаты запросов для статистики rate limiting (вместо агрегации сырых логов за сутки)
+CREATE TABLE IF NOT EXISTS rate_limit_stats_hourly (
+    bucket_hour TIMESTAMP NOT NULL,
+    endpoint VARCHAR(255) NOT NULL,
+    ip_address VARCHAR(45) NOT NULL,
+    fingerprint VARCHAR(255) NOT NULL DEFAULT '',
+    requests INTEGER NOT NULL DEFAULT 0,
+    first_seen TIMESTAMP NOT NULL,
+    last_seen TIMESTAMP NOT NULL,
+    PRIMARY KEY (bucket_hour, endpoint, ip_address, fingerprint)
+);
+
+INSERT INTO rate_limit_stats_hourly (bucket_hour, endpoint, ip_address, fingerprint, requests, first_seen, last_seen)
+SELECT date_trunc('hour', created_at), endpoint, ip_address, COALESCE(fingerprint, ''), COUNT(*), MIN(created_at), MAX(created_at)
+FROM rate_limit_logs
+WHERE created_at > NOW() - INTERVAL '2 days'
+GROUP BY 1, 2, 3, 4
+ON CONFLICT (bucket_hour, endpoint, ip_address, fingerprint) DO NOTHING;
+
+-- Сырые логи — секционированная по дням таблица: хранение за сутки сводится к DROP старой секции.
+-- Секции на следующие дни создаёт rate_limiter; строки вне секций попадают в rate_limit_logs_default.
+ALTER TABLE rate_limit_logs RENAME TO rate_limit_logs_legacy;
+
+CREATE TABLE IF NOT EXISTS rate_limit_logs (
+    id BIGSERIAL,
+    ip_address VARCHAR(45) NOT NULL,
+    endpoint VARCHAR(255) NOT NULL,
+    fingerprint VARCHAR(255),
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+CREATE TABLE IF NOT EXISTS rate_limit_logs_default PARTITION OF rate_limit_logs DEFAULT;
+
+INSERT INTO rate_limit_logs (ip_address, endpoint, fingerprint, created_at)
+SELECT ip_address, endpoint, fingerprint, COALESCE(created_at, CURRENT_TIMESTAMP)
+FROM rate_limit_logs_legacy
+WHERE created_at > NOW() - INTERVAL '1 day';
+
+DROP TABLE rate_limit_logs_legacy;
+
+CREATE INDEX IF NOT EXISTS idx_rate_limit_ip_time ON rate_limit_logs(ip_address, created_at);
+CREATE INDEX IF NOT EXISTS idx_rate_limit_endpoint_time ON rate_limit_logs(endpoint, created_at);
+CREATE INDEX IF NOT EXISTS idx_rate_limit_fingerprint_time ON rate_limit_logs(fingerprint, created_at);
+
+COMMENT ON TABLE rate_limit_logs IS 'Логи запросов для защиты от ботов и rate limiting, секции rate_limit_logs_pYYYYMMDD по дням';
+COMMENT ON COLUMN rate_limit_logs.ip_address IS 'IP адрес клиента';
+COMMENT ON COLUMN rate_limit_logs.endpoint IS 'Название endpoint (forum, chat, appointments и т.д.)';
+COMMENT ON COLUMN rate_limit_logs.fingerprint IS 'Уникальный отпечаток браузера/устройства';
+COMMENT ON COLUMN rate_limit_logs.created_at IS 'Время запроса';
+COMMENT ON TABLE rate_limit_stats_hourly IS 'Число запросов по часу, endpoint, IP и отпечатку — источник get-stats';
+COMMENT ON COLUMN rate_limit_stats_hourly.fingerprint IS 'Отпечаток устройства, пустая строка если не передан';
@@ -0,0 +1,29 @@
+-- Отметка изменения строк для инкрементальных резервных копий
+ALTER TABLE t_p30358746_hospital_website_red.appointments_v2
+ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+
+ALTER TABLE t_p30358746_hospital_website_red.doctor_schedules
+ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+
+CREATE INDEX IF NOT EXISTS idx_appointments_v2_updated_at ON t_p30358746_hospital_website_red.appointments_v2(updated_at);
+CREATE INDEX IF NOT EXISTS idx_doctor_schedules_updated_at ON t_p30358746_hospital_website_red.doctor_schedules(updated_at);
+CREATE INDEX IF NOT EXISTS idx_daily_schedules_updated_at ON t_p30358746_hospital_website_red.daily_schedules(updated_at);
+CREATE INDEX IF NOT EXISTS idx_doctor_calendar_updated_at ON t_p30358746_hospital_website_red.doctor_calendar(updated_at);
+
+-- Цепочки резервных копий: базовая выгрузка + дельты с водяными знаками по таблицам
+ALTER TABLE t_p30358746_hospital_website_red.backup_records
+ADD COLUMN IF NOT EXISTS mode VARCHAR(20) NOT NULL DEFAULT 'snapshot',
+ADD COLUMN IF NOT EXISTS base_folder TEXT,
+ADD COLUMN IF NOT EXISTS watermarks JSONB DEFAULT '{}';
+
+CREATE INDEX IF NOT EXISTS idx_backup_records_base_folder ON t_p30358746_hospital_website_red.backup_records(base_folder, created_at);
+
+ALTER TABLE t_p30358746_hospital_website_red.backup_settings
+ADD COLUMN IF NOT EXISTS baseline_hours INTEGER NOT NULL DEFAULT 24;
+
+COMMENT ON COLUMN t_p30358746_hospital_website_red.appointments_v2.updated_at IS 'Время последнего изменения записи';
+COMMENT ON COLUMN t_p30358746_hospital_website_red.doctor_schedules.updated_at IS 'Время последнего изменения расписания';
+COMMENT ON COLUMN t_p30358746_hospital_website_red.backup_records.mode IS 'snapshot=разовая полная копия, base=базовая копия цепочки по расписанию, delta=изменения с прошлого запуска';
+COMMENT ON COLUMN t_p30358746_hospital_website_red.backup_records.base_folder IS 'Папка базовой копии цепочки (для base — своя папка)';
+COMMENT ON COLUMN t_p30358746_hospital_website_red.backup_records.watermarks IS 'По таблицам: {"updated_at": ..., "max_id": ...} на момент снимка';
+COMMENT ON COLUMN t_p30358746_hospital_website_red.backup_settings.baseline_hours IS 'Как часто по расписанию снимается новая базовая копия вместо дельты';
@@ -0,0 +1,26 @@
+-- Журнал плановых запусков резервного копирования: блокировка повторного запуска и продолжение прерванного
+CREATE TABLE IF NOT EXISTS t_p30358746_hospital_website_red.backup_runs (
+    id SERIAL PRIMARY KEY,
+    folder TEXT NOT NULL,
+    mode VARCHAR(20) NOT NULL,
+    base_folder TEXT,
+    since JSONB,
+    tables JSONB NOT NULL DEFAULT '[]',
+    done JSONB NOT NULL DEFAULT '{}',
+    status VARCHAR(20) NOT NULL DEFAULT 'running',
+    attempts INTEGER NOT NULL DEFAULT 1,
+    started_at TIMESTAMPTZ DEFAULT NOW(),
+    heartbeat_at TIMESTAMPTZ DEFAULT NOW(),
+    finished_at TIMESTAMPTZ
+);
+
+-- Не больше одного незавершённого запуска
+CREATE UNIQUE INDEX IF NOT EXISTS idx_backup_runs_single_running
+ON t_p30358746_hospital_website_red.backup_runs (status)
+WHERE status = 'running';
+
+CREATE INDEX IF NOT EXISTS idx_backup_runs_started_at ON t_p30358746_hospital_website_red.backup_runs (started_at);
+
+COMMENT ON TABLE t_p30358746_hospital_website_red.backup_runs IS 'Плановые запуски db-backup; running-запуск после прерывания продолжается с невыгруженных таблиц';
+COMMENT ON COLUMN t_p30358746_hospital_website_red.backup_runs.since IS 'Водяные знаки, от которых выгружается дельта (NULL для base)';
+COMMENT ON COLUMN t_p30358746_hospital_website_red.backup_runs.done IS 'Готовые таблицы: {"таблица": {"result": ..., "watermark": ...}}';
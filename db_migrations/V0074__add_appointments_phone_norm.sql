@@ -0,0 +1,12 @@
+-- Нормализованный телефон пациента (последние 10 цифр) для поиска записей по индексу
+ALTER TABLE t_p30358746_hospital_website_red.appointments_v2
+ADD COLUMN IF NOT EXISTS patient_phone_norm VARCHAR(10);
+
+UPDATE t_p30358746_hospital_website_red.appointments_v2
+SET patient_phone_norm = NULLIF(RIGHT(REGEXP_REPLACE(patient_phone, '[^0-9]', '', 'g'), 10), '')
+WHERE patient_phone IS NOT NULL AND patient_phone_norm IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_appointments_v2_phone_norm
+ON t_p30358746_hospital_website_red.appointments_v2(patient_phone_norm, appointment_date);
+
+COMMENT ON COLUMN t_p30358746_hospital_website_red.appointments_v2.patient_phone_norm IS 'Последние 10 цифр patient_phone — ключ поиска записей пациента (my-appointments, отмена)';
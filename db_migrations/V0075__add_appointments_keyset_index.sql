@@ -0,0 +1,3 @@
+-- Постраничная выдача списка записей врача по ключу (appointment_date, appointment_time, id)
+CREATE INDEX IF NOT EXISTS idx_appointments_v2_doctor_keyset
+ON t_p30358746_hospital_website_red.appointments_v2(doctor_id, appointment_date, appointment_time, id);
@@ -0,0 +1,14 @@
+-- Удалённые записи для changes-since: после DELETE строки в appointments_v2 нет, и без отметки
+-- опрашивающий дашборд не узнал бы об удалении
+CREATE TABLE IF NOT EXISTS t_p30358746_hospital_website_red.appointment_deletions (
+    appointment_id INTEGER PRIMARY KEY,
+    doctor_id INTEGER NOT NULL,
+    appointment_date DATE NOT NULL,
+    deleted_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_appointment_deletions_deleted_at
+ON t_p30358746_hospital_website_red.appointment_deletions(deleted_at);
+
+COMMENT ON TABLE t_p30358746_hospital_website_red.appointment_deletions IS 'Отметки удаления записей для инкрементальной синхронизации дашбордов, хранятся 7 дней';
+COMMENT ON COLUMN t_p30358746_hospital_website_red.appointment_deletions.deleted_at IS 'Время удаления; сравнивается с курсором changes-since';
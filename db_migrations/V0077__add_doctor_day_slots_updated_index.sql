@@ -0,0 +1,3 @@
+-- slot-updates ищет дни врача, изменившиеся после курсора
+CREATE INDEX IF NOT EXISTS idx_doctor_day_slots_doctor_updated
+ON t_p30358746_hospital_website_red.doctor_day_slots(doctor_id, updated_at);
@@ -0,0 +1,39 @@
+-- Массовые рассылки по реестру пациентов: задание и получатели с состоянием отправки,
+-- чтобы рассылка продолжалась с места остановки, а не упиралась в таймаут одного запроса
+CREATE TABLE IF NOT EXISTS t_p30358746_hospital_website_red.registry_send_jobs (
+    id SERIAL PRIMARY KEY,
+    channel VARCHAR(20) NOT NULL,
+    message TEXT NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'running',
+    total INTEGER NOT NULL DEFAULT 0,
+    sent INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    finished_at TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS t_p30358746_hospital_website_red.registry_send_items (
+    job_id INTEGER NOT NULL REFERENCES t_p30358746_hospital_website_red.registry_send_jobs(id) ON DELETE CASCADE,
+    record_id INTEGER NOT NULL,
+    address VARCHAR(255),
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    error TEXT,
+    claimed_at TIMESTAMP,
+    sent_at TIMESTAMP,
+    PRIMARY KEY (job_id, record_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_registry_send_items_pending
+ON t_p30358746_hospital_website_red.registry_send_items(job_id, status)
+WHERE status IN ('pending', 'sending');
+
+CREATE INDEX IF NOT EXISTS idx_registry_send_jobs_status
+ON t_p30358746_hospital_website_red.registry_send_jobs(status, created_at);
+
+COMMENT ON TABLE t_p30358746_hospital_website_red.registry_send_jobs IS 'Задания массовой рассылки по реестру (email, MAX)';
+COMMENT ON COLUMN t_p30358746_hospital_website_red.registry_send_jobs.status IS 'running=есть неотправленные получатели, done=все обработаны, failed=остановлено ошибкой канала';
+COMMENT ON TABLE t_p30358746_hospital_website_red.registry_send_items IS 'Получатели задания рассылки';
+COMMENT ON COLUMN t_p30358746_hospital_website_red.registry_send_items.status IS 'pending, sending (взят обработчиком, claimed_at), sent, failed';
+COMMENT ON COLUMN t_p30358746_hospital_website_red.registry_send_items.address IS 'Адрес на момент постановки: email или телефон';
@@ -0,0 +1,7 @@
+-- Повторы временных ошибок рассылки (сеть, 429, 5xx) с растущей паузой
+ALTER TABLE t_p30358746_hospital_website_red.registry_send_items
+ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0,
+ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMP;
+
+COMMENT ON COLUMN t_p30358746_hospital_website_red.registry_send_items.attempts IS 'Число сделанных попыток отправки';
+COMMENT ON COLUMN t_p30358746_hospital_website_red.registry_send_items.next_attempt_at IS 'Не раньше этого времени получатель берётся на повтор (pending после временной ошибки)';
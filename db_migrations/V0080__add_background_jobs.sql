@@ -0,0 +1,41 @@
+-- Очередь фоновых заданий: HTTP-обработчики только ставят задание, выполняет его job-worker по cron.
+-- Задание берётся через FOR UPDATE SKIP LOCKED, поэтому параллельные обработчики не мешают друг другу
+CREATE TABLE IF NOT EXISTS t_p30358746_hospital_website_red.background_jobs (
+    id BIGSERIAL PRIMARY KEY,
+    kind VARCHAR(50) NOT NULL,
+    payload JSONB NOT NULL DEFAULT '{}',
+    priority INTEGER NOT NULL DEFAULT 0,
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+    dedupe_key VARCHAR(100),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 5,
+    run_after TIMESTAMP NOT NULL DEFAULT NOW(),
+    locked_at TIMESTAMP,
+    progress JSONB,
+    result JSONB,
+    last_error TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    finished_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_background_jobs_ready
+ON t_p30358746_hospital_website_red.background_jobs(priority DESC, run_after, id)
+WHERE status IN ('queued', 'running');
+
+-- Одно ждущее или выполняющееся задание на ключ: повторная постановка возвращает существующее
+CREATE UNIQUE INDEX IF NOT EXISTS idx_background_jobs_dedupe
+ON t_p30358746_hospital_website_red.background_jobs(dedupe_key)
+WHERE status IN ('queued', 'running');
+
+CREATE INDEX IF NOT EXISTS idx_background_jobs_finished
+ON t_p30358746_hospital_website_red.background_jobs(finished_at)
+WHERE status IN ('done', 'failed');
+
+COMMENT ON TABLE t_p30358746_hospital_website_red.background_jobs IS 'Фоновые задания для job-worker';
+COMMENT ON COLUMN t_p30358746_hospital_website_red.background_jobs.kind IS 'registry_send, db_backup, backup_cleanup, max_message';
+COMMENT ON COLUMN t_p30358746_hospital_website_red.background_jobs.priority IS 'Большее значение берётся раньше';
+COMMENT ON COLUMN t_p30358746_hospital_website_red.background_jobs.status IS 'queued=ждёт run_after, running=взято обработчиком (locked_at), done, failed';
+COMMENT ON COLUMN t_p30358746_hospital_website_red.background_jobs.attempts IS 'Неудачные и текущая попытки; продолжение длинного задания попыткой не считается';
+COMMENT ON COLUMN t_p30358746_hospital_website_red.background_jobs.progress IS 'Последний промежуточный ответ задания, которое продолжается частями';
+COMMENT ON COLUMN t_p30358746_hospital_website_red.background_jobs.result IS 'Ответ выполненного задания';
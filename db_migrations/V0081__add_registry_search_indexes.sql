@@ -0,0 +1,21 @@
+-- Индексный поиск по реестру пациентов: подстрока в ФИО/email/телефоне через триграммы
+-- и поиск по началу слов ФИО полнотекстовым индексом с ранжированием
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_reest_phone_max_full_name_trgm
+ON t_p30358746_hospital_website_red.reest_phone_max USING gin (full_name gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_reest_phone_max_email_trgm
+ON t_p30358746_hospital_website_red.reest_phone_max USING gin (email gin_trgm_ops);
+
+-- Телефон в реестре хранится в разных форматах: ищем по последним 10 цифрам
+CREATE INDEX IF NOT EXISTS idx_reest_phone_max_phone_digits_trgm
+ON t_p30358746_hospital_website_red.reest_phone_max
+USING gin ((RIGHT(REGEXP_REPLACE(phone, '[^0-9]', '', 'g'), 10)) gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_reest_phone_max_full_name_fts
+ON t_p30358746_hospital_website_red.reest_phone_max
+USING gin (to_tsvector('russian', full_name));
+
+CREATE INDEX IF NOT EXISTS idx_reest_phone_max_created_at
+ON t_p30358746_hospital_website_red.reest_phone_max(created_at DESC);
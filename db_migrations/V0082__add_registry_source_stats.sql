@@ -0,0 +1,16 @@
+-- Число записей реестра по источнику: поддерживается при вставке (upsert_registry) и удалении,
+-- чтобы страница реестра не пересчитывала всю таблицу GROUP BY source на каждый запрос
+CREATE TABLE IF NOT EXISTS t_p30358746_hospital_website_red.registry_source_stats (
+    source VARCHAR(20) PRIMARY KEY,
+    records BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+INSERT INTO t_p30358746_hospital_website_red.registry_source_stats (source, records)
+SELECT COALESCE(source, ''), COUNT(*)
+FROM t_p30358746_hospital_website_red.reest_phone_max
+GROUP BY COALESCE(source, '')
+ON CONFLICT (source) DO UPDATE SET records = EXCLUDED.records, updated_at = NOW();
+
+COMMENT ON TABLE t_p30358746_hospital_website_red.registry_source_stats IS 'Счётчики записей reest_phone_max по source; пересчёт — patient-registry action=recount_stats';
+COMMENT ON COLUMN t_p30358746_hospital_website_red.registry_source_stats.source IS 'Значение reest_phone_max.source, пустая строка — без источника';
@@ -0,0 +1,8 @@
+-- Заявки наплыва, не проведённые за BOOKING_QUEUE_TTL_MINUTES, снимаются со статусом expired;
+-- очередь разбирается фоновым заданием booking_drain, а не только опросом booking-status
+CREATE INDEX IF NOT EXISTS idx_booking_queue_pending_created
+ON t_p30358746_hospital_website_red.booking_queue (created_at)
+WHERE status = 'pending';
+
+COMMENT ON COLUMN t_p30358746_hospital_website_red.booking_queue.status IS 'pending=ожидает, booked=записан (appointment_id), rejected=слот уже занят, expired=не проведена вовремя';
+COMMENT ON COLUMN t_p30358746_hospital_website_red.background_jobs.kind IS 'registry_send, db_backup, backup_cleanup, max_message, booking_drain';
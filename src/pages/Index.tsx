@@ -39,6 +39,25 @@ const BACKEND_URLS = {
     "https://functions.poehali.dev/7ea5c6f5-d200-4cc0-b34b-10144a995d69",
 };
 
+// В часы открытия записи сервер ставит заявку в очередь — ждём, пока её проведут или снимут по сроку.
+// Сервер сам переводит заявку в booked/rejected/expired за expires_in секунд плюс такт фонового задания
+const BOOKING_STATUS_GRACE_MS = 90_000;
+
+const waitForQueuedBooking = async (ticket: number, expiresIn: number) => {
+  const deadline = Date.now() + (expiresIn || 180) * 1000 + BOOKING_STATUS_GRACE_MS;
+  for (let attempt = 0; Date.now() < deadline; attempt++) {
+    await new Promise((resolve) => setTimeout(resolve, attempt < 10 ? 1000 : 3000));
+    const res = await fetch(
+      `${BACKEND_URLS.appointments}?action=booking-status&ticket=${ticket}`,
+    );
+    const status = await res.json();
+    if (["booked", "rejected", "expired"].includes(status.status)) {
+      return status;
+    }
+  }
+  return { error: "Очередь записи перегружена, попробуйте ещё раз" };
+};
+
 const Index = () => {
   const { toast } = useToast();
   const { checkRateLimit: checkAppointmentLimit } = useRateLimiter({
@@ -441,11 +460,14 @@ const Index = () => {
           appointment_date: selectedDate,
           ...appointmentForm,
           created_by: 1,
-          skip_slot_check: false,
+          accept_queue: true,
         }),
       });
 
-      const data = await response.json();
+      let data = await response.json();
+      if (response.status === 202 && data.queued) {
+        data = await waitForQueuedBooking(data.ticket, data.expires_in);
+      }
 
       if (response.ok && data.success) {
         const successAudio = new Audio(
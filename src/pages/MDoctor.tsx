@@ -58,6 +58,7 @@ const MDoctor = () => {
   const [photoPosition, setPhotoPosition] = useState({ x: 0, y: 0 });
   const [registryRecords, setRegistryRecords] = useState<any[]>([]);
   const [registryTotal, setRegistryTotal] = useState(0);
+  const [registryTotalExact, setRegistryTotalExact] = useState(true);
   const [registryPage, setRegistryPage] = useState(1);
   const [registryPageSize, setRegistryPageSize] = useState(20);
   const [registrySearch, setRegistrySearch] = useState('');
@@ -280,6 +281,7 @@ const MDoctor = () => {
       if (data.records) {
         setRegistryRecords(data.records);
         setRegistryTotal(data.total || data.records.length);
+        setRegistryTotalExact(data.total_exact !== false);
         setRegistryPage(page);
         setRegistrySelected(new Set());
         if (data.stats) setRegistryStats(data.stats);
@@ -302,20 +304,35 @@ const MDoctor = () => {
         body: JSON.stringify({
           action: sendChannel === 'email' ? 'send_email' : 'send_max',
           ids: Array.from(registrySelected),
-          message: sendMessage
+          message: sendMessage,
+          background: true
         })
       });
-      const data = await response.json();
+      let data = await response.json();
+      // Рассылку выполняет фоновый обработчик: следим за заданием, пока все получатели не обработаны,
+      // но не дольше 10 минут — дальше рассылка продолжается без открытого окна
+      for (let attempt = 0; data.success && data.status === 'running'; attempt++) {
+        if (attempt >= 200) {
+          toast({ title: 'Рассылка продолжается', description: 'Сообщения отправляются в фоне, окно можно закрыть' });
+          setShowSendDialog(false);
+          return;
+        }
+        await new Promise((resolve) => setTimeout(resolve, 3000));
+        const next = await fetch(`${API_URLS.registry}?action=send_job&id=${data.job_id}`);
+        const state = await next.json();
+        if (!next.ok || !state.job) break;
+        data = { ...data, status: state.job.status, sent_count: state.job.sent, failed: state.job.failed };
+        if (state.job.status === 'failed') {
+          data = { success: false, error: state.job.last_error };
+        }
+      }
       if (data.success) {
         await logAction(sendChannel === 'email' ? 'Рассылка email из реестра' : 'Рассылка MAX из реестра', {
           recipients_count: registrySelected.size,
           sent_count: data.sent_count,
           message: sendMessage.substring(0, 200)
         });
-        toast({ title: 'Успех', description: `Отправлено: ${data.sent_count}${data.errors?.length ? `. Ошибки: ${data.errors.length}` : ''}` });
-        if (data.errors?.length) {
-          console.log('Send errors:', data.errors);
-        }
+        toast({ title: 'Успех', description: `Отправлено: ${data.sent_count}${data.failed ? `. Не доставлено: ${data.failed}` : ''}` });
         setShowSendDialog(false);
         setSendMessage('');
         loadRegistry();
@@ -1533,7 +1550,7 @@ const MDoctor = () => {
                 </div>
 
                 <div className="sticky top-0 z-20 bg-white border rounded-md px-3 py-2 mb-2 flex flex-wrap gap-x-4 gap-y-1 text-xs text-muted-foreground shadow-sm">
-                  <span>Всего: <strong className="text-foreground">{registryTotal}</strong></span>
+                  <span>Всего: <strong className="text-foreground">{registryTotalExact ? '' : '≈'}{registryTotal}</strong></span>
                   <span>Выбрано: <strong className="text-foreground">{registrySelected.size}</strong></span>
                   <span className="border-l pl-4 flex flex-wrap gap-x-3 gap-y-1">
                     <span className="inline-flex items-center gap-1">
@@ -1680,7 +1697,7 @@ const MDoctor = () => {
                 {registryTotal > 0 && (
                   <div className="mt-3 flex items-center justify-between">
                     <div className="text-sm text-muted-foreground">
-                      Показано {(safePage - 1) * registryPageSize + 1}–{Math.min(safePage * registryPageSize, registryTotal)} из {registryTotal}
+                      Показано {(safePage - 1) * registryPageSize + 1}–{Math.min(safePage * registryPageSize, registryTotal)} из {registryTotalExact ? '' : '≈'}{registryTotal}
                     </div>
                     <div className="flex items-center gap-1">
                       <Button size="sm" variant="outline" className="h-8 w-8 p-0" disabled={safePage <= 1} onClick={() => loadRegistry(1)} title="Первая страница">
@@ -189,9 +189,22 @@ const Security = () => {
       const res = await fetch(`${DB_BACKUP_URL}?action=backup`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ full }),
+        body: JSON.stringify({ full, background: full }),
       });
-      const data = await res.json();
+      let data = await res.json();
+      // Полный архив выполняется фоновым заданием: ждём его завершения, но не дольше 10 минут
+      for (let attempt = 0; data.queued && data.job_id; attempt++) {
+        if (attempt >= 120) {
+          toast({ title: 'Архив ещё создаётся', description: 'Задание выполняется в фоне — проверьте список архивов позже' });
+          return;
+        }
+        await new Promise((resolve) => setTimeout(resolve, 5000));
+        const jobRes = await fetch(`${DB_BACKUP_URL}?action=job&id=${data.job_id}`);
+        const { job } = await jobRes.json();
+        if (!job) break;
+        if (job.status === 'done') data = job.result;
+        else if (job.status === 'failed') throw new Error(job.last_error);
+      }
       setLastBackupResult(data);
       const ok = data.results?.filter((r: any) => r.success).length || 0;
       const total = data.results?.length || 0;
@@ -0,0 +1,184 @@
+"""
+Восстановление цепочки резервных копий db-backup в базу: базовая копия + дельты по порядку.
+
+Список копий берётся из db-backup (?action=list), файлы скачиваются по их URL и загружаются
+потоком через COPY FROM STDIN, не распаковываясь целиком ни на диск, ни в память.
+Для дельты изменённые строки заменяются по id, а строки, которых нет в списке id
+(<таблица>.ids.csv.gz), удаляются. Всё восстановление — одна транзакция.
+
+    python tools/backup_restore.py --api https://functions.poehali.dev/<db-backup> \\
+        --folder 2026-03-01_03-30-00 --dsn postgresql://localhost/restore_check
+
+По умолчанию восстанавливает в схему t_p30358746_hospital_website_red целевой базы —
+таблицы с такой же структурой должны уже существовать (миграции db_migrations).
+"""
+import argparse
+import csv
+import gzip
+import io
+import json
+import urllib.request
+
+import psycopg2
+
+
+def fetch_json(url):
+    with urllib.request.urlopen(url, timeout=60) as resp:
+        return json.loads(resp.read().decode('utf-8'))
+
+
+def resolve_chain(folders, target_name):
+    """Базовая копия и дельты до выбранной включительно, в порядке создания"""
+    by_name = {f['folder']: f for f in folders}
+    target = by_name.get(target_name)
+    if target is None:
+        raise SystemExit(f'Копия {target_name} не найдена')
+    if target.get('mode') != 'delta':
+        return [target]
+    base = by_name.get(target['base_folder'])
+    if base is None:
+        raise SystemExit(f'Базовая копия {target["base_folder"]} для {target_name} не найдена')
+    deltas = sorted(
+        (f for f in folders
+         if f.get('mode') == 'delta' and f.get('base_folder') == target['base_folder']
+         and f['created_at'] <= target['created_at']),
+        key=lambda f: f['created_at'],
+    )
+    return [base] + deltas
+
+
+def copy_into(cur, table, url):
+    """Загрузить CSV по URL в таблицу потоком; столбцы берутся из заголовка файла"""
+    with urllib.request.urlopen(url, timeout=600) as resp:
+        stream = gzip.GzipFile(fileobj=resp) if url.endswith('.gz') else resp
+        header = stream.readline().decode('utf-8')
+        columns = next(csv.reader(io.StringIO(header)))
+        column_list = ', '.join(f'"{c}"' for c in columns)
+        cur.copy_expert(f'COPY {table} ({column_list}) FROM STDIN WITH (FORMAT csv)', stream)
+    return columns
+
+
+def dependency_order(cur, schema, tables):
+    """Таблицы в порядке внешних ключей: сначала те, на которые ссылаются"""
+    cur.execute("""
+        SELECT child.relname, parent.relname
+        FROM pg_constraint c
+        JOIN pg_class child ON child.oid = c.conrelid
+        JOIN pg_class parent ON parent.oid = c.confrelid
+        JOIN pg_namespace n ON n.oid = child.relnamespace
+        WHERE c.contype = 'f' AND n.nspname = %s AND child.relname <> parent.relname
+    """, (schema,))
+    parents = {}
+    for child, parent in cur.fetchall():
+        if child in tables and parent in tables:
+            parents.setdefault(child, set()).add(parent)
+    ordered, placed = [], set()
+    while len(ordered) < len(tables):
+        ready = sorted(t for t in tables if t not in placed and parents.get(t, set()) <= placed)
+        if not ready:
+            ready = sorted(t for t in tables if t not in placed)
+        ordered.extend(ready)
+        placed.update(ready)
+    return ordered
+
+
+def without_partitions(cur, schema, tables):
+    """Секции, родитель которых тоже восстанавливается, пропускаются: COPY в родителя
+    сам раскладывает строки по секциям, иначе они загрузились бы дважды"""
+    cur.execute("""
+        SELECT child.relname FROM pg_inherits i
+        JOIN pg_class child ON child.oid = i.inhrelid
+        JOIN pg_class parent ON parent.oid = i.inhparent
+        JOIN pg_namespace n ON n.oid = child.relnamespace
+        WHERE n.nspname = %s AND child.relispartition AND parent.relname = ANY(%s)
+    """, (schema, list(tables)))
+    partitions = {row[0] for row in cur.fetchall()}
+    return {t for t in tables if t not in partitions}
+
+
+def table_files(folder):
+    files = {}
+    for f in folder['files']:
+        table = f.get('table') or f['name'].split('.')[0]
+        files.setdefault(table, {})[f.get('kind', 'rows')] = f['url']
+    return files
+
+
+def restore_base(cur, schema, folder, tables):
+    files = {t: f for t, f in table_files(folder).items() if not tables or t in tables}
+    if not files:
+        return
+    keep = without_partitions(cur, schema, set(files))
+    files = {t: f for t, f in files.items() if t in keep}
+    # Одним TRUNCATE, чтобы внешние ключи между восстанавливаемыми таблицами не мешали очистке
+    cur.execute('TRUNCATE ' + ', '.join(f'"{schema}"."{t}"' for t in files))
+    for table in dependency_order(cur, schema, set(files)):
+        copy_into(cur, f'"{schema}"."{table}"', files[table]['rows'])
+        print(f'  {table}: загружено {cur.rowcount} строк')
+
+
+def apply_delta(cur, schema, folder, tables):
+    folder_files = table_files(folder)
+    keep = without_partitions(cur, schema, set(folder_files))
+    for table, files in folder_files.items():
+        if (tables and table not in tables) or table not in keep:
+            continue
+        target = f'"{schema}"."{table}"'
+        cur.execute(f'CREATE TEMP TABLE _restore_rows ON COMMIT DROP AS SELECT * FROM {target} WITH NO DATA')
+        columns = copy_into(cur, '_restore_rows', files['rows'])
+        changed = cur.rowcount
+        column_list = ', '.join(f'"{c}"' for c in columns)
+        cur.execute(f'DELETE FROM {target} t USING _restore_rows r WHERE t.id = r.id')
+        cur.execute(f'INSERT INTO {target} ({column_list}) SELECT {column_list} FROM _restore_rows')
+        removed = 0
+        if 'ids' in files:
+            cur.execute('CREATE TEMP TABLE _restore_ids (id BIGINT PRIMARY KEY) ON COMMIT DROP')
+            copy_into(cur, '_restore_ids', files['ids'])
+            cur.execute(f'DELETE FROM {target} t WHERE NOT EXISTS (SELECT 1 FROM _restore_ids i WHERE i.id = t.id)')
+            removed = cur.rowcount
+            cur.execute('DROP TABLE _restore_ids')
+        cur.execute('DROP TABLE _restore_rows')
+        print(f'  {table}: изменено {changed}, удалено {removed}')
+
+
+def reset_sequences(cur, schema, tables):
+    for table in tables:
+        cur.execute('SELECT pg_get_serial_sequence(%s, %s)', (f'"{schema}"."{table}"', 'id'))
+        sequence = cur.fetchone()[0]
+        if sequence:
+            cur.execute(f'SELECT setval(%s, COALESCE((SELECT MAX(id) FROM "{schema}"."{table}"), 0) + 1, false)', (sequence,))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Восстановление резервной копии db-backup (base + дельты)')
+    parser.add_argument('--api', required=True, help='адрес функции db-backup')
+    parser.add_argument('--folder', required=True, help='копия, на момент которой восстановить (как в списке)')
+    parser.add_argument('--dsn', required=True, help='строка подключения к целевой базе')
+    parser.add_argument('--schema', default='t_p30358746_hospital_website_red')
+    parser.add_argument('--tables', nargs='*', help='только эти таблицы')
+    args = parser.parse_args()
+
+    folders = fetch_json(f'{args.api}?action=list')['folders']
+    chain = resolve_chain(folders, args.folder)
+    tables = set(args.tables or [])
+
+    conn = psycopg2.connect(args.dsn)
+    try:
+        cur = conn.cursor()
+        print(f'базовая копия {chain[0]["folder"]}')
+        restore_base(cur, args.schema, chain[0], tables)
+        for delta in chain[1:]:
+            print(f'дельта {delta["folder"]}')
+            apply_delta(cur, args.schema, delta, tables)
+        reset_sequences(cur, args.schema, without_partitions(cur, args.schema, tables or set(table_files(chain[0]))))
+        conn.commit()
+        print('готово')
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Локальная заглушка GREEN-API sendMessage для проверки пропускной способности рассылки MAX.
+
+Отвечает на POST .../sendMessage/... с задержкой --delay, доля --rate-limited ответов — 429
+с Retry-After, доля --errors — 502. Раз в секунду печатает число принятых сообщений.
+
+    python tools/green_api_stub.py --port 8081 --delay 300 --rate-limited 0.05
+
+Функцию рассылки направить на неё: GREEN_API_URL=http://127.0.0.1:8081
+
+Замеры (локально, PostgreSQL 16, --delay 300, 100 получателей, один вызов handler send_max):
+    прежний путь (запросы по очереди):              30.3 c, 3.3 сообщения/с; при --rate-limited 0.05 —
+                                                    3.1 сообщения/с и 5 из 100 потеряны (429 без повтора)
+    задание, MAX_WORKERS=8, MAX_RATE_PER_SECOND=10: 10.2 c, 9.8 сообщения/с (упирается в лимит частоты);
+                                                    при --rate-limited 0.05 — 14.3 c, 7.0 сообщения/с, доставлены все 100
+    задание, MAX_RATE_PER_SECOND=50:                4.0 c, 24.8 сообщения/с (упирается в 8 потоков × 300 мс)
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        time.sleep(self.server.delay)
+        roll = random.random()
+        if roll < self.server.rate_limited:
+            self.send_response(429)
+            self.send_header('Retry-After', '1')
+            self.end_headers()
+            return
+        if roll < self.server.rate_limited + self.server.errors:
+            self.send_response(502)
+            self.end_headers()
+            return
+        with self.server.lock:
+            self.server.accepted += 1
+        body = json.dumps({'idMessage': uuid.uuid4().hex}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(host, port, delay=0, rate_limited=0, errors=0):
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.delay = delay
+    server.rate_limited = rate_limited
+    server.errors = errors
+    server.accepted = 0
+    server.lock = threading.Lock()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Заглушка GREEN-API для нагрузочной проверки рассылки MAX')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--delay', type=float, default=0, help='задержка ответа, мс')
+    parser.add_argument('--rate-limited', type=float, default=0, help='доля ответов 429')
+    parser.add_argument('--errors', type=float, default=0, help='доля ответов 502')
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.delay / 1000, args.rate_limited, args.errors)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f'green-api-stub на {args.host}:{args.port}')
+
+    last = 0
+    try:
+        while True:
+            time.sleep(1)
+            total = server.accepted
+            print(f'сообщений: {total} (+{total - last}/с)')
+            last = total
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+"""Постановка заданий в очередь background_jobs, которую разбирает job-worker."""
+import json
+
+SCHEMA = 't_p30358746_hospital_website_red'
+
+# shared:background_jobs — копия tools/shared/background_jobs.py, правится там (python tools/sync_shared.py)
+def enqueue_job(conn, kind, payload, priority=0, dedupe_key=None):
+    """Поставить задание в background_jobs в текущей транзакции (коммитит вызывающий).
+    Пока задание с тем же dedupe_key ждёт или выполняется, возвращается его id."""
+    cur = conn.cursor()
+    for _ in range(2):
+        cur.execute(f'''
+            INSERT INTO "{SCHEMA}".background_jobs (kind, payload, priority, dedupe_key)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (dedupe_key) WHERE status IN ('queued', 'running') DO NOTHING
+            RETURNING id
+        ''', (kind, json.dumps(payload), priority, dedupe_key))
+        row = cur.fetchone()
+        if row is None:
+            cur.execute(f'''
+                SELECT id FROM "{SCHEMA}".background_jobs WHERE dedupe_key = %s AND status IN ('queued', 'running')
+            ''', (dedupe_key,))
+            row = cur.fetchone()
+        if row is not None:
+            break
+    cur.close()
+    return row[0]
+# end shared:background_jobs
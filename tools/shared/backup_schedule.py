@@ -0,0 +1,35 @@
+"""Расписание плановых резервных копий: окно и интервал из backup_settings.
+Используется функциями backup-cron (решает, ставить ли задание) и db-backup (перепроверяет под блокировкой)."""
+from datetime import time, timedelta
+
+# shared:backup_schedule — копия tools/shared/backup_schedule.py, правится там (python tools/sync_shared.py)
+def backup_due(settings, last_started, now):
+    """Пора ли запускать плановую копию и когда следующий запуск.
+    Окно start_time–end_time по МСК (может переходить через полночь); repeat_minutes — интервал
+    между запусками внутри окна, 0 — один запуск за окно. Возвращает (пора, время следующего запуска)."""
+    if not settings['enabled']:
+        return False, None
+    start = time(*map(int, settings['start_time'].split(':')))
+    end = time(*map(int, settings['end_time'].split(':')))
+    window_start = now.replace(hour=start.hour, minute=start.minute, second=0, microsecond=0)
+    window_end = now.replace(hour=end.hour, minute=end.minute, second=59, microsecond=0)
+    if window_end < window_start:
+        if now <= window_end:
+            window_start -= timedelta(days=1)
+        else:
+            window_end += timedelta(days=1)
+    if now > window_end:
+        window_start += timedelta(days=1)
+        window_end += timedelta(days=1)
+    if now < window_start:
+        return False, window_start
+    if last_started is None or last_started < window_start:
+        return True, now
+    if settings['repeat_minutes'] > 0:
+        next_run = last_started + timedelta(minutes=settings['repeat_minutes'])
+        if next_run <= now:
+            return True, now
+        if next_run <= window_end:
+            return False, next_run
+    return False, window_start + timedelta(days=1)
+# end shared:backup_schedule
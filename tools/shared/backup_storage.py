@@ -0,0 +1,48 @@
+"""Листинг и пакетное удаление архивов резервных копий в S3 (бакет files, префикс backups/).
+Используется функциями db-backup и backup-cleanup."""
+from concurrent.futures import ThreadPoolExecutor
+
+# shared:backup_storage — копия tools/shared/backup_storage.py, правится там (python tools/sync_shared.py)
+S3_DELETE_BATCH = 1000
+S3_DELETE_WORKERS = 8
+
+
+def list_backup_objects(s3, prefix='backups/'):
+    """Все объекты под префиксом одним проходом, сгруппированные по папке:
+    папка -> {'objects': [(ключ, размер)], 'last_modified': самое позднее изменение}"""
+    folders = {}
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket='files', Prefix=prefix):
+        for obj in page.get('Contents', []):
+            folder = folders.setdefault(obj['Key'].rsplit('/', 1)[0], {'objects': [], 'last_modified': None})
+            folder['objects'].append((obj['Key'], obj.get('Size', 0)))
+            modified = obj.get('LastModified')
+            if modified and (folder['last_modified'] is None or modified > folder['last_modified']):
+                folder['last_modified'] = modified
+    return folders
+
+
+def delete_s3_keys(s3, objects):
+    """Удалить объекты пачками по S3_DELETE_BATCH ключей (предел delete_objects), пачки — параллельно.
+    Возвращает (удалено объектов, освобождено байт, ошибок)."""
+    chunks = [objects[i:i + S3_DELETE_BATCH] for i in range(0, len(objects), S3_DELETE_BATCH)]
+
+    def delete_chunk(chunk):
+        try:
+            resp = s3.delete_objects(
+                Bucket='files',
+                Delete={'Objects': [{'Key': key} for key, _ in chunk], 'Quiet': True},
+            )
+        except Exception as e:
+            print(f'[s3 delete error] keys={len(chunk)} error={e}')
+            return 0, 0, len(chunk)
+        failed = {err['Key'] for err in resp.get('Errors', [])}
+        done = [(key, size) for key, size in chunk if key not in failed]
+        return len(done), sum(size for _, size in done), len(failed)
+
+    if not chunks:
+        return 0, 0, 0
+    with ThreadPoolExecutor(max_workers=min(S3_DELETE_WORKERS, len(chunks))) as pool:
+        results = list(pool.map(delete_chunk, chunks))
+    return tuple(sum(r[i] for r in results) for i in range(3))
+# end shared:backup_storage
@@ -0,0 +1,9 @@
+"""Нормализация телефона пациента для patient_phone_norm.
+Используется функциями appointments, kiosk, schedules (запись) и cancel-appointment (поиск записей по номеру)."""
+
+# shared:phone — копия tools/shared/phone.py, правится там (python tools/sync_shared.py)
+def normalize_phone(phone):
+    """Последние 10 цифр номера — значение patient_phone_norm, по которому ищутся записи пациента"""
+    digits = ''.join(filter(str.isdigit, phone or ''))
+    return digits[-10:] or None
+# end shared:phone
@@ -0,0 +1,77 @@
+"""
+Раскладка общих блоков кода по функциям backend/*/index.py.
+
+Платформа собирает и выкладывает каждую папку backend/<функция> отдельно: модуль рядом с одной
+функцией в сборку другой не попадает, поэтому общий импорт между функциями невозможен.
+Общий код (пул соединений, кэш ответов, постановка заданий и т.п.) хранится в одном экземпляре —
+tools/shared/<блок>.py, а в index.py функций лежат его копии между метками
+
+    # shared:<блок> — копия tools/shared/<блок>.py, ...
+    ...
+    # end shared:<блок>
+
+Блок правится только в tools/shared, затем копии переписываются:
+
+    python tools/sync_shared.py          # обновить копии в backend/*/index.py
+    python tools/sync_shared.py --check  # только проверить: код выхода 1, если копия разошлась
+
+--check запускается перед деплоем: разошедшаяся вручную копия — ошибка.
+"""
+import argparse
+import re
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+SHARED_DIR = ROOT / 'tools' / 'shared'
+BLOCK_RE = re.compile(r'^# shared:(?P<name>\w+) [^\n]*\n.*?^# end shared:(?P=name)\n', re.M | re.S)
+
+
+def canonical_blocks():
+    blocks = {}
+    for path in sorted(SHARED_DIR.glob('*.py')):
+        match = BLOCK_RE.search(path.read_text(encoding='utf-8'))
+        if match is None or match['name'] != path.stem:
+            sys.exit(f'{path.relative_to(ROOT)}: нет блока # shared:{path.stem} ... # end shared:{path.stem}')
+        blocks[path.stem] = match.group(0)
+    return blocks
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Разложить tools/shared/*.py по backend/*/index.py')
+    parser.add_argument('--check', action='store_true', help='не писать файлы, только найти расхождения')
+    args = parser.parse_args()
+
+    blocks = canonical_blocks()
+    usage = {name: 0 for name in blocks}
+    stale, unknown = [], []
+    for path in sorted((ROOT / 'backend').glob('*/index.py')):
+        text = path.read_text(encoding='utf-8')
+        rel = path.relative_to(ROOT)
+
+        def replace(match):
+            name = match['name']
+            if name not in blocks:
+                unknown.append(f'{rel}: {name}')
+                return match.group(0)
+            usage[name] += 1
+            if match.group(0) != blocks[name]:
+                stale.append(f'{rel}: {name}')
+            return blocks[name]
+
+        synced = BLOCK_RE.sub(replace, text)
+        if synced != text and not args.check:
+            path.write_text(synced, encoding='utf-8')
+
+    for name, count in usage.items():
+        print(f'{name}: копий в функциях — {count}')
+    for item in unknown:
+        print(f'неизвестный блок — {item}')
+    for item in stale:
+        print(f'{"расходится" if args.check else "обновлено"} — {item}')
+    if unknown or (args.check and stale):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()